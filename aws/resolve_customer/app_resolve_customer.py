@@ -1,5 +1,10 @@
 #!/usr/bin/python3
 from resolve_customer.app import lambda_handler as resolve_customer_lambda
+from resolve_customer.app import warmup_services
+from resolve_customer.prewarm import prewarm_on_init
+
+# runs in the lambda init phase if PREWARM_CLIENTS is set
+prewarm_on_init(warmup_services)
 
 
 def lambda_handler(event, context):
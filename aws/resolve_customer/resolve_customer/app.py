@@ -22,15 +22,27 @@ AWS Metering/Entitlement Marketplace API's
 import logging
 import json
 import base64
+import urllib.parse
 from typing import (
-    Dict, Union, List
+    Dict, Union, List, Mapping
 )
 
 from resolve_customer.error import (
     error_record, error_response
 )
-from resolve_customer.customer import AWSCustomer
+from resolve_customer.customer import (
+    AWSCustomer, hash_token, get_invalid_token_cache_stats
+)
+from resolve_customer.cache import TTLCache
 from resolve_customer.entitlements import AWSCustomerEntitlement
+from resolve_customer.metrics import metrics
+from resolve_customer.defaults import Defaults
+from resolve_customer.prewarm import (
+    is_warmup_event, warm_up
+)
+from resolve_customer.logs import (
+    configure_logging, log_payload
+)
 
 logger = logging.getLogger('resolve_customer')
 logger.setLevel("INFO")
@@ -38,6 +50,17 @@ logger.setLevel("INFO")
 # Topic name for this lambda
 topic = 'Registration'
 
+# Process wide cache of resolved customers per token hash,
+# see customer_cache config
+customer_cache = TTLCache()
+
+# Default number of seconds a resolved token is answered from
+# the customer_cache without asking AWS, 0 disables it
+DEFAULT_CUSTOMER_CACHE_TTL = 300
+
+# Services called by this lambda, pre-warmed and kept warm
+warmup_services = ('meteringmarketplace', 'marketplace-entitlement')
+
 
 def lambda_handler(event, context):
     """
@@ -72,17 +95,38 @@ def lambda_handler(event, context):
             ]
         }
     }
+
+    A warm-up event {"warmup": true} only refreshes the credentials,
+    clients and config and returns the report of prewarm.warm_up
     """
     try:
-        logger.info(f'EVENT: {event}')
-        logger.info(f'CONTEXT: {context}')
+        if is_warmup_event(event):
+            return json.dumps(
+                {
+                    'isBase64Encoded': False,
+                    'statusCode': 200,
+                    'body': warm_up(warmup_services)
+                }
+            )
+        config = get_tolerant_config()
+        configure_logging(config.get('log_format'))
+        logger.info(
+            'Request %s', getattr(context, 'aws_request_id', 'unknown')
+        )
         event_body = event['body']
         if event.get('isBase64Encoded'):
-            event_body = base64.b64decode(event_body)
+            event_body = base64.b64decode(event_body).decode()
+        log_payload(
+            logger, 'EVENT', dict(event, body=event_body),
+            config.get('log_sample_rate')
+        )
         event_body = json.loads(event_body)
-        return json.dumps(
-            process_event(event_body.get('registrationToken'))
+        response = process_event(event_body.get('registrationToken'))
+        logger.info(
+            'Customer cache: %s, invalid token cache: %s',
+            customer_cache.get_stats(), get_invalid_token_cache_stats()
         )
+        return json.dumps(response)
     except Exception as error:
         return json.dumps(
             error_response(
@@ -91,13 +135,27 @@ def lambda_handler(event, context):
                 ), topic
             )
         )
+    finally:
+        # emit the latency metrics of this invocation
+        metrics.flush()
+
+
+def get_tolerant_config() -> Mapping:
+    """
+    Return the config for the log and cache settings, a broken
+    config must not prevent logging
+    """
+    try:
+        return Defaults.get_assume_role_config()
+    except Exception:
+        return {}
 
 
 def process_event(
     token: str
 ) -> Dict[str, Union[str, int, Dict[str, Union[str, List]]]]:
     try:
-        customer = AWSCustomer(token)
+        customer = get_customer(token)
         if customer.error:
             return error_response(customer.error, topic)
         entitlements = AWSCustomerEntitlement(
@@ -105,6 +163,8 @@ def process_event(
         )
         if entitlements.error:
             return error_response(entitlements.error, topic)
+        # further entitlement pages are requested here
+        customer_entitlements = entitlements.get_entitlements()
     except Exception as oops:
         # Some unexpected exception happened, report as internal
         # server error including the message we got
@@ -121,6 +181,34 @@ def process_event(
             'marketplaceAccountId': customer.get_account_id(),
             'customerIdentifier': customer.get_id(),
             "productCode": customer.get_product_code(),
-            'entitlements': entitlements.get_entitlements()
+            'entitlements': customer_entitlements
         }
     }
+
+
+def get_customer(token: str) -> AWSCustomer:
+    """
+    Return the AWSCustomer of the token. A resolved customer is
+    answered from the customer_cache for customer_cache.ttl seconds,
+    default 300, such that repeated resolves of the same token skip
+    the region loop. The entitlements are not part of the cache
+    """
+    cache_config: Mapping = get_tolerant_config().get('customer_cache') or {}
+    ttl = cache_config.get('ttl', DEFAULT_CUSTOMER_CACHE_TTL)
+    if not token or not ttl:
+        return AWSCustomer(token)
+    customer_cache.configure(ttl, cache_config.get('size') or 1024)
+    key = hash_token(urllib.parse.unquote(token))
+    customer = customer_cache.get(key)
+    if customer is not None:
+        return AWSCustomer.from_customer(customer)
+    aws_customer = AWSCustomer(token)
+    if not aws_customer.error:
+        customer_cache.put(
+            key, {
+                'CustomerIdentifier': aws_customer.get_id(),
+                'CustomerAWSAccountId': aws_customer.get_account_id(),
+                'ProductCode': aws_customer.get_product_code()
+            }
+        )
+    return aws_customer
@@ -15,21 +15,89 @@
 # You should have received a copy of the GNU General Public License
 # along with mash.  If not, see <http://www.gnu.org/licenses/>
 #
-import boto3
+import threading
+from datetime import (
+    datetime, timedelta, timezone
+)
+from typing import (
+    Dict, Optional, Tuple
+)
+
+from resolve_customer.client import get_client
+from resolve_customer.metrics import metrics
+
+# Number of seconds before the expiration of the credentials
+# at which they are considered stale and get refreshed from STS
+DEFAULT_EXPIRY_MARGIN = 300
 
 
 class AWSAssumeRole:
     """
     Get access tokens from the token service through the
     assumed role arn of the marketplace account
+
+    The credentials are cached process wide per role_arn and
+    session_name and are reused until expiry_margin seconds
+    before their expiration date. Concurrent callers for the
+    same role share one in-flight STS request.
     """
-    def __init__(self, role_arn, session_name):
-        self.role_response = {}
-        sts_client = boto3.client('sts')
-        self.role_response = sts_client.assume_role(
-            RoleArn=role_arn,
-            RoleSessionName=session_name
-        )
+    _cache: Dict[Tuple[str, str], Dict] = {}
+    _cache_lock = threading.Lock()
+    _refresh_locks: Dict[Tuple[str, str], threading.Lock] = {}
+
+    def __init__(
+        self, role_arn, session_name,
+        expiry_margin: int = DEFAULT_EXPIRY_MARGIN,
+        client_config: Optional[Dict] = None
+    ):
+        key = (role_arn, session_name)
+        self.role_response = AWSAssumeRole._cache.get(key) or {}
+        if not AWSAssumeRole.is_valid(self.role_response, expiry_margin):
+            with AWSAssumeRole.__get_refresh_lock(key):
+                # another caller might have refreshed the credentials
+                # while we were waiting for the lock
+                self.role_response = AWSAssumeRole._cache.get(key) or {}
+                if not AWSAssumeRole.is_valid(
+                    self.role_response, expiry_margin
+                ):
+                    sts_client = get_client(
+                        'sts', client_config=client_config
+                    )
+                    with metrics.timer('AssumeRole'):
+                        self.role_response = sts_client.assume_role(
+                            RoleArn=role_arn,
+                            RoleSessionName=session_name
+                        )
+                    AWSAssumeRole._cache[key] = self.role_response
+
+    @staticmethod
+    def is_valid(role_response: Dict, expiry_margin: int) -> bool:
+        """
+        Check if the credentials of the given assume_role response
+        are still valid for at least expiry_margin seconds
+        """
+        credentials = role_response.get('Credentials') or {}
+        expiration = credentials.get('Expiration')
+        if isinstance(expiration, str):
+            try:
+                expiration = datetime.fromisoformat(expiration)
+            except ValueError:
+                return False
+        if not isinstance(expiration, datetime):
+            return False
+        if expiration.tzinfo is None:
+            expiration = expiration.replace(tzinfo=timezone.utc)
+        return expiration - timedelta(seconds=expiry_margin) > \
+            datetime.now(timezone.utc)
+
+    @staticmethod
+    def clear_cache() -> None:
+        """
+        Drop all cached credentials
+        """
+        with AWSAssumeRole._cache_lock:
+            AWSAssumeRole._cache.clear()
+            AWSAssumeRole._refresh_locks.clear()
 
     def get_access_key(self) -> str:
         return self.__get('AccessKeyId')
@@ -43,6 +111,13 @@ class AWSAssumeRole:
     def get_expiration_date(self) -> str:
         return self.__get('Expiration')
 
+    @staticmethod
+    def __get_refresh_lock(key: Tuple[str, str]) -> threading.Lock:
+        with AWSAssumeRole._cache_lock:
+            return AWSAssumeRole._refresh_locks.setdefault(
+                key, threading.Lock()
+            )
+
     def __get(self, key) -> str:
         result = ''
         if self.role_response.get('Credentials'):
@@ -0,0 +1,93 @@
+# Copyright (c) 2025 SUSE LLC.  All rights reserved.
+#
+# This file is part of suse-saas-tools
+#
+# suse-saas-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mash is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mash.  If not, see <http://www.gnu.org/licenses/>
+#
+import threading
+import time
+from collections import OrderedDict
+from typing import (
+    Any, Dict, Hashable, Optional
+)
+
+
+class TTLCache:
+    """
+    Thread safe least recently used cache with a time to live
+
+    Entries expire ttl seconds after they were stored. If more
+    than maxsize entries are stored, the least recently used
+    entry is dropped. Hits and misses are counted for sizing
+    the cache.
+    """
+    def __init__(self, ttl: float = 0, maxsize: int = 1024):
+        self.lock = threading.Lock()
+        self.entries: OrderedDict = OrderedDict()
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, ttl: float, maxsize: int) -> None:
+        with self.lock:
+            self.ttl = ttl
+            self.maxsize = maxsize
+            self.__evict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Return the value for key or None if the key is not
+        cached or expired
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            self.__evict()
+
+    def invalidate(self, key: Hashable) -> None:
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self) -> Dict[str, float]:
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl
+            }
+
+    def __evict(self) -> None:
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
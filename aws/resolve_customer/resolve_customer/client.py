@@ -0,0 +1,112 @@
+# Copyright (c) 2025 SUSE LLC.  All rights reserved.
+#
+# This file is part of suse-saas-tools
+#
+# suse-saas-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mash is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mash.  If not, see <http://www.gnu.org/licenses/>
+#
+import threading
+from collections import OrderedDict
+from typing import (
+    Dict, Mapping, Optional, Tuple
+)
+
+from resolve_customer.config import thaw
+
+# Maximum number of clients kept in the registry. Clients bound
+# to credentials that got rotated are no longer requested and
+# drop out of the registry as least recently used entries
+MAX_CLIENTS = 64
+
+_clients: OrderedDict = OrderedDict()
+_clients_lock = threading.Lock()
+
+
+def get_client(
+    service_name: str, region_name: Optional[str] = None,
+    assume_role=None, client_config: Optional[Mapping] = None,
+    endpoint_url: Optional[str] = None
+):
+    """
+    Return a boto3 client for the given service and region
+
+    Clients are kept in a process wide registry keyed by service,
+    region, client_config, endpoint_url and the identity of the
+    credentials from the given AWSAssumeRole instance, such that
+    warm invocations reuse the client including its HTTPS connection
+    pool. A new client is created when the credentials rotate or
+    the client_config changes. The optional client_config mapping
+    is passed as botocore.config.Config options, e.g.
+    max_pool_connections, connect_timeout, read_timeout or retries.
+    A frozen config snapshot is copied to plain dicts first, as
+    botocore modifies e.g. the retries options. The optional
+    endpoint_url points the client to e.g. a local stand-in of
+    the service
+    """
+    credentials: Dict[str, str] = {}
+    endpoint: Dict[str, str] = {}
+    if endpoint_url:
+        endpoint['endpoint_url'] = endpoint_url
+    if assume_role:
+        credentials = {
+            'aws_access_key_id': assume_role.get_access_key(),
+            'aws_secret_access_key': assume_role.get_secret_access_key(),
+            'aws_session_token': assume_role.get_session_token()
+        }
+    key: Tuple = (
+        service_name, region_name,
+        credentials.get('aws_access_key_id') or '', endpoint_url or '',
+        get_config_key(client_config or {})
+    )
+    # boto3 client creation from the default session is not thread
+    # safe, thus clients are created while holding the lock
+    with _clients_lock:
+        client = _clients.get(key)
+        if client:
+            _clients.move_to_end(key)
+        else:
+            # boto3 is imported on first use to keep it out of the
+            # cold start of code paths that never create a client
+            import boto3
+            from botocore.config import Config
+            client = boto3.client(
+                service_name,
+                region_name=region_name,
+                config=Config(**thaw(client_config or {})),
+                **credentials, **endpoint
+            )
+            _clients[key] = client
+            while len(_clients) > MAX_CLIENTS:
+                _clients.popitem(last=False)
+    return client
+
+
+def get_config_key(data):
+    """
+    Return a hashable form of the given client_config
+    """
+    if isinstance(data, Mapping):
+        return tuple(
+            sorted((key, get_config_key(value)) for key, value in data.items())
+        )
+    if isinstance(data, (list, tuple)):
+        return tuple(get_config_key(value) for value in data)
+    return data
+
+
+def clear_clients() -> None:
+    """
+    Drop all clients from the registry
+    """
+    with _clients_lock:
+        _clients.clear()
@@ -0,0 +1,103 @@
+# Copyright (c) 2025 SUSE LLC.  All rights reserved.
+#
+# This file is part of suse-saas-tools
+#
+# suse-saas-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mash is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mash.  If not, see <http://www.gnu.org/licenses/>
+#
+import os
+import threading
+from types import MappingProxyType
+from typing import (
+    Any, Callable, Dict, Mapping, Optional, Tuple
+)
+
+_snapshots: Dict[str, Tuple[Tuple, Mapping]] = {}
+_snapshots_lock = threading.Lock()
+
+
+def load_config(
+    config_file: str, environment: str = '',
+    validate: Optional[Callable[[Dict], None]] = None
+) -> Mapping:
+    """
+    Return an immutable snapshot of the given YAML config file
+
+    The file is parsed once per process and only parsed again
+    if its inode, mtime or size changes. If the environment
+    variable named by environment is set, its value is used as
+    the YAML config content and the file is not read at all.
+    The optional validate callable is called with the parsed
+    data before the snapshot is stored and is expected to raise
+    on invalid content.
+    """
+    content = os.environ.get(environment) if environment else None
+    if content is not None:
+        key = f'env:{environment}'
+        signature: Tuple = (content,)
+    else:
+        key = config_file
+        stat = os.stat(config_file)
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _snapshots_lock:
+        cached = _snapshots.get(key)
+        if cached and cached[0] == signature:
+            return cached[1]
+        if content is None:
+            with open(config_file) as config:
+                content = config.read()
+        # imported on first parse, warm invocations hit the snapshot
+        import yaml
+        data = yaml.safe_load(content) or {}
+        if not isinstance(data, dict):
+            raise ValueError(
+                f'Invalid config {key}: expected mapping, got {type(data).__name__}'
+            )
+        if validate:
+            validate(data)
+        snapshot = freeze(data)
+        _snapshots[key] = (signature, snapshot)
+    return snapshot
+
+
+def freeze(data: Any) -> Any:
+    """
+    Return a read-only copy of the given config data
+    """
+    if isinstance(data, dict):
+        return MappingProxyType(
+            {key: freeze(value) for key, value in data.items()}
+        )
+    if isinstance(data, list):
+        return tuple(freeze(value) for value in data)
+    return data
+
+
+def thaw(data: Any) -> Any:
+    """
+    Return a mutable copy of the given frozen config data, e.g.
+    for libraries such as botocore that modify the passed options
+    """
+    if isinstance(data, Mapping):
+        return {key: thaw(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [thaw(value) for value in data]
+    return data
+
+
+def clear_config_cache() -> None:
+    """
+    Drop all config snapshots
+    """
+    with _snapshots_lock:
+        _snapshots.clear()
@@ -15,81 +15,97 @@
 # You should have received a copy of the GNU General Public License
 # along with mash.  If not, see <http://www.gnu.org/licenses/>
 #
-import boto3
+import copy
+import hashlib
+import time
 import urllib.parse
+from concurrent.futures import (
+    ThreadPoolExecutor, as_completed
+)
 from botocore.exceptions import ClientError
 from resolve_customer.defaults import Defaults
-from resolve_customer.assume_role import AWSAssumeRole
+from resolve_customer.client import get_client
+from resolve_customer.region_stats import region_stats
+from resolve_customer.cache import TTLCache
+from resolve_customer.metrics import metrics
+from resolve_customer.logs import REDACTED
+from resolve_customer.assume_role import (
+    AWSAssumeRole, DEFAULT_EXPIRY_MARGIN
+)
 from resolve_customer.error import (
     error_record, log_error, classify_error,
     error_code_matches, set_message, get_message
 )
 from typing import (
-    Dict, List
+    Dict, List, Mapping
 )
 
 
+# Process wide cache of the classified errors of invalid and
+# expired tokens per token hash, see invalid_token_cache config
+invalid_token_cache = TTLCache()
+
+# Default number of seconds a rejected token is answered from
+# the invalid_token_cache without asking AWS, 0 disables it
+DEFAULT_INVALID_TOKEN_TTL = 60
+
+# AWS error codes of tokens that are rejected again when retried
+invalid_token_codes = ('InvalidTokenException', 'ExpiredTokenException')
+
+
 class AWSCustomer:
     """
     Get AWS customer ID information from a marketplace token
+
+    The regions from the role config are tried one after the
+    other, in the order learned from previous outcomes, see
+    RegionStats. If concurrent_regions is set
+    in the config, all regions are tried at the same time on a
+    thread pool of at most region_workers threads and the first
+    successful result is used.
+
+    A token rejected as invalid or expired by all regions is
+    answered with the same error from a process wide cache for
+    invalid_token_cache.ttl seconds, default 60, without asking AWS.
+    The cache keeps the token hash and the error without the token
     """
     def __init__(self, urlEncodedtoken: str):
-        self.customer = {}
+        self.customer: Dict = {}
         self.error: Dict = {}
         self.error_list: List[Dict] = []
+        self.rejected_regions = 0
         config = Defaults.get_assume_role_config()
         role: Dict[str, Dict[str, str]] = config.get('role') or {}
         if urlEncodedtoken and role:
             token = urllib.parse.unquote(urlEncodedtoken)
-            for region in sorted(role.keys()):
-                try:
-                    assume_role = AWSAssumeRole(
-                        role[region]['arn'], role[region]['session']
-                    )
-                    marketplace = boto3.client(
-                        'meteringmarketplace',
-                        region_name=region,
-                        aws_access_key_id=assume_role.get_access_key(),
-                        aws_secret_access_key=assume_role.get_secret_access_key(),
-                        aws_session_token=assume_role.get_session_token()
-                    )
-                    self.customer = marketplace.resolve_customer(
-                        RegistrationToken=token
+            cache_config: Mapping = config.get('invalid_token_cache') or {}
+            ttl = cache_config.get('ttl', DEFAULT_INVALID_TOKEN_TTL)
+            if ttl:
+                invalid_token_cache.configure(
+                    ttl, cache_config.get('size') or 1024
+                )
+                cached_error = invalid_token_cache.get(hash_token(token))
+                if cached_error is not None:
+                    # the cached error does not keep the token
+                    self.error = set_message(
+                        copy.deepcopy(cached_error),
+                        get_message(cached_error).replace(REDACTED, token)
                     )
-                    # success, clear all errors that happened so far
-                    # and return from the constructor in this state
-                    self.error = {}
-                    self.error_list = []
+                    log_error(cached_error)
                     return
-                except ClientError as error:
-                    self.error = error.response
-                    if error_code_matches(self.error, 'InvalidTokenException'):
-                        # for invalid tokens, place the token to the error message
-                        self.error = set_message(
-                            self.error, f'{get_message(self.error)}: {token}'
-                        )
-                    # Classify group of errors into app exception and HTTP code
-                    self.error = classify_error(
-                        self.error, 'ExpiredTokenException',
-                        400, 'App.Error.TokenException'
-                    )
-                    self.error = classify_error(
-                        self.error, 'InvalidTokenException',
-                        400, 'App.Error.TokenException'
-                    )
-                    self.error = classify_error(
-                        self.error, 'ThrottlingException',
-                        400, 'App.Error.TokenException'
-                    )
-                    self.error = classify_error(
-                        self.error, 'DisabledApiException',
-                        400, 'App.Error.TokenException'
-                    )
-                    self.error_list.append(self.error)
-
-            # All attempts failed, log errors
+            region_stats.set_stats_file(config.get('region_stats_file') or '')
+            if config.get('concurrent_regions'):
+                self.__resolve_concurrent(token, config)
+            else:
+                self.__resolve_serial(token, config)
+            if ttl and self.error and \
+                    self.rejected_regions == len(self.error_list):
+                invalid_token_cache.put(
+                    hash_token(token), redact_token(self.error, token)
+                )
+            # In case all attempts failed, log errors
             for issue in self.error_list:
-                log_error(issue)
+                log_error(redact_token(issue, token))
         else:
             if not urlEncodedtoken:
                 self.error = error_record(
@@ -103,6 +119,19 @@ class AWSCustomer:
                 )
             log_error(self.error)
 
+    @classmethod
+    def from_customer(cls, customer: Dict) -> 'AWSCustomer':
+        """
+        Create instance from an already resolved customer,
+        e.g. as cached by the resolve_customer app
+        """
+        aws_customer = cls.__new__(cls)
+        aws_customer.customer = dict(customer)
+        aws_customer.error = {}
+        aws_customer.error_list = []
+        aws_customer.rejected_regions = 0
+        return aws_customer
+
     def get_id(self) -> str:
         return self.__get('CustomerIdentifier')
 
@@ -112,5 +141,129 @@ class AWSCustomer:
     def get_product_code(self) -> str:
         return self.__get('ProductCode')
 
+    def __resolve_serial(self, token: str, config: Mapping) -> None:
+        regions = region_stats.order(config['role'].keys())
+        for region in regions:
+            try:
+                self.customer = self.__resolve(token, region, config)
+                region_stats.record_lookup(region == regions[0])
+                # success, clear all errors that happened so far
+                # and return in this state
+                self.error = {}
+                self.error_list = []
+                return
+            except ClientError as error:
+                self.error = self.__classify(error.response, token)
+                self.error_list.append(self.error)
+        region_stats.record_lookup(False)
+
+    def __resolve_concurrent(self, token: str, config: Mapping) -> None:
+        regions = region_stats.order(config['role'].keys())
+        errors: Dict[str, Dict] = {}
+        executor = ThreadPoolExecutor(
+            max_workers=min(
+                len(regions), config.get('region_workers') or len(regions)
+            )
+        )
+        futures = {
+            executor.submit(self.__resolve, token, region, config): region
+            for region in regions
+        }
+        try:
+            for future in as_completed(futures):
+                try:
+                    self.customer = future.result()
+                    region_stats.record_lookup(futures[future] == regions[0])
+                    # success, ignore all other attempts
+                    self.error = {}
+                    self.error_list = []
+                    return
+                except ClientError as error:
+                    errors[futures[future]] = self.__classify(
+                        error.response, token
+                    )
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        region_stats.record_lookup(False)
+        # report errors in the same order as the serial resolution
+        self.error_list = [errors[region] for region in regions]
+        self.error = self.error_list[-1]
+
+    @staticmethod
+    def __resolve(token: str, region: str, config: Mapping) -> Dict:
+        role: Dict[str, str] = config['role'][region]
+        client_config: Dict = config.get('client_config') or {}
+        assume_role = AWSAssumeRole(
+            role['arn'], role['session'],
+            config.get('credentials_expiry_margin', DEFAULT_EXPIRY_MARGIN),
+            client_config
+        )
+        marketplace = get_client(
+            'meteringmarketplace', region, assume_role, client_config
+        )
+        start = time.monotonic()
+        try:
+            with metrics.timer('ResolveCustomer', region):
+                customer = marketplace.resolve_customer(
+                    RegistrationToken=token
+                )
+        except ClientError:
+            region_stats.record(region, time.monotonic() - start, False)
+            raise
+        region_stats.record(
+            region, time.monotonic() - start, True,
+            ('', customer.get('ProductCode'))
+        )
+        return customer
+
+    def __classify(self, error: Dict, token: str) -> Dict:
+        if error['Error']['Code'] in invalid_token_codes:
+            self.rejected_regions += 1
+        if error_code_matches(error, 'InvalidTokenException'):
+            # for invalid tokens, place the token to the error message
+            error = set_message(
+                error, f'{get_message(error)}: {token}'
+            )
+        # Classify group of errors into app exception and HTTP code
+        error = classify_error(
+            error, 'ExpiredTokenException',
+            400, 'App.Error.TokenException'
+        )
+        error = classify_error(
+            error, 'InvalidTokenException',
+            400, 'App.Error.TokenException'
+        )
+        error = classify_error(
+            error, 'ThrottlingException',
+            400, 'App.Error.TokenException'
+        )
+        error = classify_error(
+            error, 'DisabledApiException',
+            400, 'App.Error.TokenException'
+        )
+        return error
+
     def __get(self, key) -> str:
         return self.customer[key] if self.customer else ''
+
+
+def redact_token(error: Dict, token: str) -> Dict:
+    """
+    Return a copy of error with the token in its message
+    replaced, such that the token does not show up in logs
+    """
+    return set_message(
+        copy.deepcopy(error), get_message(error).replace(token, REDACTED)
+    )
+
+
+def hash_token(token: str) -> str:
+    """
+    Return the cache key of the unquoted token, the token
+    itself is not kept
+    """
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def get_invalid_token_cache_stats() -> Dict[str, float]:
+    return invalid_token_cache.get_stats()
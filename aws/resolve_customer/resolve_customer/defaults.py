@@ -15,14 +15,33 @@
 # You should have received a copy of the GNU General Public License
 # along with mash.  If not, see <http://www.gnu.org/licenses/>
 #
-import yaml
-from typing import Dict
+from typing import (
+    Dict, Mapping
+)
+
+from resolve_customer.config import load_config
 
 
 class Defaults:
     @staticmethod
     def get_assume_role_config(
         config_file: str = '/etc/assume_role.yml'
-    ) -> Dict[str, Dict[str, Dict[str, str]]]:
-        with open(config_file) as config:
-            return yaml.safe_load(config)
+    ) -> Mapping:
+        """
+        Return the cached assume role config. The content of the
+        ASSUME_ROLE_CONFIG environment variable takes precedence
+        over the config file
+        """
+        return load_config(
+            config_file, 'ASSUME_ROLE_CONFIG',
+            Defaults.validate_assume_role_config
+        )
+
+    @staticmethod
+    def validate_assume_role_config(config: Dict) -> None:
+        for region, role in (config.get('role') or {}).items():
+            if not isinstance(role, dict) or \
+               not role.get('arn') or not role.get('session'):
+                raise ValueError(
+                    f'Invalid role config for {region}: arn and session required'
+                )
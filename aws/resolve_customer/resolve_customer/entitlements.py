@@ -16,108 +16,384 @@
 # along with mash.  If not, see <http://www.gnu.org/licenses/>
 #
 import logging
-import boto3
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
 from resolve_customer.defaults import Defaults
-from resolve_customer.assume_role import AWSAssumeRole
+from resolve_customer.client import get_client
+from resolve_customer.region_stats import region_stats
+from resolve_customer.cache import TTLCache
+from resolve_customer.metrics import metrics
+from resolve_customer.assume_role import (
+    AWSAssumeRole, DEFAULT_EXPIRY_MARGIN
+)
 from resolve_customer.error import (
-    error_record, log_error, classify_error
+    error_record, log_error, classify_error, PERMANENT, TRANSIENT
 )
 from typing import (
-    List, Dict
+    List, Dict, Iterable, Iterator, Mapping, Optional
 )
 
 logger = logging.getLogger('marketplace_entitlement')
 logger.setLevel('INFO')
 
+# Process wide cache of normalized entitlements per
+# (customer_id, product_code), see entitlement_cache config
+entitlement_cache = TTLCache()
+
+# Default number of customers per GetEntitlements request
+# of AWSProductEntitlements, see entitlement_filter_size config
+DEFAULT_ENTITLEMENT_FILTER_SIZE = 25
+
 
 class AWSCustomerEntitlement:
     """
     Get AWS customer entitlements for given customer ID and product code
+
+    The constructor requests the first page of entitlements, further
+    pages are requested while iterating over iter_entitlements.
+    If entitlement_cache.ttl is set in the config, the normalized
+    entitlements are served from and stored to a process wide cache
     """
     def __init__(self, customer_id: str, product_code: str):
         self.entitlements = {}
+        self.cached_entitlements: Optional[List[dict]] = None
+        self.marketplace = None
+        self.request: Dict = {}
+        self.region = ''
         self.error: Dict = {}
         self.error_list: List[Dict] = []
         config = Defaults.get_assume_role_config()
         role: Dict[str, Dict[str, str]] = config.get('role') or {}
         if customer_id and product_code and role:
-            logger.info(
-                'requesting entitlements for customer {} and product {}'.format(
-                    customer_id, product_code
+            cached = configure_entitlement_cache(config)
+            if cached:
+                self.cached_entitlements = entitlement_cache.get(
+                    (customer_id, product_code)
                 )
+                if self.cached_entitlements is not None:
+                    return
+            logger.info(
+                'requesting entitlements for customer %s and product %s',
+                customer_id, product_code
             )
-            for region in sorted(role.keys()):
+            region_stats.set_stats_file(config.get('region_stats_file') or '')
+            regions = region_stats.order(role.keys(), product_code)
+            for region in regions:
                 try:
-                    assume_role = AWSAssumeRole(
-                        role[region]['arn'], role[region]['session']
-                    )
-                    marketplace = boto3.client(
-                        'marketplace-entitlement',
-                        region_name='us-east-1',
-                        aws_access_key_id=assume_role.get_access_key(),
-                        aws_secret_access_key=assume_role.get_secret_access_key(),
-                        aws_session_token=assume_role.get_session_token()
-                    )
-                    self.entitlements = marketplace.get_entitlements(
-                        ProductCode=product_code,
-                        Filter={'CUSTOMER_IDENTIFIER': [customer_id]}
+                    self.marketplace = get_entitlement_client(config, region)
+                    self.request = {
+                        'ProductCode': product_code,
+                        'Filter': {'CUSTOMER_IDENTIFIER': [customer_id]}
+                    }
+                    self.region = region
+                    self.entitlements = get_entitlements_page(
+                        self.marketplace, self.request, region
                     )
+                    # the entitlement API is served from us-east-1 for
+                    # all roles, its latency says nothing about region
+                    region_stats.record_success(region, (product_code,))
+                    region_stats.record_lookup(region == regions[0])
+                    if cached:
+                        # all pages are needed for the cache
+                        self.cached_entitlements = self.get_entitlements()
+                        entitlement_cache.put(
+                            (customer_id, product_code),
+                            self.cached_entitlements
+                        )
                     # success, clear all errors that happened so far
                     # and return from the constructor in this state
                     self.error = {}
                     self.error_list = []
                     return
                 except ClientError as error:
-                    self.error = error.response
-                    # Classify group of errors into app exception and HTTP code
-                    self.error = classify_error(
-                        self.error, 'InvalidParameterException',
-                        400, 'App.Error.EntitlementException'
-                    )
-                    self.error = classify_error(
-                        self.error, 'ThrottlingException',
-                        400, 'App.Error.EntitlementException'
-                    )
+                    self.error = classify_entitlement_error(error.response)
                     self.error_list.append(self.error)
 
+            region_stats.record_lookup(False)
             # All attempts failed, log errors
             for issue in self.error_list:
                 log_error(issue)
+        elif not role:
+            # a deployment problem, the message is retried once fixed
+            self.error = error_record(
+                500, 'no role provided',
+                'InternalServiceErrorException', TRANSIENT
+            )
+            log_error(self.error)
         else:
             self.error = error_record(
-                500, 'no customer_id/product_code and/or role provided',
-                'InternalServiceErrorException'
+                500, 'no customer_id/product_code provided',
+                'InternalServiceErrorException', PERMANENT
             )
             log_error(self.error)
 
+    @classmethod
+    def from_entitlements(
+        cls, customer_id: str, product_code: str, entitlements: List[dict]
+    ) -> 'AWSCustomerEntitlement':
+        """
+        Create instance from already normalized entitlements,
+        e.g. as fetched by AWSProductEntitlements
+        """
+        customer_entitlement = cls.__new__(cls)
+        customer_entitlement.entitlements = {}
+        customer_entitlement.cached_entitlements = entitlements
+        customer_entitlement.marketplace = None
+        customer_entitlement.request = {}
+        customer_entitlement.region = ''
+        customer_entitlement.error = {}
+        customer_entitlement.error_list = []
+        return customer_entitlement
+
+    def iter_entitlements(self, prefetch: bool = True) -> Iterator[dict]:
+        """
+        Yield the normalized entitlements one at a time, following
+        NextToken lazily. With prefetch, the next page is requested
+        while the current page is consumed. A failing page request
+        raises ClientError rather than dropping entitlements
+        """
+        if self.cached_entitlements is not None:
+            yield from self.cached_entitlements
+            return
+        for page in iter_entitlement_pages(
+            self.marketplace, self.request, self.entitlements or {},
+            prefetch, self.region
+        ):
+            for entitlement in page.get('Entitlements') or []:
+                yield normalize_entitlement(entitlement)
+
     def get_entitlements(self) -> List[dict]:
-        result_entitlements: List = []
-        if self.entitlements:
-            entitlements = self.entitlements.get('Entitlements') or []
-            for entitlement in entitlements:
-                result_entitlements.append(
-                    {
-                        'expirationDate': format(
-                            entitlement.get('ExpirationDate')
-                        ),
-                        'dimension': entitlement.get(
-                            'Dimension'
-                        ),
-                        'value': {
-                            'booleanValue': bool(
-                                entitlement['Value'].get('BooleanValue')
-                            ),
-                            'doubleValue': float(
-                                entitlement['Value'].get('DoubleValue') or 0
-                            ),
-                            'integerValue': int(
-                                entitlement['Value'].get('IntegerValue') or 0
-                            ),
-                            'stringValue': format(
-                                entitlement['Value'].get('StringValue') or ''
-                            )
-                        }
+        return list(self.iter_entitlements())
+
+
+class AWSProductEntitlements:
+    """
+    Get AWS customer entitlements for many customers of one product code
+
+    Customers are requested with as few GetEntitlements calls as
+    possible, entitlement_filter_size customers per call, following
+    NextToken pagination. The result is split per customer in the
+    same normalized form as AWSCustomerEntitlement.get_entitlements.
+    With the entitlement_cache enabled, cached customers are served
+    from the cache and only the others are requested
+    """
+    def __init__(self, product_code: str, customer_ids: Iterable[str]):
+        self.customer_entitlements: Dict[str, List[dict]] = {}
+        self.error: Dict = {}
+        self.error_list: List[Dict] = []
+        config = Defaults.get_assume_role_config()
+        role: Dict[str, Dict[str, str]] = config.get('role') or {}
+        customers = list(dict.fromkeys(filter(None, customer_ids)))
+        filter_size: int = config.get('entitlement_filter_size') or \
+            DEFAULT_ENTITLEMENT_FILTER_SIZE
+        if product_code and customers and role:
+            cached = configure_entitlement_cache(config)
+            cached_entitlements: Dict[str, List[dict]] = {}
+            if cached:
+                for customer_id in customers:
+                    entitlements = entitlement_cache.get(
+                        (customer_id, product_code)
+                    )
+                    if entitlements is not None:
+                        cached_entitlements[customer_id] = entitlements
+                customers = [
+                    customer_id for customer_id in customers
+                    if customer_id not in cached_entitlements
+                ]
+                if not customers:
+                    self.customer_entitlements = cached_entitlements
+                    return
+            logger.info(
+                'requesting entitlements for %d customers and product %s',
+                len(customers), product_code
+            )
+            region_stats.set_stats_file(config.get('region_stats_file') or '')
+            regions = region_stats.order(role.keys(), product_code)
+            for region in regions:
+                try:
+                    marketplace = get_entitlement_client(config, region)
+                    customer_entitlements: Dict[str, List[dict]] = {
+                        customer_id: [] for customer_id in customers
                     }
-                )
-        return result_entitlements
+                    for offset in range(0, len(customers), filter_size):
+                        request = {
+                            'ProductCode': product_code,
+                            'Filter': {
+                                'CUSTOMER_IDENTIFIER':
+                                    customers[offset:offset + filter_size]
+                            }
+                        }
+                        for response in iter_entitlement_pages(
+                            marketplace, request,
+                            get_entitlements_page(
+                                marketplace, request, region
+                            ), region=region
+                        ):
+                            for entitlement in response.get(
+                                'Entitlements'
+                            ) or []:
+                                customer_entitlements.setdefault(
+                                    entitlement.get('CustomerIdentifier'), []
+                                ).append(normalize_entitlement(entitlement))
+                    region_stats.record_success(region, (product_code,))
+                    region_stats.record_lookup(region == regions[0])
+                    if cached:
+                        for customer_id, entitlements in \
+                                customer_entitlements.items():
+                            entitlement_cache.put(
+                                (customer_id, product_code), entitlements
+                            )
+                    customer_entitlements.update(cached_entitlements)
+                    self.customer_entitlements = customer_entitlements
+                    # success, clear all errors that happened so far
+                    # and return from the constructor in this state
+                    self.error = {}
+                    self.error_list = []
+                    return
+                except ClientError as error:
+                    self.error = classify_entitlement_error(error.response)
+                    self.error_list.append(self.error)
+
+            region_stats.record_lookup(False)
+            # All attempts failed, log errors
+            for issue in self.error_list:
+                log_error(issue)
+        elif not role:
+            self.error = error_record(
+                500, 'no role provided',
+                'InternalServiceErrorException', TRANSIENT
+            )
+            log_error(self.error)
+        else:
+            self.error = error_record(
+                500, 'no customer_ids/product_code provided',
+                'InternalServiceErrorException', PERMANENT
+            )
+            log_error(self.error)
+
+    def get_entitlements(self, customer_id: str) -> List[dict]:
+        return list(self.customer_entitlements.get(customer_id) or [])
+
+    def get_customer_entitlements(self) -> Dict[str, List[dict]]:
+        return dict(self.customer_entitlements)
+
+
+def configure_entitlement_cache(config: Mapping) -> bool:
+    """
+    Configure the entitlement_cache from the entitlement_cache
+    section of config and return whether it is enabled
+    """
+    cache_config: Mapping = config.get('entitlement_cache') or {}
+    if not cache_config.get('ttl'):
+        return False
+    entitlement_cache.configure(
+        cache_config['ttl'], cache_config.get('size') or 1024
+    )
+    return True
+
+
+def get_entitlement_client(config: Mapping, region: str):
+    """
+    Return marketplace-entitlement client for the role of the
+    given region. The entitlement API is only served in us-east-1
+    """
+    role: Dict[str, str] = config['role'][region]
+    client_config: Dict = config.get('client_config') or {}
+    assume_role = AWSAssumeRole(
+        role['arn'], role['session'],
+        config.get('credentials_expiry_margin', DEFAULT_EXPIRY_MARGIN),
+        client_config
+    )
+    return get_client(
+        'marketplace-entitlement', 'us-east-1', assume_role, client_config
+    )
+
+
+def get_entitlements_page(
+    marketplace, request: Dict, region: str = ''
+) -> Dict:
+    """
+    Request one page of entitlements, timed as GetEntitlements
+    metric for the region of the role
+    """
+    with metrics.timer('GetEntitlements', region):
+        return marketplace.get_entitlements(**request)
+
+
+def iter_entitlement_pages(
+    marketplace, request: Dict, page: Dict, prefetch: bool = True,
+    region: str = ''
+) -> Iterator[Dict]:
+    """
+    Yield the given GetEntitlements response page and all pages
+    following it by NextToken. With prefetch, at most one page
+    ahead is requested in the background
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        while True:
+            token = page.get('NextToken')
+            next_page = None
+            if token:
+                request = dict(request, NextToken=token)
+                if prefetch:
+                    next_page = executor.submit(
+                        get_entitlements_page, marketplace, request, region
+                    )
+            yield page
+            if not token:
+                return
+            page = next_page.result() if next_page else \
+                get_entitlements_page(marketplace, request, region)
+
+
+def classify_entitlement_error(error: Dict) -> Dict:
+    # Classify group of errors into app exception and HTTP code
+    error = classify_error(
+        error, 'InvalidParameterException',
+        400, 'App.Error.EntitlementException'
+    )
+    error = classify_error(
+        error, 'ThrottlingException',
+        400, 'App.Error.EntitlementException'
+    )
+    return error
+
+
+def normalize_entitlement(entitlement: Dict) -> Dict:
+    """
+    Return entitlement in the format provided to the
+    customer portal
+    """
+    return {
+        'expirationDate': format(
+            entitlement.get('ExpirationDate')
+        ),
+        'dimension': entitlement.get(
+            'Dimension'
+        ),
+        'value': {
+            'booleanValue': bool(
+                entitlement['Value'].get('BooleanValue')
+            ),
+            'doubleValue': float(
+                entitlement['Value'].get('DoubleValue') or 0
+            ),
+            'integerValue': int(
+                entitlement['Value'].get('IntegerValue') or 0
+            ),
+            'stringValue': format(
+                entitlement['Value'].get('StringValue') or ''
+            )
+        }
+    }
+
+
+def invalidate_entitlements(customer_id: str, product_code: str) -> None:
+    """
+    Drop cached entitlements of the given customer and product
+    """
+    entitlement_cache.invalidate((customer_id, product_code))
+
+
+def get_entitlement_cache_stats() -> Dict[str, float]:
+    return entitlement_cache.get_stats()
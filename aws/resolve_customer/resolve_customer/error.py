@@ -20,6 +20,26 @@ from typing import Dict
 
 logger = logging.getLogger()
 
+# Failure classes, a transient failure may succeed when retried
+# while a permanent failure will fail again, see get_failure
+TRANSIENT = 'transient'
+PERMANENT = 'permanent'
+
+# Error codes of failures considered transient regardless
+# of their HTTP status code
+transient_error_codes = (
+    'ThrottlingException',
+    'Throttling',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    'RequestTimeout',
+    'RequestTimeoutException',
+    'ServiceUnavailable',
+    'ServiceUnavailableException',
+    'InternalFailure',
+    'InternalServiceErrorException'
+)
+
 
 def error_response(error: Dict, topic: str):
     return {
@@ -34,8 +54,10 @@ def error_response(error: Dict, topic: str):
     }
 
 
-def error_record(status_code: int, message: str, kind: str = 'Unknown') -> Dict:
-    return {
+def error_record(
+    status_code: int, message: str, kind: str = 'Unknown', failure: str = ''
+) -> Dict:
+    error: Dict[str, Dict] = {
         'ResponseMetadata': {
             'HTTPStatusCode': status_code
         },
@@ -44,6 +66,9 @@ def error_record(status_code: int, message: str, kind: str = 'Unknown') -> Dict:
             'Code': f'App.Error.{kind}'
         }
     }
+    if failure:
+        error['Error']['Failure'] = failure
+    return error
 
 
 def classify_error(
@@ -51,12 +76,31 @@ def classify_error(
 ) -> Dict:
     error_code = error['Error']['Code']
     if error_code == aws_code:
+        # keep the failure class of the original error
+        error['Error']['Failure'] = get_failure(error)
         error['ResponseMetadata']['HTTPStatusCode'] = status_code
         if exception_name:
             error['Error']['Code'] = exception_name
     return error
 
 
+def get_failure(error: Dict) -> str:
+    """
+    Return whether the error is a TRANSIENT failure, e.g. throttling,
+    a 5xx status code or a timeout, or a PERMANENT one. The failure
+    class stored by error_record or classify_error takes precedence
+    """
+    failure = error['Error'].get('Failure')
+    if failure:
+        return failure
+    status_code = error.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+    error_code = format(error['Error'].get('Code')).split('.')[-1]
+    if status_code >= 500 or status_code in (408, 429) or \
+            error_code in transient_error_codes:
+        return TRANSIENT
+    return PERMANENT
+
+
 def error_code_matches(error: Dict, aws_code: str) -> bool:
     status = True if error['Error']['Code'] == aws_code else False
     return status
@@ -0,0 +1,131 @@
+# Copyright (c) 2025 SUSE LLC.  All rights reserved.
+#
+# This file is part of suse-saas-tools
+#
+# suse-saas-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mash is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mash.  If not, see <http://www.gnu.org/licenses/>
+#
+import json
+import logging
+import random
+import time
+from typing import (
+    Any, FrozenSet, Optional
+)
+
+# Keys whose values never show up in logged payloads
+REDACTED_FIELDS: FrozenSet[str] = frozenset(
+    (
+        'auth_token',
+        'registrationToken',
+        'RegistrationToken',
+        'Authorization',
+        'authorization',
+        'SecretAccessKey',
+        'SessionToken'
+    )
+)
+
+# Replacement of a redacted value
+REDACTED = '***'
+
+# Default share of invocations which log their full payloads
+DEFAULT_SAMPLE_RATE = 0.0
+
+
+def redact(data: Any) -> Any:
+    """
+    Return a copy of data with the values of REDACTED_FIELDS
+    replaced, including JSON documents embedded as strings or
+    bytes, e.g. the body of an API Gateway or SQS event
+    """
+    if isinstance(data, bytes):
+        data = data.decode('utf-8', errors='replace')
+    if isinstance(data, dict):
+        return {
+            key: REDACTED if key in REDACTED_FIELDS else redact(value)
+            for key, value in data.items()
+        }
+    if isinstance(data, (list, tuple)):
+        return [redact(value) for value in data]
+    if isinstance(data, str) and data[:1] in ('{', '['):
+        try:
+            document = json.loads(data)
+        except ValueError:
+            return data
+        return json.dumps(redact(document))
+    return data
+
+
+class Payload:
+    """
+    Redacted JSON dump of data, formatted only if the
+    log record it is passed to is emitted
+    """
+    __slots__ = ('data',)
+
+    def __init__(self, data: Any):
+        self.data = data
+
+    def __str__(self) -> str:
+        return json.dumps(redact(self.data), default=str)
+
+
+def log_payload(
+    logger: logging.Logger, label: str, data: Any,
+    sample_rate: Optional[float] = DEFAULT_SAMPLE_RATE
+) -> None:
+    """
+    Log the full payload data for the given share of calls,
+    sample_rate 1 logs every call, 0 none
+    """
+    if not sample_rate or not logger.isEnabledFor(logging.INFO):
+        return
+    if sample_rate < 1 and random.random() >= sample_rate:
+        return
+    logger.info('%s: %s', label, Payload(data))
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Format log records as one JSON document per line. Fields
+    passed as extra={'fields': {...}} become keys of the document
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'timestamp': time.strftime(
+                '%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)
+            ) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        fields = getattr(record, 'fields', None)
+        if isinstance(fields, dict):
+            entry.update(redact(fields))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(log_format: Optional[str] = '') -> None:
+    """
+    With log_format json, format the records of all handlers of
+    the root logger, e.g. the handler of the Lambda runtime,
+    with JSONFormatter
+    """
+    if log_format != 'json':
+        return
+    for handler in logging.getLogger().handlers:
+        if not isinstance(handler.formatter, JSONFormatter):
+            handler.setFormatter(JSONFormatter())
@@ -0,0 +1,165 @@
+# Copyright (c) 2025 SUSE LLC.  All rights reserved.
+#
+# This file is part of suse-saas-tools
+#
+# suse-saas-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mash is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mash.  If not, see <http://www.gnu.org/licenses/>
+#
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import (
+    Callable, Dict, Iterator, List, Optional, Tuple
+)
+
+from botocore.exceptions import ClientError
+
+# CloudWatch namespace of the emitted metrics
+DEFAULT_NAMESPACE = 'SUSE/SaaSTools'
+
+# Dimensions of each metric, in the order of the metric key
+DIMENSIONS = ('Region', 'Action', 'Outcome')
+
+# Outcome of a call that did not raise
+SUCCESS = 'success'
+
+# Value of a dimension that does not apply to a metric
+NO_DIMENSION = 'none'
+
+# Maximum number of values per metric in one EMF record
+MAX_VALUES = 100
+
+
+class Timing:
+    """
+    Outcome of a timed call, see Metrics.timer
+    """
+    def __init__(self):
+        self.outcome = SUCCESS
+
+
+def write_stdout(record: str) -> None:
+    sys.stdout.write(f'{record}\n')
+
+
+class Metrics:
+    """
+    In-process collection of latency metrics
+
+    Calls are timed in milliseconds per metric name with the
+    dimensions region, action and outcome. flush emits the
+    collected values as CloudWatch embedded metric format (EMF)
+    records, one JSON document per combination of dimensions.
+    Lambda forwards the records from stdout to CloudWatch. The
+    sink can be replaced, e.g. by list.append in tests
+    """
+    def __init__(self, namespace: str = DEFAULT_NAMESPACE):
+        self.lock = threading.Lock()
+        self.namespace = namespace
+        self.sink: Callable[[str], None] = write_stdout
+        self.clear()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.values: Dict[Tuple[str, str, str], Dict[str, List]] = {}
+
+    def set_sink(self, sink: Optional[Callable[[str], None]] = None) -> None:
+        """
+        Write the EMF records to sink, default is stdout
+        """
+        self.sink = sink or write_stdout
+
+    def record(
+        self, name: str, seconds: float, region: str = '',
+        action: str = '', outcome: str = SUCCESS
+    ) -> None:
+        key = (
+            region or NO_DIMENSION, action or NO_DIMENSION,
+            outcome or NO_DIMENSION
+        )
+        with self.lock:
+            self.values.setdefault(key, {}).setdefault(name, []).append(
+                round(seconds * 1000, 3)
+            )
+
+    @contextmanager
+    def timer(
+        self, name: str, region: str = '', action: str = ''
+    ) -> Iterator[Timing]:
+        """
+        Time the enclosed call. The outcome is the error code of
+        a raised ClientError, the name of any other exception, or
+        what the caller sets on the yielded Timing
+        """
+        timing = Timing()
+        start = time.perf_counter()
+        try:
+            yield timing
+        except ClientError as error:
+            timing.outcome = format(
+                error.response.get('Error', {}).get('Code')
+            )
+            raise
+        except Exception as error:
+            timing.outcome = type(error).__name__
+            raise
+        finally:
+            self.record(
+                name, time.perf_counter() - start, region, action,
+                timing.outcome
+            )
+
+    def flush(self) -> List[Dict]:
+        """
+        Emit the collected values to the sink and clear them.
+        Returns the emitted EMF records
+        """
+        with self.lock:
+            values, self.values = self.values, {}
+        timestamp = int(time.time() * 1000)
+        records: List[Dict] = []
+        for dimensions, metrics in values.items():
+            count = max(len(metric) for metric in metrics.values())
+            for offset in range(0, count, MAX_VALUES):
+                chunk = {
+                    name: metric[offset:offset + MAX_VALUES]
+                    for name, metric in metrics.items()
+                    if metric[offset:offset + MAX_VALUES]
+                }
+                record: Dict = {
+                    '_aws': {
+                        'Timestamp': timestamp,
+                        'CloudWatchMetrics': [
+                            {
+                                'Namespace': self.namespace,
+                                'Dimensions': [list(DIMENSIONS)],
+                                'Metrics': [
+                                    {'Name': name, 'Unit': 'Milliseconds'}
+                                    for name in chunk
+                                ]
+                            }
+                        ]
+                    }
+                }
+                record.update(zip(DIMENSIONS, dimensions))
+                record.update(chunk)
+                records.append(record)
+        for record in records:
+            self.sink(json.dumps(record))
+        return records
+
+
+# Process wide metrics, flushed once per Lambda invocation
+metrics = Metrics()
@@ -0,0 +1,207 @@
+# Copyright (c) 2025 SUSE LLC.  All rights reserved.
+#
+# This file is part of suse-saas-tools
+#
+# suse-saas-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mash is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mash.  If not, see <http://www.gnu.org/licenses/>
+#
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from resolve_customer.defaults import Defaults
+from resolve_customer.client import get_client
+from resolve_customer.entitlements import get_entitlement_client
+from resolve_customer.assume_role import (
+    AWSAssumeRole, DEFAULT_EXPIRY_MARGIN
+)
+from typing import (
+    Any, Callable, Dict, Iterable, List, Mapping, Optional
+)
+
+logger = logging.getLogger('prewarm')
+logger.setLevel('INFO')
+
+# Services for which a client is created per configured region
+SERVICES = ('meteringmarketplace', 'marketplace-entitlement', 'sqs')
+
+# Environment variable to enable pre-warming in the init phase
+PREWARM_ENVIRONMENT = 'PREWARM_CLIENTS'
+
+# Key of the warm-up event, {"warmup": true}, sent by scheduled pings
+WARMUP_EVENT_KEY = 'warmup'
+
+# Credentials expiring within this number of seconds are refreshed
+# by a warm-up event, see warmup_refresh_margin config
+DEFAULT_WARMUP_REFRESH_MARGIN = 900
+
+
+def is_enabled() -> bool:
+    return os.environ.get(PREWARM_ENVIRONMENT, '').lower() in (
+        '1', 'true', 'yes'
+    )
+
+
+def prewarm_on_init(
+    services: Iterable[str] = SERVICES,
+    get_sqs_config: Optional[Callable[[], Mapping]] = None
+) -> Dict[str, str]:
+    """
+    Pre-warm the given services if enabled by the PREWARM_CLIENTS
+    environment variable. Meant to be called at module load of
+    a lambda entry point, thus it never raises
+    """
+    if not is_enabled():
+        return {}
+    try:
+        config = Defaults.get_assume_role_config()
+        sqs_config = get_sqs_config() if get_sqs_config else {}
+    except Exception as error:
+        logger.warning(
+            'Pre-warming skipped, no valid config: %s: %s',
+            type(error).__name__, error
+        )
+        return {}
+    return prewarm(config, services, sqs_config.get('client_config'))
+
+
+def is_warmup_event(event: Any) -> bool:
+    return isinstance(event, dict) and event.get(WARMUP_EVENT_KEY) is True
+
+
+def warm_up(
+    services: Iterable[str] = SERVICES,
+    get_sqs_config: Optional[Callable[[], Mapping]] = None
+) -> Dict[str, Any]:
+    """
+    Handle a warm-up event: re-validate the config snapshots,
+    refresh credentials expiring within warmup_refresh_margin
+    seconds and touch the connections of the clients, such that
+    requests never pay for a refresh. Returns a timing report,
+    never raises
+    """
+    start = time.monotonic()
+    report: Dict[str, Any] = {'warmup': True}
+    try:
+        config = Defaults.get_assume_role_config()
+        sqs_config = get_sqs_config() if get_sqs_config else {}
+        report['config'] = 'ok'
+    except Exception as error:
+        report['config'] = f'{type(error).__name__}: {error}'
+    else:
+        refresh_margin = max(
+            config.get('warmup_refresh_margin', DEFAULT_WARMUP_REFRESH_MARGIN),
+            config.get('credentials_expiry_margin', DEFAULT_EXPIRY_MARGIN)
+        )
+        report['regions'] = prewarm(
+            config, services, sqs_config.get('client_config'), refresh_margin
+        )
+    report['seconds'] = round(time.monotonic() - start, 3)
+    logger.info('Warm-up done: %s', report)
+    return report
+
+
+def prewarm(
+    config: Mapping, services: Iterable[str] = SERVICES,
+    sqs_client_config: Optional[Mapping] = None,
+    expiry_margin: Optional[int] = None
+) -> Dict[str, str]:
+    """
+    Assume the roles of all configured regions concurrently, create
+    the clients of the given services and open their connections
+
+    Credentials and clients end up in the same process wide caches
+    used by the request path, such that the first request runs as
+    a warm one. sqs clients are also created for the region of the
+    lambda function. Credentials are refreshed if they expire within
+    expiry_margin seconds, default credentials_expiry_margin.
+    A failure is logged and reported per region, it only leaves
+    valid credentials and clients behind.
+    Returns ok or the failure per region
+    """
+    services = tuple(services)
+    regions: List[str] = list(config.get('role') or {})
+    own_region = os.environ.get('AWS_REGION')
+    if 'sqs' in services and own_region and own_region not in regions:
+        regions.append(own_region)
+    if not regions:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(regions)) as executor:
+        return dict(
+            zip(
+                regions, executor.map(
+                    lambda region: prewarm_region(
+                        config, region, services, sqs_client_config,
+                        expiry_margin
+                    ), regions
+                )
+            )
+        )
+
+
+def prewarm_region(
+    config: Mapping, region: str, services: Iterable[str],
+    sqs_client_config: Optional[Mapping] = None,
+    expiry_margin: Optional[int] = None
+) -> str:
+    start = time.monotonic()
+    try:
+        clients = []
+        role: Optional[Mapping] = (config.get('role') or {}).get(region)
+        if role:
+            client_config: Dict = dict(config.get('client_config') or {})
+            if expiry_margin is None:
+                expiry_margin = config.get(
+                    'credentials_expiry_margin', DEFAULT_EXPIRY_MARGIN
+                )
+            assume_role = AWSAssumeRole(
+                role['arn'], role['session'], expiry_margin, client_config
+            )
+            if 'meteringmarketplace' in services:
+                clients.append(
+                    get_client(
+                        'meteringmarketplace', region, assume_role,
+                        client_config
+                    )
+                )
+            if 'marketplace-entitlement' in services:
+                clients.append(get_entitlement_client(config, region))
+        if 'sqs' in services:
+            clients.append(
+                get_client(
+                    'sqs', region, client_config=dict(sqs_client_config or {})
+                )
+            )
+        for client in clients:
+            open_connection(client)
+    except Exception as error:
+        logger.warning(
+            'Pre-warming region %s failed: %s: %s',
+            region, type(error).__name__, error
+        )
+        return f'{type(error).__name__}: {error}'
+    logger.info(
+        'Pre-warmed region %s in %.3fs', region, time.monotonic() - start
+    )
+    return 'ok'
+
+
+def open_connection(client) -> None:
+    """
+    Open the TLS connection of the client by an unsigned request
+    to its endpoint, the connection is kept in the pool of the
+    client. The response status does not matter
+    """
+    from botocore.awsrequest import AWSRequest
+    request = AWSRequest(method='GET', url=client.meta.endpoint_url)
+    client._endpoint.http_session.send(request.prepare())
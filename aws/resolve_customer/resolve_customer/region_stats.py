@@ -0,0 +1,160 @@
+# Copyright (c) 2025 SUSE LLC.  All rights reserved.
+#
+# This file is part of suse-saas-tools
+#
+# suse-saas-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mash is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mash.  If not, see <http://www.gnu.org/licenses/>
+#
+import json
+import logging
+import os
+import threading
+from typing import (
+    Dict, Iterable, List, Optional
+)
+
+logger = logging.getLogger('region_stats')
+
+# Weight of a new latency sample in the exponentially
+# weighted moving average of a region
+EWMA_ALPHA = 0.3
+
+
+class RegionStats:
+    """
+    In-process statistic of region resolve outcomes
+
+    Remembers the region that last succeeded per key, e.g. per
+    product code, and a latency EWMA per region. This is used to
+    try the most likely region first. The statistic can optionally
+    be persisted to a file, e.g. in /tmp, to survive a restart of
+    the Lambda runtime on the same instance.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats_file = ''
+        self.clear()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.last_success: Dict[str, str] = {}
+            self.latency: Dict[str, float] = {}
+            self.lookups = 0
+            self.first_region_hits = 0
+
+    def set_stats_file(self, stats_file: str) -> None:
+        """
+        Persist the statistic to the given file. Data already
+        stored in the file is loaded
+        """
+        if not stats_file or stats_file == self.stats_file:
+            return
+        self.stats_file = stats_file
+        try:
+            with open(stats_file) as stats:
+                data = json.load(stats)
+            with self.lock:
+                self.last_success.update(data.get('last_success') or {})
+                self.latency.update(data.get('latency') or {})
+        except (OSError, ValueError) as issue:
+            logger.info('No region stats loaded from %s: %s', stats_file, issue)
+
+    def order(self, regions: Iterable[str], key: str = '') -> List[str]:
+        """
+        Return regions in the order they should be tried. The region
+        that last succeeded for key comes first, followed by regions
+        with known latency, fastest first, followed by the remaining
+        regions in alphabetical order
+        """
+        with self.lock:
+            preferred = self.last_success.get(key)
+            return sorted(
+                regions, key=lambda region: (
+                    region != preferred,
+                    region not in self.latency,
+                    self.latency.get(region, 0),
+                    region
+                )
+            )
+
+    def record(
+        self, region: str, seconds: float, success: bool,
+        keys: Iterable[Optional[str]] = ('',)
+    ) -> None:
+        """
+        Record the outcome and latency of an attempt in region.
+        On success the region becomes the preferred one for keys
+        """
+        with self.lock:
+            previous = self.latency.get(region)
+            self.latency[region] = seconds if previous is None else \
+                EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * previous
+        if success:
+            self.record_success(region, keys)
+
+    def record_success(
+        self, region: str, keys: Iterable[Optional[str]] = ('',)
+    ) -> None:
+        """
+        Make region the preferred one for keys without changing
+        its latency, e.g. for calls not served by the region itself
+        """
+        changed = False
+        with self.lock:
+            for key in keys:
+                if key is not None and self.last_success.get(key) != region:
+                    self.last_success[key] = region
+                    changed = True
+        if changed:
+            self.save()
+
+    def record_lookup(self, first_region_hit: bool) -> None:
+        """
+        Count a lookup and whether the first region tried succeeded
+        """
+        with self.lock:
+            self.lookups += 1
+            if first_region_hit:
+                self.first_region_hits += 1
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return {
+                'lookups': self.lookups,
+                'first_region_hits': self.first_region_hits,
+                'hit_rate': self.first_region_hits / self.lookups
+                if self.lookups else 0.0,
+                'last_success': dict(self.last_success),
+                'latency': dict(self.latency)
+            }
+
+    def save(self) -> None:
+        if not self.stats_file:
+            return
+        with self.lock:
+            data = {
+                'last_success': dict(self.last_success),
+                'latency': dict(self.latency)
+            }
+        try:
+            temp_file = \
+                f'{self.stats_file}.{os.getpid()}.{threading.get_ident()}'
+            with open(temp_file, 'w') as stats:
+                json.dump(data, stats)
+            os.replace(temp_file, self.stats_file)
+        except OSError as issue:
+            logger.error('Failed to store region stats: %s', issue)
+
+
+# Process wide region statistic
+region_stats = RegionStats()
@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+
+# Cumulative import time of the lambda entry point in microseconds,
+# best of three runs. Importing boto3 alone takes longer than this
+IMPORT_TIME_BUDGET = 150000
+
+# Modules only imported on the code path that needs them
+DEFERRED_MODULES = ('boto3', 'botocore.config', 'yaml')
+
+project_dir = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', '..')
+)
+
+
+def import_entry_point():
+    """
+    Return the -X importtime report of app_resolve_customer
+    as dict of module name to cumulative microseconds
+    """
+    report = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app_resolve_customer'],
+        cwd=project_dir, capture_output=True, text=True, check=True,
+        env=dict(
+            os.environ, PYTHONPATH=os.pathsep.join([project_dir] + sys.path)
+        )
+    ).stderr
+    modules = {}
+    for line in report.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line.split('|')
+            if cumulative.strip().isdigit():
+                modules[name.strip()] = int(cumulative)
+    return modules
+
+
+class TestAppResolveCustomer:
+    def test_import_time(self):
+        reports = [import_entry_point() for _ in range(3)]
+        for module in DEFERRED_MODULES:
+            assert module not in reports[0]
+        assert min(
+            report['app_resolve_customer'] for report in reports
+        ) < IMPORT_TIME_BUDGET
@@ -1,20 +1,41 @@
+import logging
 from unittest.mock import (
     Mock, patch
 )
+from pytest import fixture
 
 from resolve_customer.error import error_record
 from resolve_customer.app import (
-    lambda_handler, process_event
+    lambda_handler, process_event, get_customer, customer_cache
 )
 
 
 class TestApp:
+    @fixture(autouse=True)
+    def inject_fixtures(self, caplog):
+        self._caplog = caplog
+
+    def setup_method(self, cls):
+        customer_cache.clear()
+
     def test_lambda_handler_invalid_event(self):
         assert lambda_handler(event={'some': 'some'}, context=Mock()) == \
             '{"isBase64Encoded": false, "statusCode": 500, ' \
             '"body": {"errors": {"Registration": "KeyError: \'body\'", ' \
             '"Exception": "App.Error.InternalServiceErrorException"}}}'
 
+    @patch('resolve_customer.app.warm_up')
+    @patch('resolve_customer.app.process_event')
+    def test_lambda_handler_warmup(self, mock_process_event, mock_warm_up):
+        mock_warm_up.return_value = {'warmup': True, 'seconds': 0.1}
+        assert lambda_handler(event={'warmup': True}, context=Mock()) == \
+            '{"isBase64Encoded": false, "statusCode": 200, ' \
+            '"body": {"warmup": true, "seconds": 0.1}}'
+        mock_warm_up.assert_called_once_with(
+            ('meteringmarketplace', 'marketplace-entitlement')
+        )
+        assert not mock_process_event.called
+
     @patch('resolve_customer.app.AWSCustomer')
     def test_lambda_handler_unexpected_error(self, mock_AWSCustomer):
         mock_AWSCustomer.side_effect = IOError('some unexpected error')
@@ -75,11 +96,34 @@ class TestApp:
             'token'
         )
 
+    @patch('resolve_customer.app.get_tolerant_config')
+    @patch('resolve_customer.app.process_event')
+    def test_lambda_handler_logs_redacted_base64_body(
+        self, mock_process_event, mock_get_tolerant_config
+    ):
+        mock_get_tolerant_config.return_value = {'log_sample_rate': 1}
+        mock_process_event.return_value = {}
+        with self._caplog.at_level(logging.INFO):
+            lambda_handler(
+                event={
+                    'body': 'eyJyZWdpc3RyYXRpb25Ub2tlbiI6ICJ0b2tlbiJ9Cg==',
+                    'isBase64Encoded': True
+                },
+                context=Mock()
+            )
+            assert '\\"registrationToken\\": \\"***\\"' in \
+                self._caplog.text
+            assert '\\"token\\"' not in self._caplog.text
+        mock_process_event.assert_called_once_with('token')
+
+    @patch('resolve_customer.app.get_tolerant_config')
     @patch('resolve_customer.app.AWSCustomer')
     @patch('resolve_customer.app.AWSCustomerEntitlement')
     def test_process_event(
-        self, mock_AWSCustomerEntitlement, mock_AWSCustomer
+        self, mock_AWSCustomerEntitlement, mock_AWSCustomer,
+        mock_get_tolerant_config
     ):
+        mock_get_tolerant_config.return_value = {'customer_cache': {'ttl': 0}}
         customer = Mock()
         customer.error = {}
         entitlements = Mock()
@@ -120,3 +164,43 @@ class TestApp:
                 }
             }
         }
+
+    @patch('resolve_customer.app.get_tolerant_config')
+    @patch('resolve_customer.app.AWSCustomer')
+    def test_get_customer(self, mock_AWSCustomer, mock_get_tolerant_config):
+        mock_get_tolerant_config.return_value = {}
+        customer = Mock()
+        customer.error = {}
+        customer.get_id.return_value = 'id'
+        customer.get_account_id.return_value = 'account_id'
+        customer.get_product_code.return_value = 'product'
+        mock_AWSCustomer.return_value = customer
+        assert get_customer('some%2Btoken') is customer
+        mock_AWSCustomer.assert_called_once_with('some%2Btoken')
+
+        # the unquoted token is answered from the cache
+        mock_AWSCustomer.reset_mock()
+        cached = get_customer('some+token')
+        assert not mock_AWSCustomer.called
+        mock_AWSCustomer.from_customer.assert_called_once_with(
+            {
+                'CustomerIdentifier': 'id',
+                'CustomerAWSAccountId': 'account_id',
+                'ProductCode': 'product'
+            }
+        )
+        assert cached is mock_AWSCustomer.from_customer.return_value
+        assert customer_cache.get_stats()['hits'] == 1
+
+        # errors are not cached
+        customer.error = error_record(400, 'invalid')
+        assert get_customer('other') is customer
+        assert customer_cache.get_stats()['size'] == 1
+
+        # no cache without token or with a ttl of 0
+        get_customer('')
+        mock_AWSCustomer.assert_called_with('')
+        mock_get_tolerant_config.return_value = {'customer_cache': {'ttl': 0}}
+        mock_AWSCustomer.reset_mock()
+        get_customer('some+token')
+        mock_AWSCustomer.assert_called_once_with('some+token')
@@ -4,10 +4,14 @@ from unittest.mock import (
 from pytest import (
     fixture, raises
 )
-from datetime import datetime
+from datetime import (
+    datetime, timedelta, timezone
+)
+from threading import Thread
 
 from botocore.exceptions import ClientError
 from resolve_customer.assume_role import AWSAssumeRole
+from resolve_customer.client import clear_clients
 from resolve_customer.error import error_record
 
 
@@ -18,6 +22,8 @@ class TestAWSAssumeRole:
 
     @patch('boto3.client')
     def setup_method(self, cls, mock_boto_client):
+        AWSAssumeRole.clear_cache()
+        clear_clients()
         self.sts_client = mock_boto_client.return_value
         self.sts_client.assume_role.return_value = {
             'Credentials': {
@@ -39,6 +45,7 @@ class TestAWSAssumeRole:
 
     @patch('boto3.client')
     def test_setup_boto_client_raises(self, mock_boto_client):
+        clear_clients()
         error_response = error_record(
             400, 'sts client failed'
         )
@@ -51,6 +58,70 @@ class TestAWSAssumeRole:
         with raises(ClientError):
             AWSAssumeRole('arn:aws:iam::some:role/Some', 'some')
 
+    @patch('boto3.client')
+    def test_credentials_cached_until_expiry_margin(self, mock_boto_client):
+        clear_clients()
+        sts_client = mock_boto_client.return_value
+        sts_client.assume_role.return_value = {
+            'Credentials': {
+                'AccessKeyId': 'cached',
+                'Expiration': datetime.now(timezone.utc) + timedelta(hours=1)
+            }
+        }
+        for _ in range(3):
+            role = AWSAssumeRole('arn:aws:iam::some:role/Cached', 'some')
+            assert role.get_access_key() == 'cached'
+        assert sts_client.assume_role.call_count == 1
+        # credentials expire within the requested margin
+        AWSAssumeRole(
+            'arn:aws:iam::some:role/Cached', 'some', expiry_margin=7200
+        )
+        assert sts_client.assume_role.call_count == 2
+        # other session name is a different cache entry
+        AWSAssumeRole('arn:aws:iam::some:role/Cached', 'other')
+        assert sts_client.assume_role.call_count == 3
+
+    @patch('boto3.client')
+    def test_concurrent_callers_share_refresh(self, mock_boto_client):
+        clear_clients()
+        sts_client = mock_boto_client.return_value
+        sts_client.assume_role.return_value = {
+            'Credentials': {
+                'AccessKeyId': 'shared',
+                'Expiration': datetime.now(timezone.utc) + timedelta(hours=1)
+            }
+        }
+        roles = []
+        threads = [
+            Thread(
+                target=lambda: roles.append(
+                    AWSAssumeRole('arn:aws:iam::some:role/Shared', 'some')
+                )
+            ) for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sts_client.assume_role.call_count == 1
+        assert [role.get_access_key() for role in roles] == ['shared'] * 8
+
+    def test_is_valid(self):
+        future = datetime.now(timezone.utc) + timedelta(hours=1)
+        assert AWSAssumeRole.is_valid({}, 0) is False
+        assert AWSAssumeRole.is_valid(
+            {'Credentials': {'Expiration': 'bogus'}}, 0
+        ) is False
+        assert AWSAssumeRole.is_valid(
+            {'Credentials': {'Expiration': future}}, 300
+        ) is True
+        assert AWSAssumeRole.is_valid(
+            {'Credentials': {'Expiration': future}}, 3600
+        ) is False
+        assert AWSAssumeRole.is_valid(
+            {'Credentials': {'Expiration': format(future.replace(tzinfo=None))}}, 0
+        ) is True
+
 #    @patch('boto3.client')
 #    def test_no_role_success(self, mock_boto_client):
 #        error_response = error_record(
@@ -0,0 +1,44 @@
+from unittest.mock import patch
+
+from resolve_customer.cache import TTLCache
+
+
+class TestTTLCache:
+    def setup_method(self, cls):
+        self.cache = TTLCache(ttl=10, maxsize=2)
+
+    @patch('resolve_customer.cache.time.monotonic')
+    def test_get_put_expire(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+        assert self.cache.get('key') is None
+        self.cache.put('key', 'value')
+        mock_monotonic.return_value = 109
+        assert self.cache.get('key') == 'value'
+        mock_monotonic.return_value = 110
+        assert self.cache.get('key') is None
+        assert self.cache.get_stats() == {
+            'hits': 1, 'misses': 2, 'size': 0, 'maxsize': 2, 'ttl': 10
+        }
+
+    def test_least_recently_used_dropped(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        assert self.cache.get('a') == 1
+        self.cache.put('c', 3)
+        assert self.cache.get('b') is None
+        assert self.cache.get('a') == 1
+        assert self.cache.get('c') == 3
+        self.cache.configure(ttl=10, maxsize=1)
+        assert self.cache.get('a') is None
+        assert self.cache.get('c') == 3
+
+    def test_invalidate_and_clear(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.invalidate('a')
+        self.cache.invalidate('unknown')
+        assert self.cache.get('a') is None
+        assert self.cache.get('b') == 2
+        self.cache.clear()
+        assert self.cache.get_stats()['hits'] == 0
+        assert self.cache.get('b') is None
@@ -0,0 +1,107 @@
+from unittest.mock import (
+    patch, Mock
+)
+
+from resolve_customer import client
+from resolve_customer.config import (
+    load_config, clear_config_cache
+)
+from resolve_customer.client import (
+    get_client, clear_clients, get_config_key
+)
+
+
+class TestClient:
+    def setup_method(self, cls):
+        clear_clients()
+        clear_config_cache()
+
+    def test_get_client_frozen_client_config(self, tmp_path):
+        config_file = tmp_path / 'assume_role.yml'
+        config_file.write_text(
+            'client_config:\n'
+            '  max_pool_connections: 10\n'
+            '  retries:\n'
+            '    max_attempts: 3\n'
+            '    mode: standard\n'
+        )
+        client_config = load_config(format(config_file))['client_config']
+        sts = get_client('sts', 'us-east-1', client_config=client_config)
+        assert sts.meta.config.retries == {
+            'total_max_attempts': 4, 'mode': 'standard'
+        }
+        # the snapshot is not modified
+        assert client_config['retries']['max_attempts'] == 3
+
+    @patch('botocore.config.Config')
+    @patch('boto3.client')
+    def test_get_client(self, mock_boto_client, mock_Config):
+        assume_role = Mock()
+        assume_role.get_access_key.return_value = 'key'
+        assume_role.get_secret_access_key.return_value = 'secret'
+        assume_role.get_session_token.return_value = 'token'
+        sqs = get_client(
+            'sqs', 'us-east-1', client_config={'max_pool_connections': 20}
+        )
+        mock_Config.assert_called_once_with(max_pool_connections=20)
+        mock_boto_client.assert_called_once_with(
+            'sqs', region_name='us-east-1', config=mock_Config.return_value
+        )
+        mock_boto_client.reset_mock()
+        marketplace = get_client(
+            'meteringmarketplace', 'eu-central-1', assume_role
+        )
+        mock_boto_client.assert_called_once_with(
+            'meteringmarketplace', region_name='eu-central-1',
+            config=mock_Config.return_value,
+            aws_access_key_id='key',
+            aws_secret_access_key='secret',
+            aws_session_token='token'
+        )
+        mock_boto_client.reset_mock()
+        # warm lookups are served from the registry
+        assert get_client(
+            'sqs', 'us-east-1', client_config={'max_pool_connections': 20}
+        ) == sqs
+        assert get_client(
+            'meteringmarketplace', 'eu-central-1', assume_role
+        ) == marketplace
+        assert not mock_boto_client.called
+        # rotated credentials cause a new client
+        assume_role.get_access_key.return_value = 'rotated'
+        get_client('meteringmarketplace', 'eu-central-1', assume_role)
+        assert mock_boto_client.called
+        mock_boto_client.reset_mock()
+        # a changed client_config causes a new client
+        get_client('sqs', 'us-east-1', client_config={'max_pool_connections': 20})
+        assert not mock_boto_client.called
+        get_client(
+            'sqs', 'us-east-1',
+            client_config={'max_pool_connections': 20, 'retries': {'mode': 'standard'}}
+        )
+        assert mock_boto_client.called
+        mock_boto_client.reset_mock()
+        # a different endpoint causes a new client
+        get_client('sqs', 'us-east-1', endpoint_url='http://localhost:9324')
+        mock_boto_client.assert_called_once_with(
+            'sqs', region_name='us-east-1', config=mock_Config.return_value,
+            endpoint_url='http://localhost:9324'
+        )
+
+    @patch('boto3.client')
+    def test_get_client_evicts_least_recently_used(self, mock_boto_client):
+        mock_boto_client.side_effect = lambda *args, **kwargs: Mock()
+        with patch.object(client, 'MAX_CLIENTS', 2):
+            first = get_client('sqs', 'us-east-1')
+            get_client('sqs', 'eu-central-1')
+            assert get_client('sqs', 'us-east-1') == first
+            get_client('sqs', 'us-west-2')
+            assert get_client('sqs', 'us-east-1') == first
+            assert mock_boto_client.call_count == 3
+            get_client('sqs', 'eu-central-1')
+            assert mock_boto_client.call_count == 4
+
+    def test_get_config_key(self):
+        key = get_config_key({'b': [1, {'c': 2}], 'a': 1})
+        assert key == (('a', 1), ('b', (1, (('c', 2),))))
+        assert hash(key) == hash(get_config_key({'a': 1, 'b': (1, {'c': 2})}))
@@ -0,0 +1,72 @@
+import os
+import yaml
+from unittest.mock import patch
+from pytest import raises
+
+from resolve_customer.config import (
+    load_config, clear_config_cache, freeze, thaw
+)
+
+
+class TestConfig:
+    def setup_method(self, cls):
+        clear_config_cache()
+
+    def test_load_config_parses_once(self, tmp_path):
+        config_file = tmp_path / 'config.yml'
+        config_file.write_text('key: value\nlist:\n  - a\n  - b\n')
+        with patch('yaml.safe_load', wraps=yaml.safe_load) as mock_safe_load:
+            config = load_config(format(config_file))
+            assert load_config(format(config_file)) is config
+            assert mock_safe_load.call_count == 1
+        assert config == {'key': 'value', 'list': ('a', 'b')}
+        with raises(TypeError):
+            config['key'] = 'other'
+
+    def test_load_config_reloads_on_change(self, tmp_path):
+        config_file = tmp_path / 'config.yml'
+        config_file.write_text('key: value\n')
+        assert load_config(format(config_file))['key'] == 'value'
+        config_file.write_text('key: changed_value\n')
+        stat = os.stat(config_file)
+        os.utime(
+            config_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000)
+        )
+        assert load_config(format(config_file))['key'] == 'changed_value'
+
+    def test_load_config_from_environment(self, tmp_path):
+        with patch.dict(os.environ, {'SOME_CONFIG': '{"key": "env"}'}):
+            assert load_config(
+                format(tmp_path / 'does-not-exist.yml'), 'SOME_CONFIG'
+            ) == {'key': 'env'}
+            assert load_config(
+                format(tmp_path / 'does-not-exist.yml'), 'SOME_CONFIG'
+            ) == {'key': 'env'}
+
+    def test_load_config_empty_file(self, tmp_path):
+        config_file = tmp_path / 'config.yml'
+        config_file.write_text('')
+        assert load_config(format(config_file)) == {}
+
+    def test_load_config_invalid(self, tmp_path):
+        config_file = tmp_path / 'config.yml'
+        config_file.write_text('- some\n- list\n')
+        with raises(ValueError):
+            load_config(format(config_file))
+
+    def test_load_config_validate(self, tmp_path):
+        config_file = tmp_path / 'config.yml'
+        config_file.write_text('key: value\n')
+
+        def validate(config):
+            raise ValueError('invalid')
+
+        with raises(ValueError):
+            load_config(format(config_file), validate=validate)
+
+    def test_thaw(self):
+        data = {'retries': {'max_attempts': 3}, 'list': ['a', {'b': 1}]}
+        thawed = thaw(freeze(data))
+        assert thawed == data
+        assert type(thawed['retries']) is dict
+        assert type(thawed['list'][1]) is dict
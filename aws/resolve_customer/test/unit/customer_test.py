@@ -1,17 +1,31 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import (
-    patch, MagicMock
+    patch, MagicMock, ANY
 )
 from pytest import fixture
 
 from botocore.exceptions import ClientError
 from resolve_customer.error import error_record
 from resolve_customer.defaults import Defaults
-from resolve_customer.customer import AWSCustomer
+from resolve_customer.client import clear_clients
+from resolve_customer.region_stats import region_stats
+from resolve_customer.customer import (
+    AWSCustomer, invalid_token_cache, hash_token,
+    get_invalid_token_cache_stats
+)
 
 role_config = Defaults.get_assume_role_config('../data/assume_role.yml')
 
 
+def set_credentials(assume_role):
+    # MagicMock creates its children lazily, which is not thread safe,
+    # the concurrent region lookups get plain values instead
+    assume_role.get_access_key.return_value = 'key'
+    assume_role.get_secret_access_key.return_value = 'secret'
+    assume_role.get_session_token.return_value = 'token'
+
+
 class TestAWSCustomer:
     @fixture(autouse=True)
     def inject_fixtures(self, caplog):
@@ -24,6 +38,9 @@ class TestAWSCustomer:
         self, cls, mock_AWSAssumeRole, mock_get_assume_role_config,
         mock_boto_client
     ):
+        clear_clients()
+        region_stats.clear()
+        invalid_token_cache.clear()
         mock_get_assume_role_config.return_value = role_config
         assume_role = MagicMock()
         mock_AWSAssumeRole.return_value = assume_role
@@ -39,7 +56,8 @@ class TestAWSCustomer:
             region_name='eu-central-1',
             aws_access_key_id=assume_role.get_access_key.return_value,
             aws_secret_access_key=assume_role.get_secret_access_key.return_value,
-            aws_session_token=assume_role.get_session_token.return_value
+            aws_session_token=assume_role.get_session_token.return_value,
+            config=ANY
         )
 
     @patch('boto3.client')
@@ -104,9 +122,139 @@ class TestAWSCustomer:
             error_response=error_response
         )
         with self._caplog.at_level(logging.INFO):
-            AWSCustomer('bogus_token')
-            assert 'Registration token is invalid: bogus_token' in \
+            customer = AWSCustomer('bogus_token')
+            assert 'Registration token is invalid: ***' in \
                 self._caplog.text
+            assert 'bogus_token' not in self._caplog.text
+        # the response still names the rejected token
+        assert customer.error['Error']['Message'] == \
+            'Registration token is invalid: bogus_token'
+
+    @patch('boto3.client')
+    @patch('resolve_customer.customer.Defaults.get_assume_role_config')
+    @patch('resolve_customer.customer.AWSAssumeRole')
+    def test_concurrent_regions_first_success(
+        self, mock_AWSAssumeRole, mock_get_assume_role_config,
+        mock_boto_client
+    ):
+        clear_clients()
+        region_stats.clear()
+        set_credentials(mock_AWSAssumeRole.return_value)
+        mock_get_assume_role_config.return_value = dict(
+            role_config, concurrent_regions=True, region_workers=2
+        )
+        error_response = error_record(400, 'not in this region')
+        error_response['Error']['Code'] = 'InvalidTokenException'
+
+        def client(service_name, region_name, **kwargs):
+            marketplace = MagicMock()
+            if region_name == 'eu-central-1':
+                marketplace.resolve_customer.side_effect = ClientError(
+                    operation_name=MagicMock(),
+                    error_response=error_response
+                )
+            else:
+                marketplace.resolve_customer.return_value = {
+                    'CustomerIdentifier': 'us-id',
+                    'CustomerAWSAccountId': 'account_id',
+                    'ProductCode': 'some'
+                }
+            return marketplace
+
+        mock_boto_client.side_effect = client
+        executors = []
+
+        def executor(*args, **kwargs):
+            executors.append(ThreadPoolExecutor(*args, **kwargs))
+            return executors[-1]
+
+        with patch(
+            'resolve_customer.customer.ThreadPoolExecutor',
+            side_effect=executor
+        ):
+            customer = AWSCustomer('token')
+        # let the other region finish while boto3.client is patched
+        for pool in executors:
+            pool.shutdown(wait=True)
+        assert customer.get_id() == 'us-id'
+        assert customer.error == {}
+        assert customer.error_list == []
+
+    @patch('boto3.client')
+    @patch('resolve_customer.customer.Defaults.get_assume_role_config')
+    @patch('resolve_customer.customer.AWSAssumeRole')
+    def test_concurrent_regions_all_fail(
+        self, mock_AWSAssumeRole, mock_get_assume_role_config,
+        mock_boto_client
+    ):
+        clear_clients()
+        region_stats.clear()
+        set_credentials(mock_AWSAssumeRole.return_value)
+        mock_get_assume_role_config.return_value = dict(
+            role_config, concurrent_regions=True
+        )
+
+        def client(service_name, region_name, **kwargs):
+            error_response = error_record(400, f'failed in {region_name}')
+            error_response['Error']['Code'] = 'ThrottlingException'
+            marketplace = MagicMock()
+            marketplace.resolve_customer.side_effect = ClientError(
+                operation_name=MagicMock(),
+                error_response=error_response
+            )
+            return marketplace
+
+        mock_boto_client.side_effect = client
+        with self._caplog.at_level(logging.ERROR):
+            customer = AWSCustomer('token')
+            assert 'failed in us-east-1' in self._caplog.text
+        assert [
+            issue['Error']['Message'] for issue in customer.error_list
+        ] == ['failed in eu-central-1', 'failed in us-east-1']
+        assert customer.error == customer.error_list[-1]
+        assert customer.error['Error']['Code'] == 'App.Error.TokenException'
+        assert customer.get_id() == ''
+
+    @patch('boto3.client')
+    @patch('resolve_customer.customer.Defaults.get_assume_role_config')
+    @patch('resolve_customer.customer.AWSAssumeRole')
+    def test_learned_region_order(
+        self, mock_AWSAssumeRole, mock_get_assume_role_config,
+        mock_boto_client
+    ):
+        clear_clients()
+        region_stats.clear()
+        mock_get_assume_role_config.return_value = role_config
+        error_response = error_record(400, 'not in this region')
+        error_response['Error']['Code'] = 'InvalidTokenException'
+        regions_tried = []
+
+        def client(service_name, region_name, **kwargs):
+            marketplace = MagicMock()
+
+            def resolve_customer(RegistrationToken):
+                regions_tried.append(region_name)
+                if region_name == 'eu-central-1':
+                    raise ClientError(
+                        operation_name=MagicMock(),
+                        error_response=error_response
+                    )
+                return {'ProductCode': 'some'}
+
+            marketplace.resolve_customer.side_effect = resolve_customer
+            return marketplace
+
+        mock_boto_client.side_effect = client
+        AWSCustomer('token')
+        assert regions_tried == ['eu-central-1', 'us-east-1']
+        regions_tried.clear()
+        AWSCustomer('token')
+        assert regions_tried == ['us-east-1']
+        assert region_stats.get_stats()['lookups'] == 2
+        assert region_stats.get_stats()['first_region_hits'] == 1
+        assert region_stats.get_stats()['last_success'] == {
+            '': 'us-east-1', 'some': 'us-east-1'
+        }
 
     def test_get_id(self):
         assert self.customer.get_id() == 'id'
@@ -116,3 +264,90 @@ class TestAWSCustomer:
 
     def test_get_product_code(self):
         assert self.customer.get_product_code() == 'some'
+
+    @patch('boto3.client')
+    @patch('resolve_customer.customer.Defaults.get_assume_role_config')
+    @patch('resolve_customer.customer.AWSAssumeRole')
+    def test_invalid_token_cache(
+        self, mock_AWSAssumeRole, mock_get_assume_role_config,
+        mock_boto_client
+    ):
+        mock_get_assume_role_config.return_value = role_config
+
+        def client(service_name, region_name, **kwargs):
+            error_response = error_record(400, 'Registration token is invalid')
+            error_response['Error']['Code'] = 'InvalidTokenException'
+            raise ClientError(
+                operation_name=MagicMock(), error_response=error_response
+            )
+
+        mock_boto_client.side_effect = client
+        customer = AWSCustomer('bogus%5Ftoken')
+        assert customer.error['Error']['Code'] == 'App.Error.TokenException'
+        assert customer.error['Error']['Message'] == \
+            'Registration token is invalid: bogus_token'
+        assert mock_boto_client.call_count == 2
+        assert hash_token('bogus_token') != 'bogus_token'
+        assert invalid_token_cache.entries.get(hash_token('bogus_token'))
+        # neither the key nor the cached error keep the token
+        assert 'bogus_token' not in repr(invalid_token_cache.entries)
+
+        # the unquoted token is rejected without asking AWS
+        mock_boto_client.reset_mock()
+        with self._caplog.at_level(logging.ERROR):
+            cached = AWSCustomer('bogus_token')
+            assert 'Registration token is invalid: ***' in \
+                self._caplog.text
+            assert 'bogus_token' not in self._caplog.text
+        assert not mock_boto_client.called
+        assert cached.error == customer.error
+        assert cached.error is not customer.error
+        assert cached.error_list == []
+        assert get_invalid_token_cache_stats()['hits'] == 1
+
+        # a disabled cache is not used
+        mock_get_assume_role_config.return_value = dict(
+            role_config, invalid_token_cache={'ttl': 0}
+        )
+        AWSCustomer('bogus_token')
+        assert mock_boto_client.call_count == 2
+
+    @patch('boto3.client')
+    @patch('resolve_customer.customer.Defaults.get_assume_role_config')
+    @patch('resolve_customer.customer.AWSAssumeRole')
+    def test_invalid_token_cache_transient_errors(
+        self, mock_AWSAssumeRole, mock_get_assume_role_config,
+        mock_boto_client
+    ):
+        set_credentials(mock_AWSAssumeRole.return_value)
+        mock_get_assume_role_config.return_value = dict(
+            role_config, concurrent_regions=True
+        )
+
+        def client(service_name, region_name, **kwargs):
+            error_response = error_record(400, 'rejected')
+            error_response['Error']['Code'] = 'InvalidTokenException' \
+                if region_name == 'us-east-1' else 'ThrottlingException'
+            raise ClientError(
+                operation_name=MagicMock(), error_response=error_response
+            )
+
+        mock_boto_client.side_effect = client
+        customer = AWSCustomer('token')
+        assert customer.error
+        # a region might still resolve the token when retried
+        assert invalid_token_cache.get_stats()['size'] == 0
+
+    def test_from_customer(self):
+        customer = AWSCustomer.from_customer(
+            {
+                'CustomerIdentifier': 'id',
+                'CustomerAWSAccountId': 'account_id',
+                'ProductCode': 'product'
+            }
+        )
+        assert customer.get_id() == 'id'
+        assert customer.get_account_id() == 'account_id'
+        assert customer.get_product_code() == 'product'
+        assert customer.error == {}
+        assert customer.error_list == []
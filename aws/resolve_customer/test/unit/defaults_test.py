@@ -1,3 +1,5 @@
+from pytest import raises
+
 from resolve_customer.defaults import Defaults
 
 
@@ -15,3 +17,10 @@ class TestDefaults:
                 }
             }
         }
+
+    def test_validate_assume_role_config(self):
+        Defaults.validate_assume_role_config({})
+        with raises(ValueError):
+            Defaults.validate_assume_role_config(
+                {'role': {'us-east-1': {'arn': 'some'}}}
+            )
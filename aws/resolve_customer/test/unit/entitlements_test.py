@@ -1,13 +1,23 @@
 import logging
 from unittest.mock import (
-    patch, MagicMock, call
+    patch, MagicMock, ANY, call
 )
-from pytest import fixture
+from pytest import fixture, raises
 
 from botocore.exceptions import ClientError
-from resolve_customer.error import error_record
+from resolve_customer.error import (
+    error_record, get_failure, PERMANENT, TRANSIENT
+)
 from resolve_customer.defaults import Defaults
-from resolve_customer.entitlements import AWSCustomerEntitlement
+from resolve_customer.client import clear_clients
+from resolve_customer.region_stats import region_stats
+from resolve_customer.entitlements import (
+    AWSCustomerEntitlement,
+    AWSProductEntitlements,
+    entitlement_cache,
+    invalidate_entitlements,
+    get_entitlement_cache_stats
+)
 
 role_config = Defaults.get_assume_role_config('../data/assume_role.yml')
 
@@ -24,11 +34,13 @@ class TestAWSCustomerEntitlement:
         self, cls, mock_AWSAssumeRole, mock_get_assume_role_config,
         mock_boto_client
     ):
+        clear_clients()
+        region_stats.clear()
         mock_get_assume_role_config.return_value = role_config
         assume_role = MagicMock()
         mock_AWSAssumeRole.return_value = assume_role
         self.marketplace = mock_boto_client.return_value
-        self.marketplace.get_entitlements.return_value = {
+        first_page = {
             'Entitlements': [
                 {
                     'CustomerIdentifier': 'id',
@@ -45,13 +57,30 @@ class TestAWSCustomerEntitlement:
             ],
             'NextToken': 'some'
         }
+        last_page = {
+            'Entitlements': [
+                {
+                    'CustomerIdentifier': 'id',
+                    'Dimension': 'other',
+                    'ExpirationDate': 'some',
+                    'ProductCode': 'some',
+                    'Value': {
+                        'IntegerValue': 1
+                    }
+                }
+            ]
+        }
+        self.pages = {None: first_page, 'some': last_page}
+        self.marketplace.get_entitlements.side_effect = \
+            lambda **request: self.pages[request.get('NextToken')]
         self.entitlements = AWSCustomerEntitlement('id', 'product')
         mock_boto_client.assert_called_once_with(
             'marketplace-entitlement',
             region_name='us-east-1',
             aws_access_key_id=assume_role.get_access_key.return_value,
             aws_secret_access_key=assume_role.get_secret_access_key.return_value,
-            aws_session_token=assume_role.get_session_token.return_value
+            aws_session_token=assume_role.get_session_token.return_value,
+            config=ANY
         )
 
     @patch('boto3.client')
@@ -62,8 +91,16 @@ class TestAWSCustomerEntitlement:
         mock_boto_client
     ):
         with self._caplog.at_level(logging.INFO):
-            AWSCustomerEntitlement('', '')
-            assert 'no customer_id/product_code and/or role' in self._caplog.text
+            entitlements = AWSCustomerEntitlement('', '')
+            assert 'no customer_id/product_code provided' in \
+                self._caplog.text
+        assert get_failure(entitlements.error) == PERMANENT
+        # a missing role is a deployment problem, not one of the message
+        mock_get_assume_role_config.return_value = {'role': {}}
+        with self._caplog.at_level(logging.INFO):
+            entitlements = AWSCustomerEntitlement('id', 'product')
+            assert 'no role provided' in self._caplog.text
+        assert get_failure(entitlements.error) == TRANSIENT
 
     @patch('boto3.client')
     @patch('resolve_customer.entitlements.Defaults.get_assume_role_config')
@@ -107,6 +144,13 @@ class TestAWSCustomerEntitlement:
             )
         ]
 
+    def test_region_stats(self):
+        # the entitlement lookup only marks the region of the role
+        # for the product, it does not skew the resolve latency
+        stats = region_stats.get_stats()
+        assert stats['latency'] == {}
+        assert stats['last_success'] == {'product': 'eu-central-1'}
+
     def test_get_entitlements(self):
         assert self.entitlements.get_entitlements() == [
             {
@@ -118,5 +162,211 @@ class TestAWSCustomerEntitlement:
                     'integerValue': 42,
                     'stringValue': 'some'
                 }
+            },
+            {
+                'dimension': 'other',
+                'expirationDate': 'some',
+                'value': {
+                    'booleanValue': False,
+                    'doubleValue': 0,
+                    'integerValue': 1,
+                    'stringValue': ''
+                }
+            }
+        ]
+        self.marketplace.get_entitlements.assert_called_with(
+            ProductCode='product',
+            Filter={'CUSTOMER_IDENTIFIER': ['id']},
+            NextToken='some'
+        )
+
+    def test_iter_entitlements(self):
+        self.marketplace.get_entitlements.reset_mock()
+        entitlements = self.entitlements.iter_entitlements(prefetch=False)
+        assert next(entitlements)['dimension'] == 'some'
+        # the next page is requested lazily
+        assert not self.marketplace.get_entitlements.called
+        assert next(entitlements)['dimension'] == 'other'
+        assert self.marketplace.get_entitlements.call_count == 1
+        assert list(entitlements) == []
+
+    def test_iter_entitlements_page_fails(self):
+        self.marketplace.get_entitlements.side_effect = ClientError(
+            operation_name=MagicMock(),
+            error_response=error_record(400, 'page failed')
+        )
+        entitlements = self.entitlements.iter_entitlements()
+        assert next(entitlements)['dimension'] == 'some'
+        with raises(ClientError):
+            next(entitlements)
+
+    @patch('boto3.client')
+    @patch('resolve_customer.entitlements.Defaults.get_assume_role_config')
+    @patch('resolve_customer.entitlements.AWSAssumeRole')
+    def test_entitlement_cache(
+        self, mock_AWSAssumeRole, mock_get_assume_role_config,
+        mock_boto_client
+    ):
+        clear_clients()
+        entitlement_cache.clear()
+        mock_get_assume_role_config.return_value = dict(
+            role_config, entitlement_cache={'ttl': 60, 'size': 10}
+        )
+        marketplace = mock_boto_client.return_value
+        marketplace.get_entitlements.side_effect = \
+            self.marketplace.get_entitlements.side_effect
+        expected = self.entitlements.get_entitlements()
+        assert AWSCustomerEntitlement('id', 'product').get_entitlements() == \
+            expected
+        assert AWSCustomerEntitlement('id', 'product').get_entitlements() == \
+            expected
+        assert marketplace.get_entitlements.call_count == 2
+        invalidate_entitlements('id', 'product')
+        assert AWSCustomerEntitlement('id', 'product').get_entitlements() == \
+            expected
+        assert marketplace.get_entitlements.call_count == 4
+        assert get_entitlement_cache_stats() == {
+            'hits': 1, 'misses': 2, 'size': 1, 'maxsize': 10, 'ttl': 60
+        }
+
+    def test_from_entitlements(self):
+        entitlements = self.entitlements.get_entitlements()
+        customer_entitlement = AWSCustomerEntitlement.from_entitlements(
+            'id', 'product', entitlements
+        )
+        assert customer_entitlement.error == {}
+        assert customer_entitlement.get_entitlements() == entitlements
+
+
+class TestAWSProductEntitlements:
+    @fixture(autouse=True)
+    def inject_fixtures(self, caplog):
+        self._caplog = caplog
+
+    def setup_method(self, cls):
+        clear_clients()
+        region_stats.clear()
+        entitlement_cache.clear()
+        # as in a fresh process, no AWSCustomerEntitlement ran yet
+        entitlement_cache.configure(0, 1024)
+
+    def entitlement(self, customer_id, dimension):
+        return {
+            'CustomerIdentifier': customer_id,
+            'Dimension': dimension,
+            'ExpirationDate': 'some',
+            'ProductCode': 'product',
+            'Value': {'IntegerValue': 1}
+        }
+
+    def normalized(self, dimension):
+        return {
+            'expirationDate': 'some',
+            'dimension': dimension,
+            'value': {
+                'booleanValue': False,
+                'doubleValue': 0,
+                'integerValue': 1,
+                'stringValue': ''
             }
+        }
+
+    @patch('boto3.client')
+    @patch('resolve_customer.entitlements.Defaults.get_assume_role_config')
+    @patch('resolve_customer.entitlements.AWSAssumeRole')
+    def test_bulk_entitlements(
+        self, mock_AWSAssumeRole, mock_get_assume_role_config,
+        mock_boto_client
+    ):
+        mock_get_assume_role_config.return_value = dict(
+            role_config, entitlement_filter_size=2,
+            entitlement_cache={'ttl': 60}
+        )
+        marketplace = mock_boto_client.return_value
+
+        def get_entitlements(ProductCode, Filter, NextToken=None):
+            customers = Filter['CUSTOMER_IDENTIFIER']
+            if customers == ['a', 'b'] and not NextToken:
+                return {
+                    'Entitlements': [self.entitlement('a', 'one')],
+                    'NextToken': 'page-2'
+                }
+            if customers == ['a', 'b']:
+                return {
+                    'Entitlements': [
+                        self.entitlement('a', 'two'),
+                        self.entitlement('b', 'one')
+                    ]
+                }
+            return {'Entitlements': []}
+
+        marketplace.get_entitlements.side_effect = get_entitlements
+        bulk = AWSProductEntitlements('product', ['a', 'b', 'a', 'c', ''])
+        assert bulk.error == {}
+        assert bulk.get_customer_entitlements() == {
+            'a': [self.normalized('one'), self.normalized('two')],
+            'b': [self.normalized('one')],
+            'c': []
+        }
+        assert bulk.get_entitlements('b') == [self.normalized('one')]
+        assert bulk.get_entitlements('unknown') == []
+        assert marketplace.get_entitlements.call_count == 3
+        assert entitlement_cache.get(('c', 'product')) == []
+        assert entitlement_cache.get(('a', 'product')) == [
+            self.normalized('one'), self.normalized('two')
         ]
+        assert region_stats.get_stats()['latency'] == {}
+
+        # cached customers are not requested again
+        marketplace.get_entitlements.reset_mock()
+        bulk = AWSProductEntitlements('product', ['a', 'c'])
+        assert not marketplace.get_entitlements.called
+        assert bulk.get_customer_entitlements() == {
+            'a': [self.normalized('one'), self.normalized('two')],
+            'c': []
+        }
+        bulk = AWSProductEntitlements('product', ['b', 'd'])
+        assert marketplace.get_entitlements.call_args_list == [
+            call(
+                ProductCode='product',
+                Filter={'CUSTOMER_IDENTIFIER': ['d']}
+            )
+        ]
+        assert bulk.get_customer_entitlements() == {
+            'b': [self.normalized('one')],
+            'd': []
+        }
+
+    @patch('boto3.client')
+    @patch('resolve_customer.entitlements.Defaults.get_assume_role_config')
+    @patch('resolve_customer.entitlements.AWSAssumeRole')
+    def test_bulk_entitlements_fails(
+        self, mock_AWSAssumeRole, mock_get_assume_role_config,
+        mock_boto_client
+    ):
+        mock_get_assume_role_config.return_value = role_config
+        error_response = error_record(400, 'throttled')
+        error_response['Error']['Code'] = 'ThrottlingException'
+        mock_boto_client.return_value.get_entitlements.side_effect = \
+            ClientError(
+                operation_name=MagicMock(), error_response=error_response
+            )
+        with self._caplog.at_level(logging.ERROR):
+            bulk = AWSProductEntitlements('product', ['a'])
+            assert 'throttled' in self._caplog.text
+        assert len(bulk.error_list) == 2
+        assert bulk.error['Error']['Code'] == 'App.Error.EntitlementException'
+        assert bulk.get_customer_entitlements() == {}
+
+    @patch('resolve_customer.entitlements.Defaults.get_assume_role_config')
+    def test_bulk_entitlements_incomplete(self, mock_get_assume_role_config):
+        mock_get_assume_role_config.return_value = role_config
+        with self._caplog.at_level(logging.ERROR):
+            bulk = AWSProductEntitlements('product', [''])
+            assert 'no customer_ids/product_code provided' in \
+                self._caplog.text
+        assert get_failure(bulk.error) == PERMANENT
+        mock_get_assume_role_config.return_value = {'role': {}}
+        assert get_failure(
+            AWSProductEntitlements('product', ['a']).error
+        ) == TRANSIENT
@@ -1,5 +1,5 @@
 from resolve_customer.error import (
-    classify_error, error_record
+    classify_error, error_record, get_failure, TRANSIENT, PERMANENT
 )
 
 
@@ -13,3 +13,20 @@ class TestErrorMethods:
         )
         assert error_classified['ResponseMetadata']['HTTPStatusCode'] == 500
         assert error_classified['Error']['Code'] == 'SomeException'
+
+    def test_get_failure(self):
+        assert get_failure(error_record(400, 'some_error')) == PERMANENT
+        assert get_failure(error_record(503, 'some_error')) == TRANSIENT
+        assert get_failure(error_record(429, 'some_error')) == TRANSIENT
+        assert get_failure(
+            error_record(500, 'some_error', failure=PERMANENT)
+        ) == PERMANENT
+        throttled = error_record(400, 'some_error')
+        throttled['Error']['Code'] = 'ThrottlingException'
+        assert get_failure(throttled) == TRANSIENT
+        # classification keeps the failure class of the original code
+        throttled = classify_error(
+            throttled, 'ThrottlingException', 400, 'App.Error.Some'
+        )
+        assert throttled['Error']['Code'] == 'App.Error.Some'
+        assert get_failure(throttled) == TRANSIENT
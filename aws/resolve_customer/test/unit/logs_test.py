@@ -0,0 +1,103 @@
+import json
+import logging
+import sys
+from unittest.mock import patch
+
+from pytest import fixture
+from resolve_customer.logs import (
+    redact, Payload, log_payload, JSONFormatter, configure_logging
+)
+
+
+class TestLogs:
+    @fixture(autouse=True)
+    def inject_fixtures(self, caplog):
+        self._caplog = caplog
+
+    def setup_method(self, cls):
+        self.logger = logging.getLogger('logs_test')
+        self.event = {
+            'body': json.dumps({'registrationToken': 'secret-token'}),
+            'config': {'auth_token': 'secret'},
+            'records': [{'Authorization': 'Bearer secret'}],
+            'text': '{no-json'
+        }
+
+    def test_redact(self):
+        assert redact(self.event) == {
+            'body': '{"registrationToken": "***"}',
+            'config': {'auth_token': '***'},
+            'records': [{'Authorization': '***'}],
+            'text': '{no-json'
+        }
+        assert redact(
+            json.dumps({'registrationToken': 'secret-token'}).encode()
+        ) == '{"registrationToken": "***"}'
+        # the original data is not modified
+        assert self.event['config'] == {'auth_token': 'secret'}
+
+    def test_payload(self):
+        assert 'secret' not in format(Payload(self.event))
+
+    def test_log_payload(self):
+        with self._caplog.at_level(logging.INFO):
+            log_payload(self.logger, 'EVENT', self.event, 0)
+            log_payload(self.logger, 'EVENT', self.event, None)
+            assert 'EVENT' not in self._caplog.text
+            log_payload(self.logger, 'EVENT', self.event, 1)
+            assert 'EVENT: {' in self._caplog.text
+            assert 'secret' not in self._caplog.text
+        self._caplog.clear()
+        with self._caplog.at_level(logging.INFO):
+            with patch('resolve_customer.logs.random.random') as mock_random:
+                mock_random.return_value = 0.5
+                log_payload(self.logger, 'EVENT', self.event, 0.1)
+                assert 'EVENT' not in self._caplog.text
+                log_payload(self.logger, 'EVENT', self.event, 0.9)
+                assert 'EVENT' in self._caplog.text
+        self._caplog.clear()
+        with self._caplog.at_level(logging.WARNING):
+            with patch.object(Payload, '__str__') as mock_str:
+                log_payload(self.logger, 'EVENT', self.event, 1)
+                # nothing is formatted if INFO is disabled
+                assert not mock_str.called
+
+    def test_json_formatter(self):
+        record = self.logger.makeRecord(
+            'logs_test', logging.INFO, __file__, 1, 'Record %s done',
+            ('id-0',), None, extra={
+                'fields': {'messageId': 'id-0', 'auth_token': 'secret'}
+            }
+        )
+        entry = json.loads(JSONFormatter().format(record))
+        assert entry['level'] == 'INFO'
+        assert entry['logger'] == 'logs_test'
+        assert entry['message'] == 'Record id-0 done'
+        assert entry['messageId'] == 'id-0'
+        assert entry['auth_token'] == '***'
+        assert entry['timestamp'].endswith('Z')
+        try:
+            raise ValueError('some-error')
+        except ValueError:
+            record = self.logger.makeRecord(
+                'logs_test', logging.ERROR, __file__, 1, 'failed', (),
+                sys.exc_info()
+            )
+        assert 'some-error' in json.loads(
+            JSONFormatter().format(record)
+        )['exception']
+
+    def test_configure_logging(self):
+        handler = logging.StreamHandler()
+        root = logging.getLogger()
+        root.addHandler(handler)
+        try:
+            configure_logging('')
+            assert not isinstance(handler.formatter, JSONFormatter)
+            configure_logging('json')
+            formatter = handler.formatter
+            assert isinstance(formatter, JSONFormatter)
+            configure_logging('json')
+            assert handler.formatter is formatter
+        finally:
+            root.removeHandler(handler)
@@ -0,0 +1,74 @@
+import json
+from unittest.mock import patch, MagicMock
+
+from pytest import raises
+from botocore.exceptions import ClientError
+from resolve_customer.error import error_record
+from resolve_customer.metrics import (
+    Metrics, metrics, write_stdout, MAX_VALUES
+)
+
+
+class TestMetrics:
+    def setup_method(self, cls):
+        self.records = []
+        self.metrics = Metrics('Test')
+        self.metrics.set_sink(self.records.append)
+
+    @patch('resolve_customer.metrics.time.perf_counter')
+    def test_timer(self, mock_perf_counter):
+        mock_perf_counter.side_effect = [1, 1.5, 2, 2.25, 3, 3.125]
+        with self.metrics.timer('ResolveCustomer', 'us-east-1'):
+            pass
+        with raises(ClientError):
+            with self.metrics.timer('ResolveCustomer', 'us-east-1'):
+                raise ClientError(
+                    error_record(400, 'some', 'TokenException'),
+                    operation_name=MagicMock()
+                )
+        with raises(ValueError):
+            with self.metrics.timer('SendNotification', action='some'):
+                raise ValueError('some')
+        records = self.metrics.flush()
+        assert [json.loads(record) for record in self.records] == records
+        assert records[0]['_aws']['CloudWatchMetrics'] == [
+            {
+                'Namespace': 'Test',
+                'Dimensions': [['Region', 'Action', 'Outcome']],
+                'Metrics': [
+                    {'Name': 'ResolveCustomer', 'Unit': 'Milliseconds'}
+                ]
+            }
+        ]
+        assert [
+            (
+                record['Region'], record['Action'], record['Outcome'],
+                record.get('ResolveCustomer') or record.get('SendNotification')
+            ) for record in records
+        ] == [
+            ('us-east-1', 'none', 'success', [500]),
+            ('us-east-1', 'none', 'App.Error.TokenException', [250]),
+            ('none', 'some', 'ValueError', [125])
+        ]
+        # flush clears the collected values
+        assert self.metrics.flush() == []
+
+    def test_flush_chunks_values(self):
+        for count in range(MAX_VALUES + 1):
+            self.metrics.record('DeleteMessage', 0.001, 'us-east-1')
+        self.metrics.record('SendNotification', 0.002, 'us-east-1')
+        records = self.metrics.flush()
+        assert len(records) == 2
+        assert len(records[0]['DeleteMessage']) == MAX_VALUES
+        assert records[0]['SendNotification'] == [2]
+        assert records[1]['DeleteMessage'] == [1]
+        assert 'SendNotification' not in records[1]
+        assert records[1]['_aws']['CloudWatchMetrics'][0]['Metrics'] == [
+            {'Name': 'DeleteMessage', 'Unit': 'Milliseconds'}
+        ]
+
+    def test_write_stdout(self, capsys):
+        metrics.set_sink()
+        assert metrics.sink == write_stdout
+        write_stdout('{}')
+        assert capsys.readouterr().out == '{}\n'
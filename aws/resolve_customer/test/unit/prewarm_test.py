@@ -0,0 +1,151 @@
+import logging
+from datetime import (
+    datetime, timedelta, timezone
+)
+from unittest.mock import (
+    patch, MagicMock, Mock
+)
+from pytest import fixture
+
+from resolve_customer.defaults import Defaults
+from resolve_customer.client import clear_clients
+from resolve_customer.assume_role import AWSAssumeRole
+from resolve_customer.prewarm import (
+    prewarm, prewarm_on_init, open_connection, is_warmup_event, warm_up
+)
+
+role_config = Defaults.get_assume_role_config('../data/assume_role.yml')
+
+
+class TestPrewarm:
+    @fixture(autouse=True)
+    def inject_fixtures(self, caplog, monkeypatch):
+        self._caplog = caplog
+        self._monkeypatch = monkeypatch
+
+    def setup_method(self, cls):
+        clear_clients()
+        AWSAssumeRole.clear_cache()
+
+    @patch('resolve_customer.prewarm.open_connection')
+    @patch('boto3.client')
+    def test_prewarm(self, mock_boto_client, mock_open_connection):
+        self._monkeypatch.setenv('AWS_REGION', 'eu-west-1')
+        mock_boto_client.return_value.assume_role.return_value = {
+            'Credentials': {
+                'AccessKeyId': 'key',
+                'SecretAccessKey': 'secret',
+                'SessionToken': 'token',
+                'Expiration': '2100-01-01T00:00:00+00:00'
+            }
+        }
+        with self._caplog.at_level(logging.INFO):
+            report = prewarm(role_config, sqs_client_config={'retries': {}})
+        regions = list(role_config['role'])
+        assert report == dict.fromkeys(regions + ['eu-west-1'], 'ok')
+        services = [
+            call_args.args[0] for call_args in
+            mock_boto_client.call_args_list
+        ]
+        assert services.count('sts') == 1
+        assert services.count('meteringmarketplace') == len(regions)
+        assert services.count('sqs') == len(regions) + 1
+        # one marketplace-entitlement client per set of credentials
+        assert services.count('marketplace-entitlement') == 1
+        assert mock_open_connection.call_count == 3 * len(regions) + 1
+        assert 'Pre-warmed region' in self._caplog.text
+
+    @patch('boto3.client')
+    def test_prewarm_failure(self, mock_boto_client):
+        mock_boto_client.return_value.assume_role.side_effect = \
+            Exception('STS down')
+        report = prewarm(role_config, ('meteringmarketplace',))
+        assert set(report.values()) == {'Exception: STS down'}
+        assert AWSAssumeRole._cache == {}
+        assert 'Pre-warming region' in self._caplog.text
+
+    def test_prewarm_no_regions(self):
+        self._monkeypatch.delenv('AWS_REGION', raising=False)
+        assert prewarm({}) == {}
+
+    @patch('resolve_customer.prewarm.prewarm')
+    def test_prewarm_on_init(self, mock_prewarm):
+        self._monkeypatch.delenv('PREWARM_CLIENTS', raising=False)
+        assert prewarm_on_init() == {}
+        assert not mock_prewarm.called
+        self._monkeypatch.setenv('PREWARM_CLIENTS', 'true')
+        get_sqs_config = Mock(return_value={'client_config': {'a': 1}})
+        with patch(
+            'resolve_customer.prewarm.Defaults.get_assume_role_config',
+            return_value=role_config
+        ):
+            assert prewarm_on_init(
+                ('sqs',), get_sqs_config
+            ) == mock_prewarm.return_value
+            mock_prewarm.assert_called_once_with(
+                role_config, ('sqs',), {'a': 1}
+            )
+        with patch(
+            'resolve_customer.prewarm.Defaults.get_assume_role_config',
+            side_effect=ValueError('broken')
+        ):
+            assert prewarm_on_init() == {}
+        assert 'Pre-warming skipped' in self._caplog.text
+
+    def test_open_connection(self):
+        client = MagicMock()
+        client.meta.endpoint_url = 'https://sqs.us-east-1.amazonaws.com'
+        open_connection(client)
+        request = client._endpoint.http_session.send.call_args.args[0]
+        assert request.method == 'GET'
+        assert request.url == 'https://sqs.us-east-1.amazonaws.com'
+
+    def test_is_warmup_event(self):
+        assert is_warmup_event({'warmup': True})
+        assert not is_warmup_event({'warmup': 'yes'})
+        assert not is_warmup_event({'body': '{}'})
+        assert not is_warmup_event(None)
+
+    @patch('resolve_customer.prewarm.open_connection')
+    @patch('resolve_customer.prewarm.Defaults.get_assume_role_config')
+    @patch('boto3.client')
+    def test_warm_up(
+        self, mock_boto_client, mock_get_assume_role_config,
+        mock_open_connection
+    ):
+        mock_get_assume_role_config.return_value = role_config
+        expiration = datetime.now(timezone.utc) + timedelta(minutes=10)
+        for role in role_config['role'].values():
+            AWSAssumeRole._cache[(role['arn'], role['session'])] = {
+                'Credentials': {
+                    'AccessKeyId': 'old', 'Expiration': expiration
+                }
+            }
+        mock_boto_client.return_value.assume_role.return_value = {
+            'Credentials': {
+                'AccessKeyId': 'new',
+                'Expiration': expiration + timedelta(hours=1)
+            }
+        }
+        report = warm_up(('meteringmarketplace',))
+        assert report['warmup'] is True
+        assert report['config'] == 'ok'
+        assert report['regions'] == dict.fromkeys(role_config['role'], 'ok')
+        assert report['seconds'] >= 0
+        # credentials expiring within warmup_refresh_margin are refreshed
+        assert mock_boto_client.return_value.assume_role.call_count == 2
+        assert {
+            response['Credentials']['AccessKeyId']
+            for response in AWSAssumeRole._cache.values()
+        } == {'new'}
+
+    @patch('resolve_customer.prewarm.prewarm')
+    @patch('resolve_customer.prewarm.Defaults.get_assume_role_config')
+    def test_warm_up_invalid_config(
+        self, mock_get_assume_role_config, mock_prewarm
+    ):
+        mock_get_assume_role_config.side_effect = ValueError('broken')
+        report = warm_up()
+        assert report['config'] == 'ValueError: broken'
+        assert 'regions' not in report
+        assert not mock_prewarm.called
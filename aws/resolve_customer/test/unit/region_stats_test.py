@@ -0,0 +1,95 @@
+import json
+import logging
+from unittest.mock import patch
+from pytest import (
+    fixture, approx
+)
+
+from resolve_customer.region_stats import RegionStats
+
+
+class TestRegionStats:
+    @fixture(autouse=True)
+    def inject_fixtures(self, caplog):
+        self._caplog = caplog
+
+    def setup_method(self, cls):
+        self.stats = RegionStats()
+
+    def test_order(self):
+        regions = ['us-east-1', 'eu-central-1', 'us-west-2']
+        assert self.stats.order(regions) == [
+            'eu-central-1', 'us-east-1', 'us-west-2'
+        ]
+        self.stats.record('us-west-2', 0.2, False)
+        self.stats.record('us-east-1', 0.1, True, ('', 'product'))
+        assert self.stats.order(regions) == [
+            'us-east-1', 'us-west-2', 'eu-central-1'
+        ]
+        assert self.stats.order(regions, 'product') == [
+            'us-east-1', 'us-west-2', 'eu-central-1'
+        ]
+        assert self.stats.order(regions, 'other') == [
+            'us-east-1', 'us-west-2', 'eu-central-1'
+        ]
+        self.stats.record('us-west-2', 0.0, True, ('other',))
+        assert self.stats.order(regions, 'other') == [
+            'us-west-2', 'us-east-1', 'eu-central-1'
+        ]
+
+    def test_record_latency_ewma(self):
+        self.stats.record('us-east-1', 1.0, True)
+        self.stats.record('us-east-1', 2.0, True, (None,))
+        assert self.stats.get_stats()['latency'] == {
+            'us-east-1': approx(1.3)
+        }
+
+    def test_record_success(self):
+        self.stats.record('us-east-1', 1.0, True, ('product',))
+        self.stats.record_success('eu-central-1', ('product', None))
+        assert self.stats.get_stats()['last_success'] == {
+            'product': 'eu-central-1'
+        }
+        assert self.stats.get_stats()['latency'] == {'us-east-1': 1.0}
+
+    def test_get_stats(self):
+        assert self.stats.get_stats()['hit_rate'] == 0.0
+        self.stats.record_lookup(True)
+        self.stats.record_lookup(True)
+        self.stats.record_lookup(True)
+        self.stats.record_lookup(False)
+        self.stats.record('us-east-1', 1.0, True, ('product',))
+        assert self.stats.get_stats() == {
+            'lookups': 4,
+            'first_region_hits': 3,
+            'hit_rate': 0.75,
+            'last_success': {'product': 'us-east-1'},
+            'latency': {'us-east-1': 1.0}
+        }
+
+    def test_persistence(self, tmp_path):
+        stats_file = format(tmp_path / 'region_stats.json')
+        self.stats.set_stats_file(stats_file)
+        self.stats.record('us-east-1', 1.0, True, ('product',))
+        stats = RegionStats()
+        stats.set_stats_file(stats_file)
+        stats.set_stats_file(stats_file)
+        assert stats.order(['eu-central-1', 'us-east-1'], 'product') == [
+            'us-east-1', 'eu-central-1'
+        ]
+        with open(stats_file) as data:
+            assert json.load(data) == {
+                'last_success': {'product': 'us-east-1'},
+                'latency': {'us-east-1': 1.0}
+            }
+
+    def test_persistence_fails(self, tmp_path):
+        with self._caplog.at_level(logging.INFO):
+            self.stats.set_stats_file(format(tmp_path / 'missing.json'))
+            assert 'No region stats loaded' in self._caplog.text
+        with patch('builtins.open') as mock_open:
+            mock_open.side_effect = OSError('read-only')
+            with self._caplog.at_level(logging.ERROR):
+                self.stats.record('us-east-1', 1.0, True)
+                assert 'Failed to store region stats: read-only' in \
+                    self._caplog.text
@@ -1,5 +1,11 @@
 #!/usr/bin/python3
 from sqs_event_manager.app import lambda_handler as sqs_event_manager_lambda
+from sqs_event_manager.app import warmup_services
+from sqs_event_manager.defaults import Defaults
+from resolve_customer.prewarm import prewarm_on_init
+
+# runs in the lambda init phase if PREWARM_CLIENTS is set
+prewarm_on_init(warmup_services, Defaults.get_sqs_event_manager_config)
 
 
 def lambda_handler(event, context):
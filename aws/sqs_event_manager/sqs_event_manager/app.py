@@ -21,18 +21,40 @@ AWS Metering/Entitlement Marketplace API's
 """
 import json
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
-
+from botocore.exceptions import ClientError
 from sqs_event_manager.defaults import Defaults
-from sqs_event_manager.queue import delete_message
+from sqs_event_manager.dead_letter import send_to_dead_letter
+from sqs_event_manager.deadline import (
+    Deadline, record_times, DEFAULT_SAFETY_MARGIN
+)
+from sqs_event_manager.session import (
+    deadline_scope, get_session, get_timeout, warm_up_session
+)
+from sqs_event_manager.queue import (
+    delete_message, delete_messages
+)
 from sqs_event_manager.message import AWSSNSMessage
-from resolve_customer.entitlements import AWSCustomerEntitlement
+from resolve_customer.entitlements import (
+    AWSCustomerEntitlement,
+    AWSProductEntitlements,
+    invalidate_entitlements,
+    get_entitlement_cache_stats
+)
+from resolve_customer.metrics import metrics
+from resolve_customer.prewarm import (
+    is_warmup_event, warm_up
+)
+from resolve_customer.logs import (
+    configure_logging, log_payload
+)
 from resolve_customer.error import (
-    error_record, error_response
+    error_record, error_response, get_failure, TRANSIENT, PERMANENT
 )
 from typing import (
-    Dict, Union
+    Callable, Dict, List, Mapping, Optional, Tuple, Union
 )
 
 logger = logging.getLogger('sqs_event_manager')
@@ -41,6 +63,14 @@ logger.setLevel('INFO')
 # Topic name for this lambda
 topic = 'SubscriptionEvent'
 
+# Services called by this lambda, pre-warmed and kept warm
+warmup_services = ('marketplace-entitlement', 'sqs')
+
+# Actions which report a change of the customer entitlements
+entitlement_change_actions = (
+    'entitlement-updated', 'subscribe-success', 'unsubscribe-success'
+)
+
 
 def lambda_handler(event, context):
     """
@@ -86,17 +116,60 @@ def lambda_handler(event, context):
             }
         ]
     }
+
+    With report_batch_item_failures set in the config, the handler
+    returns a partial batch response listing only the failed
+    messages and leaves deleting the others to Lambda:
+
+    {
+        'batchItemFailures': [
+            {
+                'itemIdentifier': 'messageId of failed record'
+            }
+        ]
+    }
+
+    A warm-up event {"warmup": true} only refreshes the credentials,
+    clients, HTTP connections and config, see handle_warmup
     """
+    config = {}
     try:
-        logger.info(f'EVENT: {event}')
-        logger.info(f'CONTEXT: {context}')
+        if is_warmup_event(event):
+            return json.dumps(
+                {
+                    'isBase64Encoded': False,
+                    'statusCode': 200,
+                    'body': handle_warmup()
+                }
+            )
+        records = event['Records']
+        config = Defaults.get_sqs_event_manager_config()
+        configure_logging(config.get('log_format'))
+        logger.info(
+            'Request %s with %d record(s)',
+            getattr(context, 'aws_request_id', 'unknown'), len(records)
+        )
+        log_payload(logger, 'EVENT', event, config.get('log_sample_rate'))
+        deadline = Deadline.from_context(
+            context, config.get('deadline_safety_margin', DEFAULT_SAFETY_MARGIN)
+        )
+        if config.get('report_batch_item_failures'):
+            # Lambda deletes the messages not reported as failed,
+            # the acknowledge list is only used to skip the deletes
+            results = process_records(records, config, [], deadline)
+            route_failures(records, results, config)
+            logger.info('Entitlement cache: %s', get_entitlement_cache_stats())
+            return get_batch_item_failures(results)
+        acknowledge = []
+        results = process_records(records, config, acknowledge, deadline)
+        route_failures(records, results, config, acknowledge)
+        acknowledge_messages(
+            acknowledge, results, config.get('client_config')
+        )
         sqs_batch_response = {
-            'batchItemFailures': []
+            'batchItemFailures': results
         }
-        for message in event['Records']:
-            sqs_batch_response['batchItemFailures'].append(
-                process_message(message)
-            )
+        logger.info('Entitlement cache: %s', get_entitlement_cache_stats())
         return json.dumps(
             {
                 'isBase64Encoded': False,
@@ -105,6 +178,9 @@ def lambda_handler(event, context):
             }
         )
     except Exception as error:
+        if config.get('report_batch_item_failures'):
+            # let Lambda retry the whole batch
+            raise
         return json.dumps(
             error_response(
                 error_record(
@@ -113,14 +189,413 @@ def lambda_handler(event, context):
                 ), topic
             )
         )
+    finally:
+        # emit the latency metrics of this invocation
+        metrics.flush()
+
+
+def handle_warmup() -> Dict:
+    """
+    Refresh credentials and clients as done by prewarm.warm_up
+    and touch the HTTP connections to the notification endpoints
+    """
+    start = time.monotonic()
+    report = warm_up(warmup_services, Defaults.get_sqs_event_manager_config)
+    if report['config'] == 'ok':
+        report['http'] = warm_up_session(
+            Defaults.get_sqs_event_manager_config()
+        )
+    report['seconds'] = round(time.monotonic() - start, 3)
+    return report
+
+
+def process_records(
+    records: List[Dict], config: Mapping,
+    acknowledge: Optional[List[Dict[str, str]]] = None,
+    deadline: Optional[Deadline] = None
+) -> List[Dict[str, Union[str, bool]]]:
+    """
+    Process the records of an SQS batch and return their results
+    in the order of the records
+
+    With batch_workers > 1 in the config, records are processed
+    in parallel on a thread pool. With keep_customer_order set,
+    records of the same customer are processed one after the
+    other in the order they were received.
+    Each record is decoded once, see parse_message, and the
+    message is shared by all processing steps. The entitlements
+    of each customer and product of the batch are fetched only
+    once, see prefetch_entitlements.
+    See process_message for acknowledge and process_record
+    for deadline.
+    """
+    messages = [parse_message(record) for record in records]
+    prefetched = prefetch_entitlements(messages, config, deadline)
+    workers = config.get('batch_workers') or 1
+    if workers <= 1 or len(records) <= 1:
+        return [
+            process_record(
+                record, acknowledge, prefetched, deadline, message
+            ) for record, message in zip(records, messages)
+        ]
+    groups = group_records(records, config, messages)
+    results: List[Dict[str, Union[str, bool]]] = [{}] * len(records)
+
+    def process_group(indexes: List[int]) -> None:
+        for index in indexes:
+            results[index] = process_record(
+                records[index], acknowledge, prefetched, deadline,
+                messages[index]
+            )
+
+    with ThreadPoolExecutor(
+        max_workers=min(workers, len(groups))
+    ) as executor:
+        for future in [
+            executor.submit(process_group, indexes)
+            for indexes in groups
+        ]:
+            future.result()
+    return results
+
+
+def group_records(
+    records: List[Dict], config: Mapping,
+    messages: Optional[List[Optional[AWSSNSMessage]]] = None
+) -> List[List[int]]:
+    """
+    Return the indexes of the records grouped such that each group
+    can be processed independently of the others. With
+    keep_customer_order set, the records of a customer form a group,
+    otherwise each record is a group of its own. messages are the
+    already decoded records, see parse_message
+    """
+    groups: Dict[str, List[int]] = {}
+    for index, record in enumerate(records):
+        key = get_ordering_key(
+            record, messages[index] if messages else None
+        ) if config.get('keep_customer_order') else format(index)
+        groups.setdefault(key, []).append(index)
+    return list(groups.values())
+
+
+def prefetch_entitlements(
+    messages: List[Optional[AWSSNSMessage]], config: Mapping,
+    deadline: Optional[Deadline] = None
+) -> Dict[Tuple[str, str], AWSCustomerEntitlement]:
+    """
+    Fetch the entitlements of each distinct customer and product
+    code of the batch once, such that records sharing the same
+    customer and product share the result. The customers of a
+    product are requested together through AWSProductEntitlements,
+    which serves customers found in the entitlement_cache first.
+    All pages are fetched here. Pairs that can not be fetched here
+    are left to process_message. messages are the decoded records
+    of the batch, see parse_message. No fetch is started once the
+    remaining time of deadline is lower than the observed p99
+    record time
+    """
+    counts: Dict[Tuple[str, str], int] = {}
+    for message in messages:
+        if message is None:
+            continue
+        try:
+            if message.category and message.category != 'Notification':
+                continue
+            pair = (message.customer_id, message.product_code)
+            if not all(pair):
+                continue
+            if message.action in entitlement_change_actions:
+                # cached entitlements of this customer are outdated
+                invalidate_entitlements(*pair)
+        except Exception:
+            continue
+        counts[pair] = counts.get(pair, 0) + 1
+
+    products: Dict[str, List[str]] = {}
+    for customer_id, product_code in counts:
+        products.setdefault(product_code, []).append(customer_id)
+
+    def allows_prefetch(item: Union[str, Tuple[str, str]]) -> bool:
+        if deadline and not deadline.allows(record_times.p99()):
+            logger.info(
+                'Prefetch of entitlements for %s skipped, '
+                'remaining invocation time too short', item
+            )
+            return False
+        return True
+
+    def fetch_bulk(
+        product_code: str
+    ) -> Dict[Tuple[str, str], AWSCustomerEntitlement]:
+        customers = products[product_code]
+        if not allows_prefetch(product_code):
+            return {}
+        try:
+            bulk = AWSProductEntitlements(product_code, customers)
+        except Exception as error:
+            logger.error(
+                'Prefetch of entitlements for %s failed: %s: %s',
+                product_code, type(error).__name__, error
+            )
+            return {}
+        if bulk.error:
+            return {}
+        logger.info(
+            'Entitlements for product %s: 1 bulk lookup for %d customers',
+            product_code, len(customers)
+        )
+        return {
+            (customer_id, product_code):
+            AWSCustomerEntitlement.from_entitlements(
+                customer_id, product_code, bulk.get_entitlements(customer_id)
+            ) for customer_id in customers
+        }
+
+    def fetch(pair: Tuple[str, str]) -> Optional[AWSCustomerEntitlement]:
+        if not allows_prefetch(pair):
+            return None
+        try:
+            entitlements = AWSCustomerEntitlement(*pair)
+            if entitlements.error:
+                return entitlements
+            # request all pages once instead of once per record
+            return AWSCustomerEntitlement.from_entitlements(
+                pair[0], pair[1], entitlements.get_entitlements()
+            )
+        except Exception as error:
+            logger.error(
+                'Prefetch of entitlements for %s failed: %s: %s',
+                pair, type(error).__name__, error
+            )
+            return None
+
+    def run(function: Callable, items: List) -> List:
+        workers = min(config.get('batch_workers') or 1, len(items))
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                return list(executor.map(function, items))
+        return [function(item) for item in items]
+
+    # products with more than one customer are requested in bulk,
+    # customers of a failed bulk request are fetched one by one
+    prefetched: Dict[Tuple[str, str], AWSCustomerEntitlement] = {}
+    bulk_products = [
+        product_code for product_code, customers in products.items()
+        if len(customers) > 1
+    ]
+    for product_entitlements in run(fetch_bulk, bulk_products):
+        prefetched.update(product_entitlements)
+    pairs = [pair for pair in counts if pair not in prefetched]
+    for pair, entitlements in zip(pairs, run(fetch, pairs)):
+        if entitlements is not None:
+            prefetched[pair] = entitlements
+    for pair in prefetched:
+        logger.info(
+            'Entitlements for customer %s and product %s: '
+            'fetched once for %d record(s)', pair[0], pair[1], counts[pair]
+        )
+    return prefetched
+
+
+def process_record(
+    record: Dict, acknowledge: Optional[List[Dict[str, str]]] = None,
+    prefetched: Optional[Dict[Tuple[str, str], AWSCustomerEntitlement]] = None,
+    deadline: Optional[Deadline] = None,
+    message: Optional[AWSSNSMessage] = None
+) -> Dict[str, Union[str, bool]]:
+    """
+    Process a record such that a failure never affects
+    the processing of the other records of a batch. message is
+    the already decoded record, if any
+
+    If the remaining time of the deadline is lower than the
+    observed p99 record time, the record is not started and
+    reported as a transient failure for redelivery
+    """
+    if deadline and not deadline.allows(record_times.p99()):
+        result: Dict[str, Union[str, bool]] = {
+            'itemIdentifier': record.get('messageId') or 'unknown',
+            'status': 'Not started, remaining invocation time too short',
+            'error': True,
+            'failure': TRANSIENT
+        }
+        logger.error(result['status'])
+        return result
+    start = time.monotonic()
+    try:
+        result = process_message(
+            record, acknowledge, prefetched, deadline, message
+        )
+    except Exception as error:
+        result = {
+            'itemIdentifier': record.get('messageId') or 'unknown',
+            'status': f'{type(error).__name__}: {error}',
+            'error': True,
+            'failure': get_exception_failure(error)
+        }
+        logger.error(result['status'])
+    seconds = time.monotonic() - start
+    record_times.record(seconds)
+    logger.info(
+        'Record %s done in %.3fs, error: %s',
+        result.get('itemIdentifier'), seconds, bool(result.get('error')),
+        extra={
+            'fields': {
+                'messageId': result.get('itemIdentifier'),
+                'error': bool(result.get('error')),
+                'failure': result.get('failure'),
+                'seconds': round(seconds, 3)
+            }
+        }
+    )
+    return result
+
+
+def parse_message(record: Dict) -> Optional[AWSSNSMessage]:
+    """
+    Return the decoded SNS message of the record or None if the
+    SQS body can not be decoded. The SNS payload is decoded on
+    first use and kept in the message for all later steps.
+    process_message reports decoding errors
+    """
+    try:
+        return AWSSNSMessage(record)
+    except Exception:
+        return None
 
 
-def process_message(record: Dict) -> Dict[str, Union[str, bool]]:
+def get_ordering_key(
+    record: Dict, message: Optional[AWSSNSMessage] = None
+) -> str:
+    """
+    Return the customer of the record, records without
+    customer information get a key of their own
+    """
+    try:
+        customer_id = (message or AWSSNSMessage(record)).customer_id
+    except Exception:
+        customer_id = ''
+    return f'customer:{customer_id}' if customer_id \
+        else f'message:{id(record)}'
+
+
+def get_batch_item_failures(
+    results: List[Dict[str, Union[str, bool]]]
+) -> Dict[str, List[Dict[str, str]]]:
+    """
+    Return the partial batch response for the event source mapping
+    with ReportBatchItemFailures, listing only the failed records
+    which were not acknowledged, see route_failures
+    """
+    return {
+        'batchItemFailures': [
+            {'itemIdentifier': format(result.get('itemIdentifier'))}
+            for result in results
+            if result.get('error') and not result.get('acknowledged')
+        ]
+    }
+
+
+def route_failures(
+    records: List[Dict], results: List[Dict[str, Union[str, bool]]],
+    config: Mapping, acknowledge: Optional[List[Dict[str, str]]] = None
+) -> None:
+    """
+    Acknowledge the records of permanently failed messages, such that
+    they are not redelivered, and send them to the dead-letter sink if
+    one is configured in config. Without a sink, the failure is only
+    logged. Transient failures are left for redelivery
+    """
+    dead_letter = config.get('dead_letter')
+    for record, result in zip(records, results):
+        if not result.get('error') or result.get('failure') != PERMANENT:
+            continue
+        if dead_letter:
+            try:
+                send_to_dead_letter(record, result, config)
+            except Exception as error:
+                result['status'] = \
+                    f'{result.get("status")}, dead-letter failed: {error}'
+                result['failure'] = TRANSIENT
+                logger.error(result['status'])
+                continue
+            result['status'] = \
+                f'{result.get("status")}, sent to dead-letter'
+            result['dead_letter'] = True
+            logger.info(result['status'])
+        elif result.get('acknowledged'):
+            # already handled and logged by process_message
+            continue
+        else:
+            result['status'] = f'{result.get("status")}, not redelivered'
+            logger.error(result['status'])
+        result['acknowledged'] = True
+        if acknowledge is not None and not any(
+            message['Id'] == result.get('itemIdentifier')
+            for message in acknowledge
+        ):
+            acknowledge.append(
+                {
+                    'Id': format(result.get('itemIdentifier')),
+                    'QueueArn': record.get('eventSourceARN') or '',
+                    'ReceiptHandle': record.get('receiptHandle') or ''
+                }
+            )
+
+
+def get_exception_failure(error: Exception) -> str:
+    """
+    Return the failure class of an exception raised while
+    processing a message. AWS errors are classified by their
+    response, anything else, e.g. a connection problem or a
+    broken config, is retried. Malformed messages are told
+    apart by process_message before
+    """
+    if isinstance(error, ClientError):
+        return get_failure(error.response)
+    return TRANSIENT
+
+
+def acknowledge_messages(
+    acknowledge: List[Dict[str, str]],
+    results: List[Dict[str, Union[str, bool]]],
+    client_config: Optional[Dict] = None
+) -> None:
+    """
+    Delete the acknowledged messages from their queues in batches.
+    Messages that could not be deleted are marked as failed in
+    their result
+    """
+    failures = delete_messages(acknowledge, client_config)
+    for result in results:
+        failure = failures.get(format(result.get('itemIdentifier')))
+        if failure:
+            result['status'] = \
+                f'{result.get("status")}, message delete failed: {failure}'
+            result['error'] = True
+            logger.error(result['status'])
+
+
+def process_message(
+    record: Dict, acknowledge: Optional[List[Dict[str, str]]] = None,
+    prefetched: Optional[Dict[Tuple[str, str], AWSCustomerEntitlement]] = None,
+    deadline: Optional[Deadline] = None,
+    message: Optional[AWSSNSMessage] = None
+) -> Dict[str, Union[str, bool]]:
     """
     Handle message received from SQS queue
 
     Ensure the message is proper format. Get the customer
     entitlements and send the information to the SCC service.
+
+    The message is deleted from the queue once handled. If an
+    acknowledge list is given, the message is added to it instead
+    such that the caller can delete all messages in batches.
+    Entitlements found in prefetched for the customer and product
+    of the message are used instead of fetching them again.
+    HTTP timeouts are shrunk to the remaining time of deadline.
+    The record is decoded here unless the decoded message is given.
     """
     sqs_event_manager_config = Defaults.get_sqs_event_manager_config()
     result = {
@@ -129,7 +604,18 @@ def process_message(record: Dict) -> Dict[str, Union[str, bool]]:
         'error': True
     }
     try:
-        message = AWSSNSMessage(record)
+        try:
+            if message is None:
+                message = AWSSNSMessage(record)
+            if message.category in ('', 'Notification'):
+                # decodes the SNS payload
+                message.customer_id
+        except Exception as error:
+            # a malformed message fails again when redelivered
+            result['status'] = f'{type(error).__name__}: {error}'
+            result['failure'] = PERMANENT
+            logger.error(result['status'])
+            return result
 
         # All Message data that we handle have the general message Type
         # category set to 'Notification'. There are other categories
@@ -140,22 +626,38 @@ def process_message(record: Dict) -> Dict[str, Union[str, bool]]:
         if message.category and message.category != 'Notification':
             result['status'] = \
                 f'No action implemented for event type: {message.category}'
+            result['failure'] = PERMANENT
             logger.info(result['status'])
+            acknowledge_message(
+                message, result, acknowledge,
+                sqs_event_manager_config.get('client_config')
+            )
             return result
 
         auth_token = sqs_event_manager_config.get('auth_token', '')
         endpoint_missing = 'missing_endpoint_setup'
-        entitlements = AWSCustomerEntitlement(
-            message.customer_id, message.product_code
+        entitlements = (prefetched or {}).get(
+            (message.customer_id, message.product_code)
         )
+        if not entitlements:
+            if message.action in entitlement_change_actions:
+                # cached entitlements of this customer are outdated
+                invalidate_entitlements(
+                    message.customer_id, message.product_code
+                )
+            entitlements = AWSCustomerEntitlement(
+                message.customer_id, message.product_code
+            )
         if entitlements.error:
             result['status'] = \
                 f'AWSCustomerEntitlement failed with {entitlements.error}'
+            result['failure'] = get_failure(entitlements.error)
             logger.error(result['status'])
             return result
 
         if not message.action:
             result['status'] = 'No action defined in SNS message'
+            result['failure'] = PERMANENT
             logger.error(result['status'])
         elif message.action == 'entitlement-updated':
             endpoint_url = sqs_event_manager_config.get(
@@ -164,7 +666,8 @@ def process_message(record: Dict) -> Dict[str, Union[str, bool]]:
             result.update(
                 send_to(
                     entitlement_updated(message, entitlements),
-                    endpoint_url, auth_token
+                    endpoint_url, auth_token, sqs_event_manager_config,
+                    deadline, message.action
                 )
             )
         elif message.action == 'subscribe-success':
@@ -174,7 +677,8 @@ def process_message(record: Dict) -> Dict[str, Union[str, bool]]:
             result.update(
                 send_to(
                     subscription_success(message, entitlements),
-                    endpoint_url, auth_token
+                    endpoint_url, auth_token, sqs_event_manager_config,
+                    deadline, message.action
                 )
             )
         elif message.action == 'unsubscribe-success':
@@ -184,7 +688,8 @@ def process_message(record: Dict) -> Dict[str, Union[str, bool]]:
             result.update(
                 send_to(
                     subscription_removed(message, entitlements),
-                    endpoint_url, auth_token
+                    endpoint_url, auth_token, sqs_event_manager_config,
+                    deadline, message.action
                 )
             )
         elif message.action == 'subscribe-fail':
@@ -194,7 +699,8 @@ def process_message(record: Dict) -> Dict[str, Union[str, bool]]:
             result.update(
                 send_to(
                     subscription_failed(message, entitlements),
-                    endpoint_url, auth_token
+                    endpoint_url, auth_token, sqs_event_manager_config,
+                    deadline, message.action
                 )
             )
         elif message.action == 'unsubscribe-pending':
@@ -204,23 +710,57 @@ def process_message(record: Dict) -> Dict[str, Union[str, bool]]:
             result.update(
                 send_to(
                     subscription_removal_pending(message, entitlements),
-                    endpoint_url, auth_token
+                    endpoint_url, auth_token, sqs_event_manager_config,
+                    deadline, message.action
                 )
             )
         else:
             result['status'] = f'Action type {message.action}: not implemented'
+            result['failure'] = PERMANENT
             logger.error(result['status'])
 
-        # Always clean up message from the queue except on a raise condition
-        delete_message(
-            message.event_source_arn, message.receipt_handle
+        if result['error'] and result.get('failure') == TRANSIENT:
+            # keep the message in the queue for redelivery
+            return result
+
+        # Clean up message from the queue except on a raise condition
+        acknowledge_message(
+            message, result, acknowledge,
+            sqs_event_manager_config.get('client_config')
         )
     except Exception as error:
         result['status'] = f'{type(error).__name__}: {error}'
+        result['failure'] = get_exception_failure(error)
         logger.error(result['status'])
     return result
 
 
+def acknowledge_message(
+    message: AWSSNSMessage, result: Dict[str, Union[str, bool]],
+    acknowledge: Optional[List[Dict[str, str]]] = None,
+    client_config: Optional[Dict] = None
+) -> None:
+    """
+    Delete the message from its queue or add it to the acknowledge
+    list if given. A failed result is marked as acknowledged, such
+    that a message which can not be acted on is not redelivered
+    """
+    if acknowledge is None:
+        delete_message(
+            message.event_source_arn, message.receipt_handle, client_config
+        )
+    else:
+        acknowledge.append(
+            {
+                'Id': format(result['itemIdentifier']),
+                'QueueArn': message.event_source_arn,
+                'ReceiptHandle': message.receipt_handle
+            }
+        )
+    if result['error']:
+        result['acknowledged'] = True
+
+
 def subscription_success(
     message: AWSSNSMessage, entitlements: AWSCustomerEntitlement
 ) -> Dict:
@@ -280,26 +820,42 @@ def entitlement_updated(
 
 
 def send_to(
-    request_data: Dict, endpoint_url: str, auth_token: str = ''
+    request_data: Dict, endpoint_url: str, auth_token: str = '',
+    config: Optional[Mapping] = None, deadline: Optional[Deadline] = None,
+    action: str = ''
 ) -> Dict:
     """
     Send POST request with notification data to given endpoint.
+    The request uses the pooled HTTP session and timeouts as
+    configured in config, shrunk to the remaining time of deadline.
+    Retries are only done while they fit into the deadline.
+    The request is timed as SendNotification metric for action.
     The method raises an exception if the request fails
     """
+    config = config or {}
     headers = {
         'Content-Type': 'application/json'
     }
     if auth_token:
         headers['Authorization'] = f'Bearer {auth_token}'
-    logger.info(f'Sending POST data to {endpoint_url}: {request_data}')
-    http_post_response = requests.post(
-        endpoint_url, json=request_data, headers=headers
+    logger.info('Sending POST data to %s', endpoint_url)
+    log_payload(
+        logger, 'POST data', request_data, config.get('log_sample_rate')
     )
+    timeout = get_timeout(config, deadline)
+    with metrics.timer('SendNotification', action=action) as timing:
+        with deadline_scope(deadline, sum(timeout)):
+            http_post_response = get_session(config).post(
+                endpoint_url, json=request_data, headers=headers,
+                timeout=timeout
+            )
+        timing.outcome = format(http_post_response.status_code)
     status_code = http_post_response.status_code
     if status_code != 200:
         result = {
             'status': f'Event report failed with: {status_code}:{http_post_response.text or "no response text"}',
-            'error': True
+            'error': True,
+            'failure': get_failure(error_record(status_code, ''))
         }
         logger.error(result['status'])
     else:
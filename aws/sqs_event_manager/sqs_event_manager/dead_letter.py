@@ -0,0 +1,53 @@
+# Copyright (c) 2025 SUSE LLC.  All rights reserved.
+#
+# This file is part of suse-saas-tools
+#
+# suse-saas-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mash is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mash.  If not, see <http://www.gnu.org/licenses/>
+#
+import json
+import time
+from typing import (
+    Dict, Mapping, Union
+)
+
+from sqs_event_manager.queue import send_message
+
+
+def send_to_dead_letter(
+    record: Dict, result: Dict[str, Union[str, bool]], config: Mapping
+) -> None:
+    """
+    Store the record of a permanently failed message together with
+    its result in the dead-letter sink configured in config. The
+    sink is either a local file, one JSON document per line, or an
+    SQS queue. Raises if the record could not be stored
+    """
+    sink: Mapping = config.get('dead_letter') or {}
+    entry = json.dumps(
+        {
+            'timestamp': time.time(),
+            'record': record,
+            'result': result
+        }
+    )
+    if sink.get('file'):
+        with open(sink['file'], 'a') as dead_letter:
+            dead_letter.write(f'{entry}\n')
+    elif sink.get('queue_url'):
+        send_message(
+            sink['queue_url'], entry, sink.get('region') or 'us-east-1',
+            sink.get('endpoint_url'), config.get('client_config')
+        )
+    else:
+        raise ValueError('no dead_letter file or queue_url configured')
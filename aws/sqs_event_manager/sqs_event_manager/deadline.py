@@ -0,0 +1,119 @@
+# Copyright (c) 2025 SUSE LLC.  All rights reserved.
+#
+# This file is part of suse-saas-tools
+#
+# suse-saas-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mash is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mash.  If not, see <http://www.gnu.org/licenses/>
+#
+import math
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+# Seconds of the remaining invocation time kept in reserve
+# for acknowledging the messages and returning the response
+DEFAULT_SAFETY_MARGIN = 1.0
+
+# Lower bound in seconds for timeouts shrunk to the deadline
+MIN_TIMEOUT = 0.1
+
+# Number of most recent record times the p99 is computed from
+RECORD_TIME_SAMPLES = 200
+
+
+class RecordTimes:
+    """
+    In-process statistic of the time it took to process a record
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.samples: deque = deque(maxlen=RECORD_TIME_SAMPLES)
+
+    def record(self, seconds: float) -> None:
+        with self.lock:
+            self.samples.append(seconds)
+
+    def p99(self) -> float:
+        """
+        Return the 99th percentile of the observed record times,
+        0 if no record was observed yet
+        """
+        with self.lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return 0.0
+        return samples[math.ceil(0.99 * len(samples)) - 1]
+
+
+# Process wide record time statistic, survives warm invocations
+record_times = RecordTimes()
+
+
+class Deadline:
+    """
+    Time budget of a Lambda invocation
+
+    The budget is taken from context.get_remaining_time_in_millis()
+    minus safety_margin seconds. Without a Lambda context the
+    budget is unlimited
+    """
+    def __init__(
+        self, remaining_millis: Optional[float] = None,
+        safety_margin: float = DEFAULT_SAFETY_MARGIN
+    ):
+        self.expires: Optional[float] = None
+        if remaining_millis is not None:
+            self.expires = \
+                time.monotonic() + remaining_millis / 1000 - safety_margin
+
+    @classmethod
+    def from_context(
+        cls, context, safety_margin: float = DEFAULT_SAFETY_MARGIN
+    ) -> 'Deadline':
+        try:
+            remaining_millis = context.get_remaining_time_in_millis()
+        except Exception:
+            remaining_millis = None
+        if not isinstance(remaining_millis, (int, float)):
+            remaining_millis = None
+        return cls(remaining_millis, safety_margin)
+
+    def remaining(self) -> Optional[float]:
+        """
+        Return the remaining seconds, None if unlimited
+        """
+        if self.expires is None:
+            return None
+        return self.expires - time.monotonic()
+
+    def allows(self, seconds: float) -> bool:
+        """
+        Return True if work expected to take seconds fits
+        into the remaining budget
+        """
+        remaining = self.remaining()
+        return remaining is None or remaining > seconds
+
+    def timeout(self, seconds: float) -> float:
+        """
+        Return the given timeout shrunk to the remaining budget
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return seconds
+        return min(seconds, max(remaining, MIN_TIMEOUT))
@@ -15,14 +15,19 @@
 # You should have received a copy of the GNU General Public License
 # along with mash.  If not, see <http://www.gnu.org/licenses/>
 #
-import yaml
-from typing import Dict
+from typing import Mapping
+
+from resolve_customer.config import load_config
 
 
 class Defaults:
     @staticmethod
     def get_sqs_event_manager_config(
         config_file: str = '/etc/sqs_event_manager.yml'
-    ) -> Dict:
-        with open(config_file) as config:
-            return yaml.safe_load(config)
+    ) -> Mapping:
+        """
+        Return the cached sqs_event_manager config. The content of
+        the SQS_EVENT_MANAGER_CONFIG environment variable takes
+        precedence over the config file
+        """
+        return load_config(config_file, 'SQS_EVENT_MANAGER_CONFIG')
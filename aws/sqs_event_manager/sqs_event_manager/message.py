@@ -16,22 +16,36 @@
 # along with mash.  If not, see <http://www.gnu.org/licenses/>
 #
 import json
-from typing import Dict
+from typing import (
+    Dict, Optional
+)
 
 
 class AWSSNSMessage:
+    """
+    SQS record carrying an SNS notification
+
+    The SQS body is decoded once on construction, the embedded
+    SNS message is decoded once on first access of one of its
+    fields
+    """
+    __slots__ = ('message', 'body', '_sns_content')
+
     def __init__(self, message: Dict):
         self.message = message
         self.body = json.loads(self.__get('body'))
+        self._sns_content: Optional[Dict] = None
 
     def get_sns_content(self) -> Dict:
-        message = self.body.get('Message') or {}
-        if isinstance(message, dict):
-            # message content is a dictionary already
-            return message
-        else:
-            # message content is still a json string
-            return json.loads(message.replace(' ', ''))
+        if self._sns_content is None:
+            message = self.body.get('Message') or {}
+            if isinstance(message, dict):
+                # message content is a dictionary already
+                self._sns_content = message
+            else:
+                # message content is still a json string
+                self._sns_content = json.loads(message)
+        return self._sns_content
 
     @property
     def message_id(self) -> str:
@@ -43,23 +57,23 @@ class AWSSNSMessage:
 
     @property
     def customer_id(self) -> str:
-        return self.get_sns_content().get('customer-identifier') or ''
+        return self.__get_sns('customer-identifier')
 
     @property
     def product_code(self) -> str:
-        return self.get_sns_content().get('product-code') or ''
+        return self.__get_sns('product-code')
 
     @property
     def action(self) -> str:
-        return self.get_sns_content().get('action') or ''
+        return self.__get_sns('action')
 
     @property
     def offer_id(self) -> str:
-        return self.get_sns_content().get('offer-identifier') or ''
+        return self.__get_sns('offer-identifier')
 
     @property
     def free_trial_term_present(self) -> str:
-        return self.get_sns_content().get('isFreeTrialTermPresent') or 'false'
+        return self.__get_sns('isFreeTrialTermPresent') or 'false'
 
     @property
     def event_source_arn(self) -> str:
@@ -69,5 +83,9 @@ class AWSSNSMessage:
     def receipt_handle(self) -> str:
         return self.__get('receiptHandle')
 
+    def __get_sns(self, key) -> str:
+        value = self.get_sns_content().get(key) or ''
+        return value.strip() if isinstance(value, str) else value
+
     def __get(self, key) -> str:
         return self.message[key] if self.message else ''
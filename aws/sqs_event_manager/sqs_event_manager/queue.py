@@ -15,8 +15,16 @@
 # You should have received a copy of the GNU General Public License
 # along with mash.  If not, see <http://www.gnu.org/licenses/>
 #
+from typing import (
+    Dict, List, Optional
+)
 
-import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+from resolve_customer.client import get_client
+from resolve_customer.metrics import metrics
+
+# Maximum number of entries per DeleteMessageBatch request
+DELETE_BATCH_SIZE = 10
 
 
 def get_queue_url(arn: str) -> str:
@@ -25,12 +33,86 @@ def get_queue_url(arn: str) -> str:
     return f'https://sqs.{region}.amazonaws.com/{account}/{queue}'
 
 
-def delete_message(queue_arn: str, receipt_handle: str):
+def get_queue_region(arn: str) -> str:
+    """Return queue region based on arn"""
+    return arn.rsplit(':', maxsplit=3)[1]
+
+
+def delete_message(
+    queue_arn: str, receipt_handle: str,
+    client_config: Optional[Dict] = None
+):
     """Delete the message from the queue"""
     queue_url = get_queue_url(queue_arn)
-    client = boto3.client('sqs')
+    client = get_client(
+        'sqs', get_queue_region(queue_arn), client_config=client_config
+    )
+
+    with metrics.timer('DeleteMessage', get_queue_region(queue_arn)):
+        client.delete_message(
+            QueueUrl=queue_url,
+            ReceiptHandle=receipt_handle
+        )
+
+
+def delete_messages(
+    messages: List[Dict[str, str]], client_config: Optional[Dict] = None
+) -> Dict[str, str]:
+    """
+    Delete the given messages from their queues
+
+    Each message is a dictionary with the keys Id, QueueArn and
+    ReceiptHandle. Messages are grouped by queue and deleted via
+    DeleteMessageBatch requests of up to 10 entries sent to the
+    region of the queue. Returns the reason of failure per Id
+    of each message that could not be deleted, a failing request
+    only fails the messages of its batch.
+    """
+    failures: Dict[str, str] = {}
+    queues: Dict[str, List[Dict[str, str]]] = {}
+    for message in messages:
+        queues.setdefault(message['QueueArn'], []).append(message)
+    for queue_arn, queue_messages in queues.items():
+        for offset in range(0, len(queue_messages), DELETE_BATCH_SIZE):
+            chunk = queue_messages[offset:offset + DELETE_BATCH_SIZE]
+            try:
+                client = get_client(
+                    'sqs', get_queue_region(queue_arn),
+                    client_config=client_config
+                )
+                with metrics.timer(
+                    'DeleteMessageBatch', get_queue_region(queue_arn)
+                ):
+                    response = client.delete_message_batch(
+                        QueueUrl=get_queue_url(queue_arn),
+                        Entries=[
+                            {
+                                'Id': format(index),
+                                'ReceiptHandle': message['ReceiptHandle']
+                            } for index, message in enumerate(chunk)
+                        ]
+                    )
+            except (ClientError, BotoCoreError) as error:
+                for message in chunk:
+                    failures[message['Id']] = format(error)
+                continue
+            for failed in response.get('Failed') or []:
+                message = chunk[int(failed['Id'])]
+                failures[message['Id']] = \
+                    f'{failed.get("Code")}: {failed.get("Message")}'
+    return failures
+
 
-    client.delete_message(
-        QueueUrl=queue_url,
-        ReceiptHandle=receipt_handle
+def send_message(
+    queue_url: str, message_body: str, region_name: Optional[str] = None,
+    endpoint_url: Optional[str] = None, client_config: Optional[Dict] = None
+) -> None:
+    """
+    Send the message body to the queue. The optional endpoint_url
+    points to e.g. a local stand-in of SQS
+    """
+    client = get_client(
+        'sqs', region_name, client_config=client_config,
+        endpoint_url=endpoint_url
     )
+    client.send_message(QueueUrl=queue_url, MessageBody=message_body)
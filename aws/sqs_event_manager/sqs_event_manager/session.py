@@ -0,0 +1,167 @@
+# Copyright (c) 2025 SUSE LLC.  All rights reserved.
+#
+# This file is part of suse-saas-tools
+#
+# suse-saas-tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mash is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mash.  If not, see <http://www.gnu.org/licenses/>
+#
+import threading
+import urllib.parse
+from contextlib import contextmanager
+from typing import (
+    TYPE_CHECKING, Dict, Iterator, Mapping, Optional, Tuple
+)
+
+from sqs_event_manager.deadline import Deadline
+
+if TYPE_CHECKING:  # pragma: no cover
+    import requests
+    from urllib3.util.retry import Retry
+
+# HTTP status codes for which a request is retried
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_session: Optional['requests.Session'] = None
+_session_settings: Tuple = ()
+_session_lock = threading.Lock()
+
+# deadline and attempt time of the requests of the current thread,
+# see deadline_scope
+_request_scope = threading.local()
+
+
+def get_session(config: Mapping) -> 'requests.Session':
+    """
+    Return the process wide HTTP session
+
+    The session keeps connections alive such that notifications
+    to the same endpoint reuse the TLS connection. The connection
+    pool is sized for the batch concurrency unless http_pool_size
+    is set. Requests failing with 429 or a 5xx status are retried
+    up to http_retries times with http_backoff_factor, Retry-After
+    headers are ignored. Within a deadline_scope, a retry is only
+    done if it fits into the deadline. A new session is created
+    when these settings change.
+    """
+    global _session
+    global _session_settings
+    settings = (
+        config.get('http_pool_size') or max(
+            config.get('batch_workers') or 1, 10
+        ),
+        config.get('http_retries', 3),
+        config.get('http_backoff_factor', 0.5)
+    )
+    with _session_lock:
+        if _session is None or settings != _session_settings:
+            # requests is imported with the first session to keep
+            # it out of the module load of the lambda entry point
+            import requests
+            from requests.adapters import HTTPAdapter
+            pool_size, retries, backoff_factor = settings
+            adapter = HTTPAdapter(
+                pool_connections=pool_size,
+                pool_maxsize=pool_size,
+                max_retries=get_retry(retries, backoff_factor)
+            )
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+            _session_settings = settings
+        return _session
+
+
+def get_retry(total: int, backoff_factor: float) -> 'Retry':
+    """
+    Return the urllib3 Retry of the session, which is exhausted
+    as soon as the next attempt including its backoff does not
+    fit into the deadline of the current deadline_scope
+    """
+    from urllib3.util.retry import Retry
+
+    class DeadlineRetry(Retry):
+        def is_exhausted(self) -> bool:
+            if super().is_exhausted():
+                return True
+            deadline, seconds = getattr(
+                _request_scope, 'value', (None, 0.0)
+            )
+            if deadline is None:
+                return False
+            return not deadline.allows(self.get_backoff_time() + seconds)
+
+    return DeadlineRetry(
+        total=total,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=None,
+        raise_on_status=False,
+        respect_retry_after_header=False
+    )
+
+
+@contextmanager
+def deadline_scope(
+    deadline: Optional[Deadline], seconds: float
+) -> Iterator[None]:
+    """
+    Bound the retries of the HTTP requests done by this thread
+    within the scope to deadline, expecting an attempt to take
+    up to seconds
+    """
+    previous = getattr(_request_scope, 'value', (None, 0.0))
+    _request_scope.value = (deadline, seconds)
+    try:
+        yield
+    finally:
+        _request_scope.value = previous
+
+
+def get_timeout(
+    config: Mapping, deadline: Optional[Deadline] = None
+) -> Tuple[float, float]:
+    """
+    Return the connect and read timeout for HTTP requests,
+    shrunk to the remaining time of the deadline if given
+    """
+    timeout = (
+        config.get('http_connect_timeout', 5),
+        config.get('http_read_timeout', 30)
+    )
+    if deadline:
+        return (deadline.timeout(timeout[0]), deadline.timeout(timeout[1]))
+    return timeout
+
+
+def warm_up_session(config: Mapping) -> Dict[str, str]:
+    """
+    Open the connections of the HTTP session to the hosts of the
+    notification URLs in the config by a HEAD request to their
+    root. Returns the status code or the failure per host
+    """
+    session = get_session(config)
+    origins = {
+        '{0.scheme}://{0.netloc}/'.format(urllib.parse.urlsplit(url))
+        for key, url in config.items()
+        if key.endswith('_url') and isinstance(url, str) and url
+    }
+    report = {}
+    for origin in sorted(origins):
+        try:
+            report[origin] = str(
+                session.head(origin, timeout=get_timeout(config)).status_code
+            )
+        except Exception as error:
+            report[origin] = f'{type(error).__name__}: {error}'
+    return report
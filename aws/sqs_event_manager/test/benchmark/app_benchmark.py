@@ -0,0 +1,424 @@
+#!/usr/bin/python3
+"""
+End-to-end benchmark of the resolve_customer and sqs_event_manager
+lambda handlers against local stand-ins
+
+The AWS APIs (STS, meteringmarketplace, marketplace-entitlement and
+SQS) are answered in-process through the botocore event hooks that
+the botocore Stubber is built on: the request is validated and
+serialized as usual, but answered before it is sent. The SCC
+notification endpoints are served by a local HTTP server. Each
+stand-in waits for a configurable latency before it answers.
+
+For each handler, batch size and region count the benchmark
+reports the throughput and the p50/p95/p99 invocation latency.
+Results can be stored as baseline and later runs compared
+against it, the script exits with 1 on a regression.
+
+Run from the project directory, with resolve_customer importable:
+
+    python test/benchmark/app_benchmark.py --save-baseline /tmp/baseline.json
+    python test/benchmark/app_benchmark.py --baseline /tmp/baseline.json
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+from datetime import (
+    datetime, timedelta, timezone
+)
+from http.server import (
+    BaseHTTPRequestHandler, ThreadingHTTPServer
+)
+from typing import (
+    Dict, List, Tuple
+)
+
+import boto3
+from botocore.awsrequest import AWSResponse
+
+from resolve_customer import app as resolve_customer_app
+from resolve_customer.app import customer_cache
+from resolve_customer.assume_role import AWSAssumeRole
+from resolve_customer.client import clear_clients
+from resolve_customer.config import clear_config_cache
+from resolve_customer.customer import invalid_token_cache
+from resolve_customer.entitlements import entitlement_cache
+from resolve_customer.metrics import metrics
+from resolve_customer.region_stats import region_stats
+from sqs_event_manager import app as sqs_event_manager_app
+
+REGIONS = (
+    'us-east-1', 'eu-central-1', 'us-west-2', 'eu-west-1', 'ap-southeast-2'
+)
+PRODUCT_CODE = 'benchmarkproductcode'
+QUEUE_ARN = 'arn:aws:sqs:us-east-1:123456789012:benchmark'
+
+
+class AWSStandIn:
+    """
+    Answer the AWS API calls of all clients created from the boto3
+    default session after the latency configured per operation
+
+    A registration token resolves only in the region it names,
+    such that the region loop of resolve_customer is exercised
+    """
+    def __init__(self, latency: Dict[str, float], entitlements: int = 3):
+        self.latency = latency
+        self.entitlements = entitlements
+        self.calls: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def install(self) -> None:
+        boto3.setup_default_session()
+        events = boto3.DEFAULT_SESSION.events  # type: ignore
+        events.register('before-parameter-build', self.keep_params)
+        events.register('before-call', self.answer)
+
+    @staticmethod
+    def keep_params(params, context, **kwargs) -> None:
+        context['stand_in_params'] = dict(params)
+
+    def answer(self, model, context, **kwargs) -> Tuple[AWSResponse, Dict]:
+        operation = model.name
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        time.sleep(self.latency.get(operation, 0))
+        params = context.get('stand_in_params') or {}
+        region = context.get('client_region')
+        if operation == 'ResolveCustomer':
+            if not params['RegistrationToken'].startswith(f'{region}:'):
+                return self.error(
+                    'InvalidTokenException', 'token not in this region'
+                )
+            return self.success(
+                {
+                    'CustomerIdentifier': params['RegistrationToken'],
+                    'CustomerAWSAccountId': '123456789012',
+                    'ProductCode': PRODUCT_CODE
+                }
+            )
+        if operation == 'AssumeRole':
+            return self.success(
+                {
+                    'Credentials': {
+                        'AccessKeyId': f'ASIA{region or "GLOBAL"}',
+                        'SecretAccessKey': 'secret',
+                        'SessionToken': 'token',
+                        'Expiration':
+                            datetime.now(timezone.utc) + timedelta(hours=1)
+                    }
+                }
+            )
+        if operation == 'GetEntitlements':
+            return self.success(
+                {
+                    'Entitlements': [
+                        {
+                            'CustomerIdentifier': customer_id,
+                            'ProductCode': PRODUCT_CODE,
+                            'Dimension': f'dimension-{index}',
+                            'Value': {'IntegerValue': index},
+                            'ExpirationDate': datetime(2030, 1, 1)
+                        }
+                        for customer_id in
+                        params['Filter']['CUSTOMER_IDENTIFIER']
+                        for index in range(self.entitlements)
+                    ]
+                }
+            )
+        if operation == 'DeleteMessageBatch':
+            return self.success(
+                {
+                    'Successful': [
+                        {'Id': entry['Id']} for entry in params['Entries']
+                    ],
+                    'Failed': []
+                }
+            )
+        return self.success({})
+
+    @staticmethod
+    def success(response: Dict) -> Tuple[AWSResponse, Dict]:
+        response['ResponseMetadata'] = {'HTTPStatusCode': 200}
+        return AWSResponse(None, 200, {}, None), response
+
+    @staticmethod
+    def error(code: str, message: str) -> Tuple[AWSResponse, Dict]:
+        return AWSResponse(None, 400, {}, None), {
+            'Error': {'Code': code, 'Message': message},
+            'ResponseMetadata': {'HTTPStatusCode': 400}
+        }
+
+
+class SCCStandIn:
+    """
+    Local HTTP server answering every POST with 200 after latency
+    """
+    def __init__(self, latency: float):
+        stand_in = self
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                with stand_in.lock:
+                    stand_in.requests += 1
+                time.sleep(stand_in.latency)
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'{}')
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def shutdown(self) -> None:
+        self.server.shutdown()
+
+
+class Context:
+    """
+    Lambda context of an invocation with a fixed time budget
+    """
+    aws_request_id = 'benchmark'
+
+    def get_remaining_time_in_millis(self) -> int:
+        return 900000
+
+
+def configure(regions: int, scc_url: str, batch_workers: int) -> None:
+    """
+    Provide the handler configs through their environment variables
+    """
+    os.environ['ASSUME_ROLE_CONFIG'] = json.dumps(
+        {
+            'role': {
+                region: {
+                    'arn': f'arn:aws:iam::123456789012:role/{region}',
+                    'session': 'benchmark'
+                } for region in REGIONS[:regions]
+            }
+        }
+    )
+    os.environ['SQS_EVENT_MANAGER_CONFIG'] = json.dumps(
+        {
+            'entitlement_change_url': f'{scc_url}/entitlement',
+            'subscribe_success_url': f'{scc_url}/subscribe',
+            'unsubscribe_success_url': f'{scc_url}/unsubscribe',
+            'unsubscribe_pending_url': f'{scc_url}/unsubscribe_pending',
+            'subscribe_fail_url': f'{scc_url}/subscribe_fail',
+            'auth_token': 'benchmark',
+            'batch_workers': batch_workers
+        }
+    )
+    clear_config_cache()
+    reset()
+
+
+def reset() -> None:
+    """
+    Drop all process wide state, as on a cold start
+    """
+    clear_clients()
+    AWSAssumeRole.clear_cache()
+    entitlement_cache.clear()
+    invalid_token_cache.clear()
+    customer_cache.clear()
+    region_stats.clear()
+
+
+def make_record(index: int, customers: int) -> Dict:
+    return {
+        'messageId': f'message-{index}',
+        'receiptHandle': f'receipt-{index}',
+        'eventSourceARN': QUEUE_ARN,
+        'body': json.dumps(
+            {
+                'Type': 'Notification',
+                'MessageId': f'sns-{index}',
+                'Message': json.dumps(
+                    {
+                        'action': 'entitlement-updated',
+                        'customer-identifier':
+                            f'customer-{index % customers}',
+                        'product-code': PRODUCT_CODE
+                    }
+                )
+            }
+        )
+    }
+
+
+def percentile(samples: List[float], share: float) -> float:
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(share * len(ordered)) - 1, 0)]
+
+
+def run(
+    handler: str, batch_size: int, regions: int, invocations: int,
+    cold: bool
+) -> Dict[str, float]:
+    """
+    Invoke the handler and return throughput in items per second
+    and latency percentiles in milliseconds
+    """
+    samples: List[float] = []
+    for invocation in range(invocations):
+        if cold:
+            reset()
+        if handler == 'resolve_customer':
+            region = REGIONS[invocation % regions]
+            event = {
+                'body': json.dumps(
+                    {'registrationToken': f'{region}:customer-{invocation}'}
+                )
+            }
+            start = time.perf_counter()
+            response = json.loads(
+                resolve_customer_app.lambda_handler(event, Context())
+            )
+            samples.append(time.perf_counter() - start)
+            if response['statusCode'] != 200:
+                raise RuntimeError(f'resolve_customer failed: {response}')
+        else:
+            event = {
+                'Records': [
+                    make_record(index, max(batch_size // 2, 1))
+                    for index in range(batch_size)
+                ]
+            }
+            start = time.perf_counter()
+            response = json.loads(
+                sqs_event_manager_app.lambda_handler(event, Context())
+            )
+            samples.append(time.perf_counter() - start)
+            failed = [
+                result for result in response['body']['batchItemFailures']
+                if result.get('error')
+            ]
+            if failed:
+                raise RuntimeError(f'sqs_event_manager failed: {failed[0]}')
+    return {
+        'throughput': batch_size * len(samples) / sum(samples),
+        'p50': percentile(samples, 0.50) * 1000,
+        'p95': percentile(samples, 0.95) * 1000,
+        'p99': percentile(samples, 0.99) * 1000
+    }
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]], tolerance: float
+) -> List[str]:
+    """
+    Return the regressions of results against baseline
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        if result['throughput'] < reference['throughput'] * (1 - tolerance):
+            regressions.append(
+                f'{name}: throughput {result["throughput"]:.1f} < '
+                f'{reference["throughput"]:.1f}'
+            )
+        for key in ('p50', 'p95', 'p99'):
+            if result[key] > reference[key] * (1 + tolerance):
+                regressions.append(
+                    f'{name}: {key} {result[key]:.1f}ms > '
+                    f'{reference[key]:.1f}ms'
+                )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--batch-sizes', default='1,10,100')
+    parser.add_argument('--regions', default='1,3')
+    parser.add_argument('--invocations', type=int, default=20)
+    parser.add_argument('--batch-workers', type=int, default=10)
+    parser.add_argument(
+        '--cold', action='store_true',
+        help='drop clients, credentials and caches before each invocation'
+    )
+    parser.add_argument('--sts-latency', type=float, default=0.05)
+    parser.add_argument('--metering-latency', type=float, default=0.03)
+    parser.add_argument('--entitlement-latency', type=float, default=0.03)
+    parser.add_argument('--sqs-latency', type=float, default=0.01)
+    parser.add_argument('--scc-latency', type=float, default=0.02)
+    parser.add_argument('--baseline', help='baseline file to compare with')
+    parser.add_argument('--save-baseline', help='store results as baseline')
+    parser.add_argument(
+        '--tolerance', type=float, default=0.2,
+        help='allowed relative regression against the baseline'
+    )
+    args = parser.parse_args()
+
+    # the stand-ins answer the requests, the EMF records are not needed
+    metrics.set_sink(lambda record: None)
+    AWSStandIn(
+        {
+            'AssumeRole': args.sts_latency,
+            'ResolveCustomer': args.metering_latency,
+            'GetEntitlements': args.entitlement_latency,
+            'DeleteMessage': args.sqs_latency,
+            'DeleteMessageBatch': args.sqs_latency
+        }
+    ).install()
+    scc = SCCStandIn(args.scc_latency)
+
+    results: Dict[str, Dict[str, float]] = {}
+    print(
+        f'{"benchmark":<48} {"items/s":>9} {"p50 ms":>9} '
+        f'{"p95 ms":>9} {"p99 ms":>9}'
+    )
+    try:
+        for regions in [int(value) for value in args.regions.split(',')]:
+            benchmarks = [('resolve_customer', 1)] + [
+                ('sqs_event_manager', int(batch_size))
+                for batch_size in args.batch_sizes.split(',')
+            ]
+            for handler, batch_size in benchmarks:
+                configure(regions, scc.url, args.batch_workers)
+                name = f'{handler}/batch={batch_size}/regions={regions}'
+                result = run(
+                    handler, batch_size, regions, args.invocations, args.cold
+                )
+                results[name] = result
+                print(
+                    f'{name:<48} {result["throughput"]:>9.1f} '
+                    f'{result["p50"]:>9.1f} {result["p95"]:>9.1f} '
+                    f'{result["p99"]:>9.1f}'
+                )
+    finally:
+        scc.shutdown()
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline:
+            json.dump(results, baseline, indent=4)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+"""
+Micro benchmark for the per record parse cost of AWSSNSMessage
+
+Run from the project directory:
+
+    python test/benchmark/message_benchmark.py
+"""
+import json
+import timeit
+
+from sqs_event_manager.message import AWSSNSMessage
+
+record = {
+    'messageId': 'c7b2c992-4f07-478e-bfb8-f577e8310550',
+    'receiptHandle': 'AQEBZ...',
+    'body': json.dumps(
+        {
+            'Type': 'Notification',
+            'MessageId': '123',
+            'TopicArn': 'arn:aws:sns:us-east-1:XXX:aws-mp-entitlement-notification-XXX',
+            'Message': json.dumps(
+                {
+                    'action': 'subscribe-success',
+                    'customer-identifier': 'abc123',
+                    'product-code': '7hn1uo40wt6psy10ovxyh4zzn',
+                    'offer-identifier': 'offer-abcexample123',
+                    'isFreeTrialTermPresent': 'true'
+                }, indent=4
+            ),
+            'Timestamp': '2025-01-15 16:31:50',
+            'SignatureVersion': '1',
+            'Signature': 'abc123',
+            'SigningCertURL': 'string',
+            'UnsubscribeURL': 'string'
+        }
+    ),
+    'eventSourceARN': 'arn:aws:sqs:eu-central-1:12345:ms-testing.fifo'
+}
+
+
+def process_record():
+    # access the fields in the same way process_message does
+    message = AWSSNSMessage(record)
+    return (
+        message.category,
+        message.customer_id,
+        message.product_code,
+        message.action,
+        message.customer_id,
+        message.product_code,
+        message.offer_id,
+        message.free_trial_term_present,
+        message.event_source_arn,
+        message.receipt_handle
+    )
+
+
+def main(number: int = 100000):
+    seconds = min(timeit.repeat(process_record, number=number, repeat=5))
+    print(f'{number} records: {seconds:.3f}s')
+    print(f'per record: {seconds / number * 1000000:.2f}us')
+
+
+if __name__ == '__main__':
+    main()
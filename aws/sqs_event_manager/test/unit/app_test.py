@@ -1,15 +1,24 @@
 import logging
 import json
+import threading
+import time
 
 from unittest.mock import (
-    Mock, patch
+    Mock, patch, ANY, call
 )
 
 from sqs_event_manager.defaults import Defaults
 from sqs_event_manager.app import (
-    lambda_handler, process_message
+    lambda_handler, process_message, process_records,
+    acknowledge_messages, route_failures, get_exception_failure
 )
-from pytest import fixture
+from sqs_event_manager.deadline import record_times
+from botocore.exceptions import ClientError, EndpointConnectionError
+from requests.exceptions import ConnectTimeout
+from resolve_customer.client import clear_clients
+from resolve_customer.error import error_record
+from resolve_customer.metrics import metrics
+from pytest import fixture, raises
 
 
 class TestApp:
@@ -146,35 +155,773 @@ class TestApp:
             "{\"errors\": {\"SubscriptionEvent\": \"KeyError: 'Records'\", " \
             "\"Exception\": \"App.Error.InternalServiceErrorException\"}}}"
 
+    @patch('sqs_event_manager.app.warm_up_session')
+    @patch('sqs_event_manager.app.warm_up')
+    @patch('sqs_event_manager.app.Defaults.get_sqs_event_manager_config')
+    def test_lambda_handler_warmup(
+        self, mock_get_sqs_event_manager_config, mock_warm_up,
+        mock_warm_up_session
+    ):
+        mock_warm_up.return_value = {'warmup': True, 'config': 'ok'}
+        mock_warm_up_session.return_value = {'https://scc.suse.com/': '200'}
+        response = json.loads(
+            lambda_handler(event={'warmup': True}, context=Mock())
+        )
+        assert response['statusCode'] == 200
+        assert response['body']['http'] == {'https://scc.suse.com/': '200'}
+        assert response['body']['seconds'] >= 0
+        mock_warm_up.assert_called_once_with(
+            ('marketplace-entitlement', 'sqs'),
+            mock_get_sqs_event_manager_config
+        )
+        mock_warm_up_session.assert_called_once_with(
+            mock_get_sqs_event_manager_config.return_value
+        )
+        # an invalid config is reported, the HTTP session not touched
+        mock_warm_up.return_value = {'warmup': True, 'config': 'ValueError'}
+        mock_warm_up_session.reset_mock()
+        response = json.loads(
+            lambda_handler(event={'warmup': True}, context=Mock())
+        )
+        assert 'http' not in response['body']
+        assert not mock_warm_up_session.called
+
+    @patch('sqs_event_manager.app.Defaults.get_sqs_event_manager_config')
     @patch('sqs_event_manager.app.AWSCustomerEntitlement')
     @patch('sqs_event_manager.app.process_message')
     def test_lambda_handler(
-        self, mock_process_message, mock_AWSCustomerEntitlement
+        self, mock_process_message, mock_AWSCustomerEntitlement,
+        mock_get_sqs_event_manager_config
     ):
+        mock_get_sqs_event_manager_config.return_value = self.config
         mock_process_message.return_value = {}
         entitlements = Mock()
+        entitlements.error = {}
         mock_AWSCustomerEntitlement.return_value = entitlements
 
         lambda_handler(
             event={'Records': [self.record]},
             context=Mock()
         )
+        # all pages are fetched once for the batch
+        mock_AWSCustomerEntitlement.from_entitlements.assert_called_once_with(
+            'abc123', '7hn1uo40wt6psy10ovxyh4zzn',
+            entitlements.get_entitlements.return_value
+        )
+        mock_process_message.assert_called_once_with(
+            self.record, [], {
+                ('abc123', '7hn1uo40wt6psy10ovxyh4zzn'):
+                    mock_AWSCustomerEntitlement.from_entitlements.return_value
+            }, ANY, ANY
+        )
+        assert mock_process_message.call_args.args[4].customer_id == 'abc123'
+
+    def make_record(self, message_id, customer_id):
+        body = dict(self.entitlement_updated)
+        body['Message'] = dict(
+            body['Message'], **{'customer-identifier': customer_id}
+        )
+        return dict(
+            self.record, messageId=message_id, body=json.dumps(body)
+        )
+
+    @patch('sqs_event_manager.app.AWSCustomerEntitlement')
+    @patch('sqs_event_manager.app.process_message')
+    def test_process_records_concurrent(
+        self, mock_process_message, mock_AWSCustomerEntitlement
+    ):
+        records = [
+            self.make_record(f'id-{index}', f'customer-{index}')
+            for index in range(6)
+        ]
+        barrier = threading.Barrier(3, timeout=5)
+
+        def process_message(
+            record, acknowledge=None, prefetched=None, deadline=None,
+            message=None
+        ):
+            # three records must be in flight at the same time
+            if record['messageId'] in ('id-0', 'id-1', 'id-2'):
+                barrier.wait()
+            return {'itemIdentifier': record['messageId']}
+
+        mock_process_message.side_effect = process_message
+        assert process_records(records, {'batch_workers': 3}) == [
+            {'itemIdentifier': f'id-{index}'} for index in range(6)
+        ]
+
+    @patch('sqs_event_manager.app.AWSCustomerEntitlement')
+    @patch('sqs_event_manager.app.process_message')
+    def test_process_records_keep_customer_order(
+        self, mock_process_message, mock_AWSCustomerEntitlement
+    ):
+        records = [
+            self.make_record('id-0', 'customer-a'),
+            self.make_record('id-1', 'customer-b'),
+            self.make_record('id-2', 'customer-a'),
+            self.make_record('id-3', ''),
+            dict(self.record, messageId='id-4', body='no-json'),
+            self.make_record('id-5', 'customer-a')
+        ]
+        processed = []
+
+        def process_message(
+            record, acknowledge=None, prefetched=None, deadline=None,
+            message=None
+        ):
+            if record['messageId'] == 'id-0':
+                # give other workers the chance to overtake
+                time.sleep(0.1)
+            processed.append(record['messageId'])
+            return {'itemIdentifier': record['messageId']}
+
+        mock_process_message.side_effect = process_message
+        assert process_records(
+            records, {'batch_workers': 4, 'keep_customer_order': True}
+        ) == [{'itemIdentifier': f'id-{index}'} for index in range(6)]
+        customer_a = [
+            message_id for message_id in processed
+            if message_id in ('id-0', 'id-2', 'id-5')
+        ]
+        assert customer_a == ['id-0', 'id-2', 'id-5']
+
+    @patch('sqs_event_manager.app.AWSCustomerEntitlement')
+    @patch('sqs_event_manager.app.process_message')
+    def test_process_records_failure_isolation(
+        self, mock_process_message, mock_AWSCustomerEntitlement
+    ):
+        records = [
+            self.make_record('id-0', 'customer-a'),
+            self.make_record('id-1', 'customer-b')
+        ]
+
+        def process_message(
+            record, acknowledge=None, prefetched=None, deadline=None,
+            message=None
+        ):
+            if record['messageId'] == 'id-0':
+                raise Exception('some-error')
+            return {'itemIdentifier': record['messageId'], 'error': False}
+
+        mock_process_message.side_effect = process_message
+        for config in [{}, {'batch_workers': 2}]:
+            assert process_records(records, config) == [
+                {
+                    'itemIdentifier': 'id-0',
+                    'status': 'Exception: some-error',
+                    'error': True,
+                    'failure': 'transient'
+                },
+                {'itemIdentifier': 'id-1', 'error': False}
+            ]
+
+    @patch('sqs_event_manager.app.delete_messages')
+    @patch('sqs_event_manager.app.get_session')
+    @patch('sqs_event_manager.app.AWSCustomerEntitlement')
+    @patch('sqs_event_manager.app.delete_message')
+    @patch('sqs_event_manager.app.Defaults.get_sqs_event_manager_config')
+    def test_lambda_handler_batch_delete(
+        self, mock_get_sqs_event_manager_config, mock_delete_message,
+        mock_AWSCustomerEntitlement, mock_get_session, mock_delete_messages
+    ):
+        response = Mock()
+        response.status_code = 200
+        mock_get_session.return_value.post.return_value = response
+        mock_get_sqs_event_manager_config.return_value = self.config
+        entitlements = Mock()
+        entitlements.error = {}
+        mock_AWSCustomerEntitlement.return_value = entitlements
+        mock_AWSCustomerEntitlement.from_entitlements.return_value = \
+            entitlements
+        mock_delete_messages.return_value = {
+            'id-1': 'ReceiptHandleIsInvalid: some'
+        }
+        records = [
+            dict(self.record, messageId='id-0', receiptHandle='r0'),
+            dict(self.record, messageId='id-1', receiptHandle='r1')
+        ]
+        metrics.clear()
+        emitted = []
+        metrics.set_sink(emitted.append)
+        assert json.loads(
+            lambda_handler(event={'Records': records}, context=Mock())
+        )['body']['batchItemFailures'] == [
+            {
+                'itemIdentifier': 'id-0',
+                'status': 'Event report succeeded',
+                'error': False
+            },
+            {
+                'itemIdentifier': 'id-1',
+                'status': 'Event report succeeded, '
+                'message delete failed: ReceiptHandleIsInvalid: some',
+                'error': True
+            }
+        ]
+        metrics.set_sink()
+        # the notifications are timed and emitted once per invocation
+        assert len(emitted) == 1
+        assert json.loads(emitted[0])['Outcome'] == '200'
+        assert json.loads(emitted[0])['Action'] == 'entitlement-updated'
+        assert len(json.loads(emitted[0])['SendNotification']) == 2
+        assert not mock_delete_message.called
+        mock_delete_messages.assert_called_once_with(
+            [
+                {
+                    'Id': 'id-0',
+                    'QueueArn': 'arn:aws:sqs:eu-central-1:12345:ms-testing.fifo',
+                    'ReceiptHandle': 'r0'
+                },
+                {
+                    'Id': 'id-1',
+                    'QueueArn': 'arn:aws:sqs:eu-central-1:12345:ms-testing.fifo',
+                    'ReceiptHandle': 'r1'
+                }
+            ], None
+        )
+
+    @patch('boto3.client')
+    @patch('sqs_event_manager.app.get_session')
+    @patch('sqs_event_manager.app.AWSCustomerEntitlement')
+    @patch('sqs_event_manager.app.Defaults.get_sqs_event_manager_config')
+    def test_lambda_handler_batch_delete_unreachable(
+        self, mock_get_sqs_event_manager_config, mock_AWSCustomerEntitlement,
+        mock_get_session, mock_boto_client
+    ):
+        clear_clients()
+        response = Mock()
+        response.status_code = 200
+        mock_get_session.return_value.post.return_value = response
+        mock_get_sqs_event_manager_config.return_value = self.config
+        mock_AWSCustomerEntitlement.return_value.error = {}
+        mock_AWSCustomerEntitlement.from_entitlements.return_value.error = {}
+        mock_boto_client.return_value.delete_message_batch.side_effect = \
+            EndpointConnectionError(endpoint_url='https://sqs')
+        records = [dict(self.record, messageId='id-0', receiptHandle='r0')]
+        # the results of the already notified records are kept
+        results = json.loads(
+            lambda_handler(event={'Records': records}, context=Mock())
+        )['body']['batchItemFailures']
+        assert results == [
+            {
+                'itemIdentifier': 'id-0',
+                'status': 'Event report succeeded, message delete failed: '
+                'Could not connect to the endpoint URL: "https://sqs"',
+                'error': True
+            }
+        ]
+        clear_clients()
+
+    @patch('sqs_event_manager.app.delete_messages')
+    @patch('sqs_event_manager.app.get_session')
+    @patch('sqs_event_manager.app.AWSCustomerEntitlement')
+    @patch('sqs_event_manager.app.delete_message')
+    @patch('sqs_event_manager.app.Defaults.get_sqs_event_manager_config')
+    def test_lambda_handler_report_batch_item_failures(
+        self, mock_get_sqs_event_manager_config, mock_delete_message,
+        mock_AWSCustomerEntitlement, mock_get_session, mock_delete_messages
+    ):
+        response = Mock()
+        response.status_code = 200
+        unavailable = Mock()
+        unavailable.status_code = 503
+        unavailable.text = 'unavailable'
+        mock_get_session.return_value.post.side_effect = [
+            response, unavailable
+        ]
+        mock_get_sqs_event_manager_config.return_value = dict(
+            self.config, report_batch_item_failures=True
+        )
+        entitlements = Mock()
+        entitlements.error = {}
+        mock_AWSCustomerEntitlement.return_value = entitlements
+        mock_AWSCustomerEntitlement.from_entitlements.return_value = \
+            entitlements
+        records = [
+            dict(self.record, messageId='id-0'),
+            dict(self.record, messageId='id-1', body='no-json'),
+            dict(self.record, messageId='id-2')
+        ]
+        # the malformed message is a permanent failure and
+        # not redelivered, the unavailable endpoint is retried
+        assert lambda_handler(
+            event={'Records': records}, context=Mock()
+        ) == {
+            'batchItemFailures': [{'itemIdentifier': 'id-2'}]
+        }
+        assert not mock_delete_message.called
+        assert not mock_delete_messages.called
+
+    @patch('sqs_event_manager.app.get_session')
+    @patch('resolve_customer.entitlements.Defaults.get_assume_role_config')
+    @patch('sqs_event_manager.app.Defaults.get_sqs_event_manager_config')
+    def test_lambda_handler_report_batch_item_failures_role_config(
+        self, mock_get_sqs_event_manager_config, mock_get_assume_role_config,
+        mock_get_session
+    ):
+        mock_get_sqs_event_manager_config.return_value = dict(
+            self.config, report_batch_item_failures=True
+        )
+        records = [
+            self.make_record('id-0', 'customer-a'),
+            self.make_record('id-1', 'customer-b')
+        ]
+        # a missing or invalid role config keeps the messages
+        # for redelivery instead of dropping the whole batch
+        for role_config in (
+            lambda: {'role': {}},
+            lambda: Defaults.validate_assume_role_config(
+                {'role': {'us-east-1': {'arn': 'arn'}}}
+            )
+        ):
+            mock_get_assume_role_config.side_effect = role_config
+            with self._caplog.at_level(logging.ERROR):
+                assert lambda_handler(
+                    event={'Records': records}, context=Mock()
+                ) == {
+                    'batchItemFailures': [
+                        {'itemIdentifier': 'id-0'},
+                        {'itemIdentifier': 'id-1'}
+                    ]
+                }
+                assert 'not redelivered' not in self._caplog.text
+        assert not mock_get_session.return_value.post.called
+
+    @patch('sqs_event_manager.app.delete_messages')
+    @patch('sqs_event_manager.app.get_session')
+    @patch('sqs_event_manager.app.AWSCustomerEntitlement')
+    @patch('sqs_event_manager.app.Defaults.get_sqs_event_manager_config')
+    def test_lambda_handler_report_batch_item_failures_not_actionable(
+        self, mock_get_sqs_event_manager_config, mock_AWSCustomerEntitlement,
+        mock_get_session, mock_delete_messages
+    ):
+        mock_get_sqs_event_manager_config.return_value = dict(
+            self.config, report_batch_item_failures=True
+        )
+        mock_AWSCustomerEntitlement.return_value.error = {}
+        mock_AWSCustomerEntitlement.from_entitlements.return_value.error = {}
+        no_action = dict(self.entitlement_updated)
+        no_action['Message'] = {
+            'customer-identifier': 'abc123',
+            'product-code': '7hn1uo40wt6psy10ovxyh4zzn'
+        }
+        unknown_action = dict(self.entitlement_updated)
+        unknown_action['Message'] = dict(
+            no_action['Message'], action='unknown'
+        )
+        records = [
+            dict(
+                self.record, messageId='id-0',
+                body=json.dumps(self.subscription_notification)
+            ),
+            dict(self.record, messageId='id-1', body=json.dumps(no_action)),
+            dict(
+                self.record, messageId='id-2',
+                body=json.dumps(unknown_action)
+            )
+        ]
+        # handled messages which can not be acted on are not
+        # redelivered, as Lambda deleted them before
+        assert lambda_handler(
+            event={'Records': records}, context=Mock()
+        ) == {
+            'batchItemFailures': []
+        }
+        assert not mock_get_session.return_value.post.called
+        assert not mock_delete_messages.called
+
+    @patch('sqs_event_manager.app.process_records')
+    @patch('sqs_event_manager.app.Defaults.get_sqs_event_manager_config')
+    def test_lambda_handler_report_batch_item_failures_raises(
+        self, mock_get_sqs_event_manager_config, mock_process_records
+    ):
+        mock_get_sqs_event_manager_config.return_value = dict(
+            self.config, report_batch_item_failures=True
+        )
+        mock_process_records.side_effect = Exception('some-error')
+        with raises(Exception):
+            lambda_handler(event={'Records': [self.record]}, context=Mock())
+
+    @patch('sqs_event_manager.app.invalidate_entitlements')
+    @patch('sqs_event_manager.app.get_session')
+    @patch('sqs_event_manager.app.AWSProductEntitlements')
+    @patch('sqs_event_manager.app.AWSCustomerEntitlement')
+    @patch('sqs_event_manager.app.Defaults.get_sqs_event_manager_config')
+    def test_process_records_coalesce_entitlements(
+        self, mock_get_sqs_event_manager_config,
+        mock_AWSCustomerEntitlement, mock_AWSProductEntitlements,
+        mock_get_session, mock_invalidate_entitlements
+    ):
+        response = Mock()
+        response.status_code = 200
+        mock_get_session.return_value.post.return_value = response
+        mock_get_sqs_event_manager_config.return_value = self.config
+
+        def entitlement(customer_id, product_code):
+            if customer_id == 'customer-fail':
+                raise Exception('some-error')
+            entitlements = Mock()
+            entitlements.error = {}
+            entitlements.customer_id = customer_id
+            return entitlements
+
+        mock_AWSCustomerEntitlement.side_effect = entitlement
+        mock_AWSCustomerEntitlement.from_entitlements.side_effect = \
+            lambda customer_id, product_code, entitlements: \
+            entitlement(customer_id, product_code)
+        records = [
+            self.make_record('id-0', 'customer-a'),
+            self.make_record('id-1', 'customer-b'),
+            self.make_record('id-2', 'customer-a'),
+            self.make_record('id-3', 'customer-fail'),
+            self.make_record('id-4', ''),
+            dict(
+                self.record, messageId='id-5',
+                body=json.dumps(self.subscription_notification)
+            ),
+            dict(self.record, messageId='id-6', body='no-json')
+        ]
+        acknowledge = []
+        # the bulk request fails, entitlements are fetched per customer
+        bulk_failures = [Exception('bulk-error'), None]
+        mock_AWSProductEntitlements.return_value.error = {'some': 'error'}
+        for config, bulk_failure in zip(
+            [self.config, dict(self.config, batch_workers=4)], bulk_failures
+        ):
+            mock_AWSCustomerEntitlement.reset_mock()
+            mock_AWSProductEntitlements.side_effect = bulk_failure
+            with self._caplog.at_level(logging.INFO):
+                results = process_records(records, config, acknowledge)
+                assert 'Entitlements for customer customer-a and product ' \
+                    '7hn1uo40wt6psy10ovxyh4zzn: fetched once for ' \
+                    '2 record(s)' in self._caplog.text
+                assert 'Prefetch of entitlements for' in self._caplog.text
+            assert [result['error'] for result in results] == [
+                False, False, False, True, False, True, True
+            ]
+            # customer-fail is fetched again by process_message
+            # and entitlements for an empty customer are requested
+            # by process_message too
+            assert sorted(
+                call_args[0][0]
+                for call_args in mock_AWSCustomerEntitlement.call_args_list
+            ) == [
+                '', 'customer-a', 'customer-b',
+                'customer-fail', 'customer-fail'
+            ]
+        mock_invalidate_entitlements.assert_any_call(
+            'customer-a', '7hn1uo40wt6psy10ovxyh4zzn'
+        )
+
+    @patch('sqs_event_manager.app.get_session')
+    @patch('sqs_event_manager.app.AWSCustomerEntitlement')
+    @patch('sqs_event_manager.app.Defaults.get_sqs_event_manager_config')
+    def test_process_records_decodes_once(
+        self, mock_get_sqs_event_manager_config,
+        mock_AWSCustomerEntitlement, mock_get_session
+    ):
+        response = Mock()
+        response.status_code = 200
+        mock_get_session.return_value.post.return_value = response
+        mock_get_sqs_event_manager_config.return_value = self.config
+        mock_AWSCustomerEntitlement.return_value.error = {}
+        mock_AWSCustomerEntitlement.from_entitlements.return_value.error = {}
+        config = dict(self.config, keep_customer_order=True)
+        records = [
+            self.make_record('id-0', 'customer-a'),
+            self.make_record('id-1', 'customer-b')
+        ]
+        with patch(
+            'sqs_event_manager.message.json.loads', wraps=json.loads
+        ) as mock_loads:
+            results = process_records(records, config, [])
+            assert [result['error'] for result in results] == [False, False]
+            # one decode of the SQS body per record, the SNS
+            # message is a dict already
+            assert mock_loads.call_count == 2
+        body = dict(self.entitlement_updated, Message='no-json')
+        results = process_records(
+            [dict(self.record, messageId='id-2', body=json.dumps(body))],
+            config, []
+        )
+        assert results[0]['error'] is True
+        assert results[0]['status'].startswith('JSONDecodeError')
+        assert results[0]['failure'] == 'permanent'
+
+    @patch('sqs_event_manager.app.get_session')
+    @patch('sqs_event_manager.app.AWSProductEntitlements')
+    @patch('sqs_event_manager.app.AWSCustomerEntitlement')
+    @patch('sqs_event_manager.app.Defaults.get_sqs_event_manager_config')
+    def test_process_records_bulk_entitlements(
+        self, mock_get_sqs_event_manager_config,
+        mock_AWSCustomerEntitlement, mock_AWSProductEntitlements,
+        mock_get_session
+    ):
+        response = Mock()
+        response.status_code = 200
+        mock_get_session.return_value.post.return_value = response
+        mock_get_sqs_event_manager_config.return_value = self.config
+        bulk = mock_AWSProductEntitlements.return_value
+        bulk.error = {}
+        bulk.get_entitlements.side_effect = lambda customer_id: [
+            {'dimension': customer_id}
+        ]
+        mock_AWSCustomerEntitlement.from_entitlements.return_value.error = {}
+        records = [
+            self.make_record('id-0', 'customer-a'),
+            self.make_record('id-1', 'customer-b'),
+            self.make_record('id-2', 'customer-a')
+        ]
+        with self._caplog.at_level(logging.INFO):
+            results = process_records(records, self.config, [])
+            assert 'Entitlements for product 7hn1uo40wt6psy10ovxyh4zzn: ' \
+                '1 bulk lookup for 2 customers' in self._caplog.text
+        assert [result['error'] for result in results] == [
+            False, False, False
+        ]
+        mock_AWSProductEntitlements.assert_called_once_with(
+            '7hn1uo40wt6psy10ovxyh4zzn', ['customer-a', 'customer-b']
+        )
+        assert not mock_AWSCustomerEntitlement.called
+        assert mock_AWSCustomerEntitlement.from_entitlements.call_count == 2
+        mock_AWSCustomerEntitlement.from_entitlements.assert_any_call(
+            'customer-b', '7hn1uo40wt6psy10ovxyh4zzn',
+            [{'dimension': 'customer-b'}]
+        )
+
+    @patch('sqs_event_manager.app.send_to_dead_letter')
+    @patch('sqs_event_manager.app.process_message')
+    @patch('sqs_event_manager.app.Defaults.get_sqs_event_manager_config')
+    def test_lambda_handler_dead_letter(
+        self, mock_get_sqs_event_manager_config, mock_process_message,
+        mock_send_to_dead_letter
+    ):
+        mock_get_sqs_event_manager_config.return_value = dict(
+            self.config, report_batch_item_failures=True,
+            dead_letter={'file': '/tmp/dead_letter'}
+        )
+        failures = {
+            'id-0': {'error': False},
+            'id-1': {'error': True, 'failure': 'permanent'},
+            'id-2': {'error': True, 'failure': 'transient'}
+        }
+        mock_process_message.side_effect = \
+            lambda record, *args: dict(
+                failures[record['messageId']],
+                itemIdentifier=record['messageId']
+            )
+        records = [
+            dict(self.record, messageId=message_id)
+            for message_id in failures
+        ]
+        # the permanent failure is not redelivered
+        assert lambda_handler(
+            event={'Records': records}, context=Mock()
+        ) == {
+            'batchItemFailures': [{'itemIdentifier': 'id-2'}]
+        }
+        mock_send_to_dead_letter.assert_called_once_with(
+            records[1], {
+                'error': True, 'failure': 'permanent',
+                'itemIdentifier': 'id-1',
+                'status': 'None, sent to dead-letter',
+                'dead_letter': True,
+                'acknowledged': True
+            }, mock_get_sqs_event_manager_config.return_value
+        )
+
+    @patch('sqs_event_manager.app.delete_messages')
+    @patch('sqs_event_manager.app.process_message')
+    @patch('sqs_event_manager.app.Defaults.get_sqs_event_manager_config')
+    def test_lambda_handler_permanent_failure_without_dead_letter(
+        self, mock_get_sqs_event_manager_config, mock_process_message,
+        mock_delete_messages
+    ):
+        mock_get_sqs_event_manager_config.return_value = self.config
+        mock_delete_messages.return_value = {}
+        mock_process_message.side_effect = \
+            lambda record, *args: {
+                'itemIdentifier': record['messageId'],
+                'status': 'some', 'error': True, 'failure': 'permanent'
+            }
+        record = dict(self.record, messageId='id-0')
+        response = json.loads(
+            lambda_handler(event={'Records': [record]}, context=Mock())
+        )
+        assert response['body']['batchItemFailures'] == [
+            {
+                'itemIdentifier': 'id-0', 'status': 'some, not redelivered',
+                'error': True, 'failure': 'permanent', 'acknowledged': True
+            }
+        ]
+        mock_delete_messages.assert_called_once_with(
+            [
+                {
+                    'Id': 'id-0',
+                    'QueueArn': record['eventSourceARN'],
+                    'ReceiptHandle': record['receiptHandle']
+                }
+            ], self.config.get('client_config')
+        )
+
+    @patch('sqs_event_manager.app.send_to_dead_letter')
+    def test_route_failures(self, mock_send_to_dead_letter):
+        records = [
+            dict(self.record, messageId='id-0', receiptHandle='r0'),
+            dict(self.record, messageId='id-1', receiptHandle='r1')
+        ]
+
+        def get_results():
+            return [
+                {
+                    'itemIdentifier': 'id-0', 'status': 'some',
+                    'error': True, 'failure': 'permanent'
+                },
+                {
+                    'itemIdentifier': 'id-1', 'status': 'some',
+                    'error': True, 'failure': 'permanent'
+                }
+            ]
+
+        # no dead-letter sink, the failures are logged and acknowledged
+        results = get_results()
+        results[1]['acknowledged'] = True
+        acknowledge = []
+        with self._caplog.at_level(logging.ERROR):
+            route_failures(records, results, self.config, acknowledge)
+            assert 'some, not redelivered' in self._caplog.text
+        assert results[0] == dict(
+            get_results()[0], status='some, not redelivered',
+            acknowledged=True
+        )
+        # acknowledged by process_message already
+        assert results[1] == dict(get_results()[1], acknowledged=True)
+        assert acknowledge == [
+            {
+                'Id': 'id-0',
+                'QueueArn': 'arn:aws:sqs:eu-central-1:12345:ms-testing.fifo',
+                'ReceiptHandle': 'r0'
+            }
+        ]
+        assert not mock_send_to_dead_letter.called
+
+        # routed messages get acknowledged once
+        config = dict(self.config, dead_letter={'file': '/tmp/dead_letter'})
+        acknowledge = [
+            {'Id': 'id-1', 'QueueArn': 'some', 'ReceiptHandle': 'r1'}
+        ]
+        results = get_results()
+        route_failures(records, results, config, acknowledge)
+        assert acknowledge == [
+            {'Id': 'id-1', 'QueueArn': 'some', 'ReceiptHandle': 'r1'},
+            {
+                'Id': 'id-0',
+                'QueueArn': 'arn:aws:sqs:eu-central-1:12345:ms-testing.fifo',
+                'ReceiptHandle': 'r0'
+            }
+        ]
+
+        # a failing sink turns the failure into a transient one
+        mock_send_to_dead_letter.side_effect = Exception('sink-error')
+        results = get_results()
+        with self._caplog.at_level(logging.ERROR):
+            route_failures(records, results, config, [])
+            assert 'dead-letter failed: sink-error' in self._caplog.text
+        assert results[0]['failure'] == 'transient'
+        assert 'dead_letter' not in results[0]
+
+    def test_get_exception_failure(self):
+        assert get_exception_failure(ConnectTimeout()) == 'transient'
+        # a broken config or a bug is not a problem of the message
+        assert get_exception_failure(ValueError()) == 'transient'
+        assert get_exception_failure(KeyError()) == 'transient'
+        assert get_exception_failure(Exception()) == 'transient'
+        throttled = error_record(400, 'some')
+        throttled['Error']['Code'] = 'ThrottlingException'
+        assert get_exception_failure(
+            ClientError(throttled, 'GetEntitlements')
+        ) == 'transient'
+
+    @patch('sqs_event_manager.app.AWSProductEntitlements')
+    @patch('sqs_event_manager.app.AWSCustomerEntitlement')
+    @patch('sqs_event_manager.app.process_message')
+    def test_process_records_deadline(
+        self, mock_process_message, mock_AWSCustomerEntitlement,
+        mock_AWSProductEntitlements
+    ):
+        records = [
+            self.make_record('id-0', 'customer-a'),
+            self.make_record('id-1', 'customer-b')
+        ]
+        deadline = Mock()
+        mock_AWSProductEntitlements.return_value.error = {'some': 'error'}
+        # the prefetches and the first record fit into the remaining time
+        deadline.allows.side_effect = [True, True, True, True, False]
+        mock_process_message.side_effect = \
+            lambda record, acknowledge, prefetched, deadline, message: {
+                'itemIdentifier': record['messageId'], 'error': False
+            }
+        record_times.clear()
+        with self._caplog.at_level(logging.ERROR):
+            assert process_records(records, {}, [], deadline) == [
+                {'itemIdentifier': 'id-0', 'error': False},
+                {
+                    'itemIdentifier': 'id-1',
+                    'status': 'Not started, remaining invocation time '
+                    'too short',
+                    'error': True,
+                    'failure': 'transient'
+                }
+            ]
+            assert 'Not started' in self._caplog.text
         mock_process_message.assert_called_once_with(
-            self.record
+            records[0], [], ANY, deadline, ANY
         )
+        assert deadline.allows.call_args_list[4] == call(
+            record_times.p99()
+        )
+        assert mock_AWSProductEntitlements.call_count == 1
+        assert mock_AWSCustomerEntitlement.call_count == 2
+
+        # no time left, nothing is prefetched or started
+        mock_AWSProductEntitlements.reset_mock()
+        mock_AWSCustomerEntitlement.reset_mock()
+        mock_process_message.reset_mock()
+        deadline.allows.side_effect = None
+        deadline.allows.return_value = False
+        with self._caplog.at_level(logging.INFO):
+            results = process_records(
+                records, {'batch_workers': 2}, [], deadline
+            )
+            assert 'Prefetch of entitlements for ' \
+                '7hn1uo40wt6psy10ovxyh4zzn skipped' in self._caplog.text
+            assert 'Prefetch of entitlements for ' \
+                "('customer-a', '7hn1uo40wt6psy10ovxyh4zzn') skipped" in \
+                self._caplog.text
+        assert [result['error'] for result in results] == [True, True]
+        assert not mock_AWSProductEntitlements.called
+        assert not mock_AWSCustomerEntitlement.called
+        assert not mock_process_message.called
+
+    @patch('sqs_event_manager.app.delete_messages')
+    def test_acknowledge_messages(self, mock_delete_messages):
+        mock_delete_messages.return_value = {}
+        results = [{'itemIdentifier': 'id-0', 'error': False}]
+        acknowledge_messages([], results)
+        assert results == [{'itemIdentifier': 'id-0', 'error': False}]
 
-    @patch('sqs_event_manager.app.requests')
+    @patch('sqs_event_manager.app.get_session')
     @patch('sqs_event_manager.app.AWSCustomerEntitlement')
     @patch('sqs_event_manager.app.delete_message')
     @patch('sqs_event_manager.app.Defaults.get_sqs_event_manager_config')
     def test_process_message_500(
         self, mock_get_sqs_event_manager_config, mock_delete_message,
-        mock_AWSCustomerEntitlement, mock_requests
+        mock_AWSCustomerEntitlement, mock_get_session
     ):
         response = Mock()
         response.status_code = 404
         response.text = 'some error'
-        mock_requests.post.return_value = response
+        mock_get_session.return_value.post.return_value = response
         record = self.record
         mock_get_sqs_event_manager_config.return_value = self.config
         entitlements = Mock()
@@ -183,34 +930,49 @@ class TestApp:
         assert process_message(record) == {
             'error': True,
             'itemIdentifier': 'c7b2c992-4f07-478e-bfb8-f577e8310550',
-            'status': 'Event report failed with: 404:some error'
+            'status': 'Event report failed with: 404:some error',
+            'failure': 'permanent',
+            'acknowledged': True
         }
         response.text = ''
         assert process_message(record) == {
             'error': True,
             'itemIdentifier': 'c7b2c992-4f07-478e-bfb8-f577e8310550',
-            'status': 'Event report failed with: 404:no response text'
+            'status': 'Event report failed with: 404:no response text',
+            'failure': 'permanent',
+            'acknowledged': True
         }
+        assert mock_delete_message.call_count == 2
+        # transient failures are left in the queue for redelivery
+        mock_delete_message.reset_mock()
+        response.status_code = 503
+        assert process_message(record) == {
+            'error': True,
+            'itemIdentifier': 'c7b2c992-4f07-478e-bfb8-f577e8310550',
+            'status': 'Event report failed with: 503:no response text',
+            'failure': 'transient'
+        }
+        assert not mock_delete_message.called
 
-    @patch('sqs_event_manager.app.requests')
+    @patch('sqs_event_manager.app.get_session')
     @patch('sqs_event_manager.app.AWSCustomerEntitlement')
     @patch('sqs_event_manager.app.delete_message')
     @patch('sqs_event_manager.app.Defaults.get_sqs_event_manager_config')
     def test_process_message_request_body_and_header(
         self, mock_get_sqs_event_manager_config, mock_delete_message,
-        mock_AWSCustomerEntitlement, mock_requests
+        mock_AWSCustomerEntitlement, mock_get_session
     ):
         response = Mock()
         response.status_code = 200
         response.text = 'some error'
-        mock_requests.post.return_value = response
+        mock_get_session.return_value.post.return_value = response
         record = self.record
         mock_get_sqs_event_manager_config.return_value = self.config
         entitlements = Mock()
         entitlements.error = {}
         mock_AWSCustomerEntitlement.return_value = entitlements
         process_message(record)
-        mock_requests.post.assert_called_once_with(
+        mock_get_session.return_value.post.assert_called_once_with(
             'https://inform-me-of-changes.com',
             json={
                 'customerIdentifier': 'abc123',
@@ -221,21 +983,25 @@ class TestApp:
             headers={
                 'Content-Type': 'application/json',
                 'Authorization': 'Bearer some'
-            }
+            },
+            timeout=(5, 30)
         )
+        mock_get_session.assert_called_once_with(self.config)
 
-    @patch('sqs_event_manager.app.requests')
+    @patch('sqs_event_manager.app.invalidate_entitlements')
+    @patch('sqs_event_manager.app.get_session')
     @patch('sqs_event_manager.app.AWSCustomerEntitlement')
     @patch('sqs_event_manager.app.delete_message')
     @patch('sqs_event_manager.app.Defaults.get_sqs_event_manager_config')
     def test_process_message_handled_maintenance_events(
         self, mock_get_sqs_event_manager_config, mock_delete_message,
-        mock_AWSCustomerEntitlement, mock_requests
+        mock_AWSCustomerEntitlement, mock_get_session,
+        mock_invalidate_entitlements
     ):
         response = Mock()
         response.status_code = 200
         response.text = 'some error'
-        mock_requests.post.return_value = response
+        mock_get_session.return_value.post.return_value = response
         record = self.record
         mock_get_sqs_event_manager_config.return_value = self.config
         entitlements = Mock()
@@ -253,31 +1019,42 @@ class TestApp:
                 'itemIdentifier': 'c7b2c992-4f07-478e-bfb8-f577e8310550',
                 'status': 'Event report succeeded'
             }
+        # subscribe-fail and unsubscribe-pending keep the cache
+        assert mock_invalidate_entitlements.call_count == 2
+        mock_invalidate_entitlements.assert_called_with(
+            'abc123', '7hn1uo40wt6psy10ovxyh4zzn'
+        )
 
+    @patch('sqs_event_manager.app.delete_message')
     @patch('sqs_event_manager.app.Defaults.get_sqs_event_manager_config')
     def test_process_message_unknown_event_category(
-        self, mock_get_sqs_event_manager_config
+        self, mock_get_sqs_event_manager_config, mock_delete_message
     ):
         record = self.record
         mock_get_sqs_event_manager_config.return_value = self.config
         record['body'] = json.dumps(self.subscription_notification)
         with self._caplog.at_level(logging.INFO):
-            process_message(record)
+            result = process_message(record)
             assert 'No action implemented for event type:' in \
                 self._caplog.text
+        assert result['acknowledged'] is True
+        mock_delete_message.assert_called_once_with(
+            record['eventSourceARN'], record['receiptHandle'],
+            self.config.get('client_config')
+        )
 
-    @patch('sqs_event_manager.app.requests')
+    @patch('sqs_event_manager.app.get_session')
     @patch('sqs_event_manager.app.AWSCustomerEntitlement')
     @patch('sqs_event_manager.app.delete_message')
     @patch('sqs_event_manager.app.Defaults.get_sqs_event_manager_config')
     def test_process_message_unknown_action(
         self, mock_get_sqs_event_manager_config, mock_delete_message,
-        mock_AWSCustomerEntitlement, mock_requests
+        mock_AWSCustomerEntitlement, mock_get_session
     ):
         response = Mock()
         response.status_code = 200
         response.text = 'some error'
-        mock_requests.post.return_value = response
+        mock_get_session.return_value.post.return_value = response
         record = self.record
         mock_get_sqs_event_manager_config.return_value = self.config
         entitlements = Mock()
@@ -291,18 +1068,18 @@ class TestApp:
             assert 'Action type fake-event: not implemented' in \
                 self._caplog.text
 
-    @patch('sqs_event_manager.app.requests')
+    @patch('sqs_event_manager.app.get_session')
     @patch('sqs_event_manager.app.AWSCustomerEntitlement')
     @patch('sqs_event_manager.app.delete_message')
     @patch('sqs_event_manager.app.Defaults.get_sqs_event_manager_config')
     def test_process_message_no_event(
         self, mock_get_sqs_event_manager_config, mock_delete_message,
-        mock_AWSCustomerEntitlement, mock_requests
+        mock_AWSCustomerEntitlement, mock_get_session
     ):
         response = Mock()
         response.status_code = 200
         response.text = 'some error'
-        mock_requests.post.return_value = response
+        mock_get_session.return_value.post.return_value = response
         record = self.record
         mock_get_sqs_event_manager_config.return_value = self.config
         entitlements = Mock()
@@ -313,42 +1090,43 @@ class TestApp:
             process_message(record)
             assert 'No action defined in SNS message' in self._caplog.text
 
-    @patch('sqs_event_manager.app.requests')
+    @patch('sqs_event_manager.app.get_session')
     @patch('sqs_event_manager.app.AWSCustomerEntitlement')
     @patch('sqs_event_manager.app.delete_message')
     @patch('sqs_event_manager.app.Defaults.get_sqs_event_manager_config')
     def test_process_message_post_request_raises(
         self, mock_get_sqs_event_manager_config, mock_delete_message,
-        mock_AWSCustomerEntitlement, mock_requests
+        mock_AWSCustomerEntitlement, mock_get_session
     ):
         response = Mock()
         response.status_code = 200
         response.text = 'some error'
-        mock_requests.post.return_value = response
+        mock_get_session.return_value.post.return_value = response
         record = self.record
         mock_get_sqs_event_manager_config.return_value = self.config
         entitlements = Mock()
         entitlements.error = {}
         mock_AWSCustomerEntitlement.return_value = entitlements
-        mock_requests.post.side_effect = Exception('some-error')
+        mock_get_session.return_value.post.side_effect = Exception('some-error')
         with self._caplog.at_level(logging.ERROR):
             process_message(record)
             assert 'some-error' in self._caplog.text
 
     @patch('sqs_event_manager.app.AWSCustomerEntitlement')
     @patch('sqs_event_manager.app.Defaults.get_sqs_event_manager_config')
-    @patch('sqs_event_manager.app.requests')
+    @patch('sqs_event_manager.app.get_session')
     def test_process_message_get_entitlements_error(
-        self, mock_requests, mock_get_sqs_event_manager_config,
+        self, mock_get_session, mock_get_sqs_event_manager_config,
         mock_AWSCustomerEntitlement
     ):
         entitlements = Mock()
-        entitlements.error = Mock()
+        entitlements.error = error_record(400, 'some', 'EntitlementException')
         mock_AWSCustomerEntitlement.return_value = entitlements
 
         assert process_message(self.record) == {
             'error': True,
             'itemIdentifier': 'c7b2c992-4f07-478e-bfb8-f577e8310550',
-            'status': f'AWSCustomerEntitlement failed with {entitlements.error}'
+            'status': f'AWSCustomerEntitlement failed with {entitlements.error}',
+            'failure': 'permanent'
         }
-        assert mock_requests.mock_requests.post.called is False
+        assert mock_get_session.return_value.post.called is False
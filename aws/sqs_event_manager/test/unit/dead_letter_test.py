@@ -0,0 +1,46 @@
+import json
+from unittest.mock import patch
+
+from pytest import raises
+from sqs_event_manager.dead_letter import send_to_dead_letter
+
+
+class TestDeadLetter:
+    def setup_method(self, cls):
+        self.record = {'messageId': 'id-0', 'body': 'no-json'}
+        self.result = {
+            'itemIdentifier': 'id-0', 'error': True, 'failure': 'permanent'
+        }
+
+    def test_send_to_dead_letter_file(self, tmp_path):
+        dead_letter = tmp_path / 'dead_letter.jsonl'
+        config = {'dead_letter': {'file': format(dead_letter)}}
+        send_to_dead_letter(self.record, self.result, config)
+        send_to_dead_letter(self.record, self.result, config)
+        entries = [
+            json.loads(line) for line in dead_letter.read_text().splitlines()
+        ]
+        assert len(entries) == 2
+        assert entries[0]['record'] == self.record
+        assert entries[0]['result'] == self.result
+
+    @patch('sqs_event_manager.dead_letter.send_message')
+    def test_send_to_dead_letter_queue(self, mock_send_message):
+        config = {
+            'dead_letter': {
+                'queue_url': 'http://localhost:9324/000000000000/dead-letter',
+                'endpoint_url': 'http://localhost:9324'
+            }
+        }
+        send_to_dead_letter(self.record, self.result, config)
+        queue_url, body, region, endpoint_url, client_config = \
+            mock_send_message.call_args[0]
+        assert queue_url == 'http://localhost:9324/000000000000/dead-letter'
+        assert json.loads(body)['record'] == self.record
+        assert region == 'us-east-1'
+        assert endpoint_url == 'http://localhost:9324'
+        assert client_config is None
+
+    def test_send_to_dead_letter_not_configured(self):
+        with raises(ValueError):
+            send_to_dead_letter(self.record, self.result, {})
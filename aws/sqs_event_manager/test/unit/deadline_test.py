@@ -0,0 +1,46 @@
+from unittest.mock import (
+    Mock, patch
+)
+
+from sqs_event_manager.deadline import (
+    Deadline, RecordTimes, MIN_TIMEOUT
+)
+
+
+class TestRecordTimes:
+    def setup_method(self, cls):
+        self.record_times = RecordTimes()
+
+    def test_p99(self):
+        assert self.record_times.p99() == 0
+        for seconds in range(1, 101):
+            self.record_times.record(seconds / 100)
+        assert self.record_times.p99() == 0.99
+        self.record_times.clear()
+        self.record_times.record(2)
+        assert self.record_times.p99() == 2
+
+
+class TestDeadline:
+    @patch('sqs_event_manager.deadline.time.monotonic')
+    def test_deadline(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+        context = Mock()
+        context.get_remaining_time_in_millis.return_value = 10000
+        deadline = Deadline.from_context(context, safety_margin=1)
+        assert deadline.remaining() == 9
+        assert deadline.allows(5)
+        assert not deadline.allows(9)
+        assert deadline.timeout(30) == 9
+        assert deadline.timeout(5) == 5
+        mock_monotonic.return_value = 110
+        assert deadline.timeout(5) == MIN_TIMEOUT
+
+    def test_deadline_unlimited(self):
+        for deadline in [
+            Deadline(), Deadline.from_context(Mock()),
+            Deadline.from_context(None)
+        ]:
+            assert deadline.remaining() is None
+            assert deadline.allows(3600)
+            assert deadline.timeout(30) == 30
@@ -1,4 +1,8 @@
-from pytest import fixture
+import json
+from unittest.mock import patch
+from pytest import (
+    fixture, raises
+)
 
 from sqs_event_manager.message import AWSSNSMessage
 
@@ -67,6 +71,7 @@ class TestAWSSNSMessage:
             'eventSourceARN': 'arn:aws:sqs:eu-central-1:12345:ms-testing.fifo',
             'awsRegion': 'eu-central-1'
         }
+        self.record_entitlement = record_entitlement
         self.message = AWSSNSMessage(record_entitlement)
         self.maintenance = AWSSNSMessage(record_maintenance)
 
@@ -93,3 +98,44 @@ class TestAWSSNSMessage:
 
     def test_get_free_trial_term_present(self):
         assert self.maintenance.free_trial_term_present == 'false'
+
+    def test_sns_content_decoded_once(self):
+        with patch('sqs_event_manager.message.json.loads',
+                   wraps=json.loads) as mock_loads:
+            message = AWSSNSMessage(self.record_entitlement)
+            for _ in range(3):
+                assert message.customer_id == 'abc123'
+                assert message.product_code == '7hn1uo40wt6psy10ovxyh4zzn'
+                assert message.action == 'entitlement-updated'
+            assert mock_loads.call_count == 2
+
+    def test_values_with_spaces(self):
+        record = {
+            'body': json.dumps(
+                {
+                    'Type': 'Notification',
+                    'Message': json.dumps(
+                        {'offer-identifier': 'offer with spaces'}
+                    )
+                }
+            )
+        }
+        assert AWSSNSMessage(record).offer_id == 'offer with spaces'
+
+    def test_sns_content_is_dict(self):
+        record = {
+            'body': json.dumps(
+                {
+                    'Type': 'Notification',
+                    'Message': {'isFreeTrialTermPresent': True}
+                }
+            )
+        }
+        message = AWSSNSMessage(record)
+        assert message.free_trial_term_present is True
+        assert message.customer_id == ''
+        assert message.category == 'Notification'
+
+    def test_slots(self):
+        with raises(AttributeError):
+            self.message.some = 'some'
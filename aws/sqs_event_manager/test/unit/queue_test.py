@@ -1,6 +1,11 @@
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock, patch, call
 
-from sqs_event_manager.queue import get_queue_url, delete_message
+from botocore.exceptions import ClientError, EndpointConnectionError
+from sqs_event_manager.queue import (
+    get_queue_url, get_queue_region, delete_message, delete_messages,
+    send_message
+)
+from resolve_customer.client import clear_clients
 
 
 def test_get_queue_url():
@@ -9,8 +14,110 @@ def test_get_queue_url():
     assert url == 'https://sqs.us-east-1.amazonaws.com/111122223333/my-queue'
 
 
+def test_get_queue_region():
+    arn = 'arn:aws:sqs:eu-central-1:111122223333:my-queue'
+    assert get_queue_region(arn) == 'eu-central-1'
+
+
 @patch('boto3.client')
 def test_delete_message(mock_boto_client):
+    clear_clients()
     client = MagicMock()
     mock_boto_client.return_value = client
     delete_message('arn:aws:sqs:us-east-1:111122223333:my-queue', 'r123')
+    assert mock_boto_client.call_args[1]['region_name'] == 'us-east-1'
+    client.delete_message.assert_called_once_with(
+        QueueUrl='https://sqs.us-east-1.amazonaws.com/111122223333/my-queue',
+        ReceiptHandle='r123'
+    )
+
+
+@patch('boto3.client')
+def test_delete_messages(mock_boto_client):
+    clear_clients()
+    us_queue = 'https://sqs.us-east-1.amazonaws.com/111122223333/my-queue'
+    eu_queue = 'https://sqs.eu-central-1.amazonaws.com/111122223333/eu-queue'
+    ap_queue = 'https://sqs.ap-south-1.amazonaws.com/111122223333/ap-queue'
+    clients = {}
+
+    def delete_message_batch(QueueUrl, Entries):
+        if QueueUrl == ap_queue:
+            raise EndpointConnectionError(endpoint_url=QueueUrl)
+        if QueueUrl == eu_queue:
+            raise ClientError(
+                operation_name='DeleteMessageBatch',
+                error_response={
+                    'Error': {'Code': 'AccessDenied', 'Message': 'denied'}
+                }
+            )
+        return {
+            'Successful': [],
+            'Failed': [
+                {'Id': '1', 'Code': 'ReceiptHandleIsInvalid', 'Message': 'bad'}
+            ] if len(Entries) == 2 else []
+        }
+
+    def client(service_name, region_name, **kwargs):
+        sqs = MagicMock()
+        sqs.delete_message_batch.side_effect = delete_message_batch
+        return clients.setdefault(region_name, sqs)
+
+    mock_boto_client.side_effect = client
+    messages = [
+        {
+            'Id': f'id-{index}',
+            'QueueArn': 'arn:aws:sqs:us-east-1:111122223333:my-queue',
+            'ReceiptHandle': f'r{index}'
+        } for index in range(12)
+    ] + [
+        {
+            'Id': 'id-eu',
+            'QueueArn': 'arn:aws:sqs:eu-central-1:111122223333:eu-queue',
+            'ReceiptHandle': 'r-eu'
+        },
+        {
+            'Id': 'id-ap',
+            'QueueArn': 'arn:aws:sqs:ap-south-1:111122223333:ap-queue',
+            'ReceiptHandle': 'r-ap'
+        }
+    ]
+    assert delete_messages([]) == {}
+    failures = delete_messages(messages)
+    assert failures['id-11'] == 'ReceiptHandleIsInvalid: bad'
+    assert failures['id-eu'].startswith('An error occurred (AccessDenied)')
+    # connection problems only fail the messages of their batch
+    assert failures['id-ap'].startswith('Could not connect to the endpoint')
+    assert len(failures) == 3
+    assert clients['us-east-1'].delete_message_batch.call_args_list == [
+        call(
+            QueueUrl=us_queue,
+            Entries=[
+                {'Id': format(index), 'ReceiptHandle': f'r{index}'}
+                for index in range(10)
+            ]
+        ),
+        call(
+            QueueUrl=us_queue,
+            Entries=[
+                {'Id': '0', 'ReceiptHandle': 'r10'},
+                {'Id': '1', 'ReceiptHandle': 'r11'}
+            ]
+        )
+    ]
+
+
+@patch('boto3.client')
+def test_send_message(mock_boto_client):
+    clear_clients()
+    client = MagicMock()
+    mock_boto_client.return_value = client
+    send_message(
+        'http://localhost:9324/000000000000/dead-letter', 'some',
+        'us-east-1', 'http://localhost:9324'
+    )
+    assert mock_boto_client.call_args[1]['endpoint_url'] == \
+        'http://localhost:9324'
+    client.send_message.assert_called_once_with(
+        QueueUrl='http://localhost:9324/000000000000/dead-letter',
+        MessageBody='some'
+    )
@@ -0,0 +1,87 @@
+from unittest.mock import patch, Mock
+
+from requests.exceptions import ConnectionError
+from sqs_event_manager.session import (
+    get_session, get_timeout, warm_up_session, get_retry, deadline_scope
+)
+from sqs_event_manager.deadline import Deadline
+
+
+class TestSession:
+    def test_get_session(self):
+        session = get_session({'batch_workers': 20})
+        assert get_session({'batch_workers': 20}) is session
+        adapter = session.get_adapter('https://inform-me-of-changes.com')
+        assert adapter._pool_maxsize == 20
+        retry = adapter.max_retries
+        assert retry.total == 3
+        assert retry.backoff_factor == 0.5
+        assert 429 in retry.status_forcelist
+        assert 503 in retry.status_forcelist
+        assert retry.allowed_methods is None
+        assert retry.respect_retry_after_header is False
+        other_session = get_session(
+            {'http_pool_size': 5, 'http_retries': 1, 'http_backoff_factor': 1}
+        )
+        assert other_session is not session
+        adapter = other_session.get_adapter('http://localhost')
+        assert adapter._pool_maxsize == 5
+        assert adapter.max_retries.total == 1
+
+    def test_get_retry(self):
+        retry = get_retry(3, 1)
+        response = Mock(status=503)
+        response.get_redirect_location.return_value = None
+        retry = retry.increment('POST', '/', response=response)
+        assert not retry.is_exhausted()
+        # the next attempt must fit into the remaining time
+        with deadline_scope(
+            Deadline(remaining_millis=3000, safety_margin=0), 2
+        ):
+            assert not retry.is_exhausted()
+            with deadline_scope(
+                Deadline(remaining_millis=1000, safety_margin=0), 2
+            ):
+                assert retry.is_exhausted()
+            assert not retry.is_exhausted()
+        # the backoff counts as well
+        retry = retry.increment('POST', '/', response=response)
+        assert retry.get_backoff_time() == 2
+        with deadline_scope(
+            Deadline(remaining_millis=3000, safety_margin=0), 2
+        ):
+            assert retry.is_exhausted()
+        with deadline_scope(None, 2):
+            assert not retry.is_exhausted()
+        assert not retry.is_exhausted()
+        assert retry.new(total=-1).is_exhausted()
+
+    def test_get_timeout(self):
+        assert get_timeout({}) == (5, 30)
+        assert get_timeout(
+            {'http_connect_timeout': 1, 'http_read_timeout': 2}
+        ) == (1, 2)
+        connect_timeout, read_timeout = get_timeout(
+            {}, Deadline(remaining_millis=11000, safety_margin=1)
+        )
+        assert connect_timeout == 5
+        assert read_timeout <= 10
+
+    @patch('requests.Session.head')
+    def test_warm_up_session(self, mock_head):
+        mock_head.side_effect = [
+            ConnectionError('refused'), type('Response', (), {'status_code': 404})
+        ]
+        assert warm_up_session(
+            {
+                'entitlement_change_url': 'https://scc.suse.com/api/change',
+                'subscribe_success_url': 'https://scc.suse.com/api/subscribe',
+                'unsubscribe_success_url': 'http://localhost:8080/unsubscribe',
+                'auth_token': 'https://not-an-url-key',
+                'subscribe_fail_url': None
+            }
+        ) == {
+            'http://localhost:8080/': 'ConnectionError: refused',
+            'https://scc.suse.com/': '404'
+        }
+        assert mock_head.call_count == 2